@@ -0,0 +1,308 @@
+# encoding=utf-8
+# created @2025/5/20
+# created by zhanzq
+#
+# 与模型无关的 Agent 核心：连接 MCP 服务器、维护工具目录、执行"模型回复 -> 并发调用工具 -> 回填结果"的循环。
+# 模型相关的部分都在 backends.py 中，各客户端只负责选择后端和服务器。
+#
+
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from backends import LLMBackend
+from connections import ServerConnection, format_startup_table
+from conversation_store import store_from_env
+from history import SUMMARY_PROMPT, HistoryManager, prompt_messages, render_for_summary
+from postprocess import PostProcessorRegistry, default_registry
+from process_pool import close_pools, open_connection
+from resilience import ServerGuard
+from result_cache import ToolResultCache
+from routing import RoutingTable
+from tool_exec import DEFAULT_TOOL_TIMEOUT, execute_tool_calls
+from tool_index import EmbedFunction, ToolIndex
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# 单次提问中模型连续调用工具的最大轮数
+MAX_TOOL_ROUNDS = 5
+
+
+class Agent:
+    def __init__(self, backend: LLMBackend, prefix_tools: bool = False, tool_timeout: float = DEFAULT_TOOL_TIMEOUT,
+                 result_cache: Optional[ToolResultCache] = None, max_tool_rounds: int = MAX_TOOL_ROUNDS,
+                 postprocess: Optional[PostProcessorRegistry] = None, tool_top_k: int = 0,
+                 tool_embed: Optional[EmbedFunction] = None):
+        """
+        :param backend: 模型后端
+        :param prefix_tools: 是否在工具名前加上服务器ID（不加时同名工具也会自动改用不冲突的别名，见 routing.py）
+        :param tool_timeout: 单个工具调用每次尝试的默认超时时间（秒），服务器配置中的 tool_timeout 优先
+        :param result_cache: 工具结果缓存，为 None 时不缓存
+        :param max_tool_rounds: 单次提问中模型连续调用工具的最大轮数
+        :param postprocess: 工具结果后处理注册表（含结果长度上限），默认使用 postprocess.default_registry
+        :param tool_top_k: 每次提问只提供与问题最相关的前 k 个工具，为 0 时提供全部工具
+        :param tool_embed: 工具检索使用的向量化函数，为 None 时使用 BM25
+        """
+        self.backend = backend
+        self.prefix_tools = prefix_tools
+        self.tool_timeout = tool_timeout
+        self.result_cache = result_cache
+        self.max_tool_rounds = max_tool_rounds
+        self.postprocess = postprocess or default_registry
+        self.connections: Dict[str, ServerConnection] = {}
+        # 每个服务器的调用保护（超时、重试、熔断）
+        self.guards: Dict[str, ServerGuard] = {}
+        # 暴露给模型的工具名 -> (服务器ID, 会话, 原始工具名, 工具)，连接时建立，目录刷新（包括重连后）时按服务器更新
+        self.routes = RoutingTable(prefix=prefix_tools)
+        # 按问题筛选工具用的检索索引，各服务器的工具目录变化时只更新该服务器的部分
+        self.tool_top_k = tool_top_k
+        self.tool_ranker = ToolIndex(embed=tool_embed)
+        self._ranker_versions: Dict[str, int] = {}
+
+    @property
+    def sessions(self) -> dict:
+        return {server_id: connection.session for server_id, connection in self.connections.items()}
+
+    async def add_server(self, server_config: dict) -> ServerConnection:
+        """
+        连接一个 MCP 服务器，配置格式见 ServerConnection
+        :param server_config: 服务器配置字典
+        :return: ServerConnection
+        """
+        server_id = server_config['id']
+        try:
+            # 配置了 warm_pool 的 stdio 服务器从预热进程池中取已就绪的连接
+            connection = await open_connection(server_config)
+        except Exception as e:
+            print(f"连接到服务器 {server_id} 失败: {str(e) or type(e).__name__}")
+            raise
+        self.connections[server_id] = connection
+        self.guards[server_id] = ServerGuard.from_config(server_config, default_timeout=self.tool_timeout)
+        self._track(server_id, connection)
+        print(f"\n已连接到服务器 {server_id}，可用工具:", [tool.name for tool in connection.tool_cache.tools])
+        return connection
+
+    async def connect_all(self, server_configs: List[dict]) -> List[str]:
+        """
+        并发连接多个服务器，每个服务器单独超时，部分服务器连接失败不影响其它服务器
+        :param server_configs: 服务器配置列表
+        :return: 连接成功的服务器ID列表
+        """
+
+        async def connect_one(server_config: dict):
+            start = time.perf_counter()
+            try:
+                connection = await self.add_server(server_config)
+                return server_config['id'], connection.timings, None
+            except asyncio.TimeoutError:
+                return server_config['id'], {"total": time.perf_counter() - start}, "连接超时"
+            except Exception as e:
+                return server_config['id'], {"total": time.perf_counter() - start}, str(e) or type(e).__name__
+
+        rows = await asyncio.gather(*(connect_one(config) for config in server_configs))
+        print("\n服务器启动耗时(秒):")
+        print(format_startup_table(rows))
+        return [server_id for server_id, _, error in rows if error is None]
+
+    def _guard(self, server_id: str) -> ServerGuard:
+        guard = self.guards.get(server_id)
+        if guard is None:
+            guard = self.guards[server_id] = ServerGuard(server_id, timeout=self.tool_timeout)
+        return guard
+
+    def _track(self, server_id: str, connection: ServerConnection):
+        """建立服务器的路由，并在其工具目录刷新后更新"""
+        self.routes.update_server(server_id, connection.healing, connection.tool_cache.tools)
+        connection.tool_cache.add_listener(
+            lambda tools: self.routes.update_server(server_id, connection.healing, tools)
+        )
+
+    def _converter(self, server_id: str):
+        def convert(tool):
+            description = f"[{server_id}] {tool.description}" if self.prefix_tools else None
+            return self.backend.convert_tool(tool, name=self.routes.alias(server_id, tool.name), description=description)
+        return convert
+
+    async def get_tools(self, query: Optional[str] = None) -> List[dict]:
+        """
+        服务器的工具，已转换为当前后端的格式；每个工具只在目录变化时转换一次；熔断中的服务器的工具不提供给模型
+        :param query: 用户的问题，设置了 tool_top_k 时只返回与之最相关的前 k 个工具（没有相关工具时返回全部）
+        :return: List[dict]
+        """
+        catalogs = []
+        for server_id, connection in self.connections.items():
+            if not self._guard(server_id).available:
+                logger.info(f"服务器 {server_id} 熔断中，暂不提供其工具")
+                continue
+            if connection.session is None:
+                logger.info(f"服务器 {server_id} 未连接（正在重连），暂不提供其工具")
+                continue
+            if server_id not in self.routes:
+                # 没有经过 add_server 加入的连接
+                self._track(server_id, connection)
+            try:
+                schemas = await connection.tool_cache.get_schemas(self.backend.name, self._converter(server_id))
+            except Exception as e:
+                # 单个服务器的工具目录刷新失败不影响其它服务器，本轮不提供它的工具
+                logger.warning(f"获取服务器 {server_id} 的工具目录失败: {str(e) or type(e).__name__}，本轮不提供其工具")
+                continue
+            catalogs.append((server_id, connection.tool_cache.version, connection.tool_cache.tools, schemas))
+        if not self.tool_top_k or not query:
+            return [schema for _, _, _, schemas in catalogs for schema in schemas]
+
+        for server_id, version, tools, _ in catalogs:
+            if self._ranker_versions.get(server_id) != version:
+                await self.tool_ranker.aupdate_server(server_id, [(self.routes.alias(server_id, tool.name), tool)
+                                                                  for tool in tools])
+                self._ranker_versions[server_id] = version
+        with tracer.span("tools.select", top_k=self.tool_top_k) as span:
+            offered = [(self.routes.alias(server_id, tool.name), schema)
+                       for server_id, _, server_tools, schemas in catalogs
+                       for tool, schema in zip(server_tools, schemas)]
+            # 索引中可能还有熔断中的服务器的工具，排序后跳过
+            names = {name for name, _ in offered}
+            ranked = [name for name in await self.tool_ranker.asearch(query, len(self.tool_ranker)) if name in names]
+            selected = set(ranked[:self.tool_top_k])
+            tools = [schema for name, schema in offered if not selected or name in selected]
+            span.set(candidates=len(self.tool_ranker), selected=len(tools))
+        return tools
+
+    def resolve_tool(self, name: str):
+        """根据暴露给模型的工具名，返回 (服务器ID, 会话, 原始工具名)；会话在连接断开后自动重连"""
+        route = self.routes.get(name)
+        if route is None:
+            raise KeyError(f"未知的工具: {name}")
+        return route.server_id, route.session, route.name
+
+    def tool_schema(self, name: str) -> Optional[dict]:
+        """暴露给模型的工具名对应的 inputSchema"""
+        route = self.routes.get(name)
+        return route.schema if route is not None else None
+
+    def tool_guard(self, name: str):
+        """暴露给模型的工具名对应的 (服务器的调用保护, 是否可以重试)"""
+        route = self.routes.get(name)
+        if route is None:
+            raise KeyError(f"未知的工具: {name}")
+        guard = self._guard(route.server_id)
+        return guard, guard.can_retry(route.tool)
+
+    async def process_query(self, query: str, history_messages) -> str:
+        """处理查询，返回完整回复"""
+        return "".join([text async for text in self.stream_query(query, history_messages)])
+
+    async def stream_query(self, query: str, history_messages):
+        """流式处理查询，逐个产出回复的文本片段"""
+        with tracer.span("query", query_chars=len(query), backend=self.backend.name) as span:
+            history_messages.append(self.backend.user_message(query))
+            # 首次请求，之后每轮工具调用只做一次后续请求
+            for tool_round in range(self.max_tool_rounds + 1):
+                # 每轮重新获取（已缓存），上一轮中熔断的服务器的工具不再提供
+                tools = await self.get_tools(query)
+                turn = self.backend.stream(
+                    prompt_messages(history_messages),
+                    tools,
+                    span_name="llm.followup" if tool_round else "llm.initial"
+                )
+                async for text in turn:
+                    yield text
+                calls = turn.calls
+                if not calls:
+                    break
+                if tool_round == self.max_tool_rounds:
+                    # 剩余的工具调用不再执行，final_message 会去掉这些调用，保证历史记录中的调用都有结果
+                    logger.warning(f"已达到工具调用轮数上限 {self.max_tool_rounds}，忽略 {len(calls)} 个未执行的工具调用")
+                    break
+
+                if turn.text:
+                    yield "\n"
+                # 同一轮的工具调用（可跨服务器）并发执行，每个调用单独超时，结果按调用ID回填
+                results = await execute_tool_calls(
+                    calls,
+                    resolve=self.resolve_tool,
+                    cache=self.result_cache,
+                    schema_of=self.tool_schema,
+                    guard_of=self.tool_guard,
+                    postprocess=self.postprocess
+                )
+                for result in results:
+                    if result["error"] is None:
+                        yield f"[Calling tool {result['name']} with args {result['args']}]\n"
+                    else:
+                        yield f"[Error calling tool {result['name']}: {result['error']}]\n"
+                history_messages.extend(self.backend.tool_messages(turn, results))
+
+            span.set(tool_rounds=tool_round)
+            history_messages.append(self.backend.final_message(turn))
+
+    async def summarize_history(self, messages: list, previous_summary: str) -> str:
+        """调用模型把较早的历史记录压缩成摘要"""
+        content = render_for_summary(messages)
+        if previous_summary:
+            content = f"已有摘要：\n{previous_summary}\n\n新的对话：\n{content}"
+        return await self.backend.complete(SUMMARY_PROMPT, content)
+
+    async def chat_loop(self, conversation_id: str = "default"):
+        """
+        Run an interactive chat loop
+        :param conversation_id: 配置了会话存储（MCP_CONVERSATION_STORE）时恢复和保存的会话ID
+        """
+        print("\nMCP客户端已启动！")
+        print("输入你的问题或输入'quit'退出。")
+        print("示例查询: '查询北京的天气'")
+
+        # 带token预算的历史记录，较早的轮次在后台合并成摘要；配置了存储时从上次的会话继续
+        store = store_from_env()
+        history_messages = None
+        if store is not None:
+            history_messages = HistoryManager.load(store, conversation_id, self.backend.model,
+                                                   summarizer=self.summarize_history)
+            if history_messages is not None:
+                print(f"已恢复会话 {conversation_id} 最近的 {len(history_messages)} 条消息")
+        if history_messages is None:
+            history_messages = HistoryManager(self.backend.model, summarizer=self.summarize_history,
+                                              store=store, conversation_id=conversation_id)
+        while True:
+            try:
+                query = input("\n问题: ").strip()
+
+                if query.lower() in ['quit', '退出', 'exit', 'q']:
+                    break
+
+                if not query:
+                    continue
+
+                print("\n正在处理你的请求，请稍候...\n")
+                async for text in self.stream_query(query, history_messages=history_messages):
+                    print(text, end="", flush=True)
+                print()
+                history_messages.end_turn()
+                logger.info(f"历史记录统计: {history_messages.stats()}")
+
+            except KeyboardInterrupt:
+                print("\n收到中断信号，正在退出...")
+                break
+            except Exception as e:
+                print(f"\n错误: {str(e)}")
+                import traceback
+                traceback.print_exc()
+        if store is not None:
+            await history_messages.wait_summary()
+            store.close()
+
+    async def cleanup(self):
+        """关闭所有连接和模型客户端"""
+        for server_id, connection in self.connections.items():
+            logger.info(f"服务器 {server_id} 工具目录缓存统计: {connection.tool_cache.stats()}")
+            logger.info(f"服务器 {server_id} 调用统计: {self._guard(server_id).stats()}")
+            logger.info(f"服务器 {server_id} 连接统计: {connection.stats()}")
+        if self.result_cache is not None:
+            logger.info(f"工具结果缓存统计: {self.result_cache.stats()}")
+        await asyncio.gather(*(connection.close() for connection in self.connections.values()))
+        # 预热进程池（warm_pool）的监控任务和空闲进程，同时输出进程池统计
+        await close_pools()
+        await self.backend.close()
+        # 输出并关闭追踪导出器（MCP_TRACE 未设置时为空操作）
+        tracer.shutdown()
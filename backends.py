@@ -0,0 +1,339 @@
+# encoding=utf-8
+# created @2025/5/20
+# created by zhanzq
+#
+# 模型后端适配层。Agent 只依赖这里的统一接口：
+#   stream()        流式请求，迭代产出文本，结束后 .text 与 .calls=[(id, 工具名, 参数)] 可用
+#   convert_tool()  MCP 工具 -> 该后端的工具 schema（由 ToolCatalogCache 按后端缓存，每个工具只转换一次）
+#   *_message()     按该后端的格式构造历史消息
+#
+
+import asyncio
+import json
+import os
+import time
+from typing import List, Optional
+
+from schema_convert import anthropic_tool, openai_tool
+from streaming import AnthropicStream, OpenAIStream, log_timing, request_stats
+from tracing import tracer
+
+
+class LLMBackend:
+    """模型后端接口"""
+
+    # 工具 schema 缓存所用的格式名
+    name = "base"
+
+    def __init__(self, model: str):
+        self.model = model
+
+    def convert_tool(self, tool, name: Optional[str] = None, description: Optional[str] = None) -> dict:
+        """
+        把 MCP 工具转换为该后端的工具 schema
+        :param tool: mcp.types.Tool
+        :param name: 暴露给模型的工具名，默认为原名
+        :param description: 暴露给模型的描述，默认为原描述
+        :return: dict
+        """
+        raise NotImplementedError
+
+    def stream(self, messages: List[dict], tools: List[dict], span_name: str = "llm.completion"):
+        """
+        发起一次流式请求
+        :return: 可异步迭代的对象，迭代结束后提供 text 和 tool_calls
+        """
+        raise NotImplementedError
+
+    def user_message(self, query: str) -> dict:
+        return {"role": "user", "content": query}
+
+    def tool_messages(self, turn, results: List[dict]) -> List[dict]:
+        """模型的工具调用及其结果，按该后端的格式追加到历史记录"""
+        raise NotImplementedError
+
+    def final_message(self, turn) -> dict:
+        raise NotImplementedError
+
+    async def complete(self, system: str, content: str) -> str:
+        """非流式的单轮请求，用于历史摘要等"""
+        raise NotImplementedError
+
+    def sampling_params(self) -> dict:
+        """影响回复内容的采样参数，作为回复缓存键的一部分"""
+        return {}
+
+    async def close(self):
+        pass
+
+
+class _OpenAITurn(OpenAIStream):
+    @property
+    def text(self) -> str:
+        return self.content
+
+    @property
+    def calls(self) -> list:
+        return [(it["id"], it["function"]["name"], it["function"]["arguments"]) for it in self.tool_calls]
+
+
+class OpenAIBackend(LLMBackend):
+    """OpenAI 兼容接口（Qwen/ollama 等）"""
+
+    name = "openai"
+
+    def __init__(self, model: str = "qwen2.5", api_key: Optional[str] = None,
+                 base_url: str = "http://localhost:11434/v1", temperature: float = 0.2, llm=None):
+        """
+        :param model: 模型名
+        :param api_key: 接口密钥，ollama 不校验
+        :param base_url: 接口地址
+        :param temperature: 采样温度
+        :param llm: 已创建的 AsyncOpenAI 客户端，为 None 时创建带连接池的客户端
+        """
+        super().__init__(model)
+        self.temperature = temperature
+        if llm is None:
+            from llm_clients import create_async_openai
+            llm = create_async_openai(api_key=api_key or os.environ.get("OPENAI_API_KEY", "hello"), base_url=base_url)
+        self.llm = llm
+
+    def convert_tool(self, tool, name: Optional[str] = None, description: Optional[str] = None) -> dict:
+        return openai_tool(tool, name=name, description=description)
+
+    def sampling_params(self) -> dict:
+        return {"temperature": self.temperature}
+
+    def stream(self, messages: List[dict], tools: List[dict], span_name: str = "llm.completion"):
+        kwargs = {"tools": tools, "tool_choice": "auto"} if tools else {}
+        return _OpenAITurn(self.llm, span_name=span_name, model=self.model, messages=messages,
+                           temperature=self.temperature, **kwargs)
+
+    def tool_messages(self, turn, results: List[dict]) -> List[dict]:
+        messages = [{
+            "role": "assistant",
+            "content": turn.text or None,
+            "tool_calls": turn.tool_calls
+        }]
+        for result in results:
+            messages.append({
+                "role": "tool",
+                "tool_call_id": result["id"],
+                "content": result["content"]
+            })
+        return messages
+
+    def final_message(self, turn) -> dict:
+        return {"role": "assistant", "content": turn.text}
+
+    async def complete(self, system: str, content: str) -> str:
+        response = await self.llm.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": content}
+            ],
+            temperature=self.temperature
+        )
+        return response.choices[0].message.content
+
+    async def close(self):
+        await self.llm.close()
+
+
+class _AnthropicTurn(AnthropicStream):
+    @property
+    def calls(self) -> list:
+        return [(block["id"], block["name"], block["input"]) for block in self.tool_uses]
+
+
+def _non_empty(blocks: List[dict]) -> List[dict]:
+    """去掉空的文本块，Anthropic 不接受 text 为空的内容块"""
+    return [block for block in blocks if block["type"] != "text" or block.get("text")]
+
+
+class AnthropicBackend(LLMBackend):
+    """Anthropic Claude"""
+
+    name = "anthropic"
+
+    def __init__(self, model: str = "claude-3-5-sonnet-20241022", api_key: Optional[str] = None,
+                 max_tokens: int = 1000, anthropic=None):
+        """
+        :param model: 模型名
+        :param api_key: 接口密钥，默认读取 ANTHROPIC_API_KEY
+        :param max_tokens: 单次回复的最大 token 数
+        :param anthropic: 已创建的 AsyncAnthropic 客户端，为 None 时创建带连接池的客户端
+        """
+        super().__init__(model)
+        self.max_tokens = max_tokens
+        if anthropic is None:
+            from llm_clients import create_async_anthropic
+            api_key = api_key or os.environ.get("ANTHROPIC_API_KEY")
+            if not api_key:
+                raise ValueError("必须提供Anthropic API密钥（ANTHROPIC_API_KEY）")
+            anthropic = create_async_anthropic(api_key=api_key)
+        self.anthropic = anthropic
+
+    def convert_tool(self, tool, name: Optional[str] = None, description: Optional[str] = None) -> dict:
+        return anthropic_tool(tool, name=name, description=description)
+
+    def sampling_params(self) -> dict:
+        return {"max_tokens": self.max_tokens}
+
+    def stream(self, messages: List[dict], tools: List[dict], span_name: str = "llm.completion"):
+        kwargs = {"tools": tools} if tools else {}
+        return _AnthropicTurn(self.anthropic, span_name=span_name, model=self.model, max_tokens=self.max_tokens,
+                              messages=messages, **kwargs)
+
+    def tool_messages(self, turn, results: List[dict]) -> List[dict]:
+        # tool_result 以 user 角色回填，按 tool_use_id 对应
+        return [
+            {"role": "assistant", "content": _non_empty(turn.content_blocks)},
+            {"role": "user", "content": [{
+                "type": "tool_result",
+                "tool_use_id": result["id"],
+                "content": result["content"],
+                "is_error": result["error"] is not None
+            } for result in results]}
+        ]
+
+    def final_message(self, turn) -> dict:
+        # 达到工具调用轮数上限时回复中还有未执行的 tool_use，没有对应的 tool_result 会使该会话之后的请求都被拒绝（400），
+        # 因此只保留文本块
+        blocks = [block for block in _non_empty(turn.content_blocks) if block["type"] != "tool_use"]
+        if turn.tool_uses and not blocks:
+            blocks = [{"type": "text", "text": "（已达到工具调用轮数上限，未执行剩余的工具调用）"}]
+        return {"role": "assistant", "content": blocks}
+
+    async def complete(self, system: str, content: str) -> str:
+        response = await self.anthropic.messages.create(
+            model=self.model,
+            max_tokens=self.max_tokens,
+            system=system,
+            messages=[{"role": "user", "content": content}]
+        )
+        return response.content[0].text
+
+    async def close(self):
+        await self.anthropic.close()
+
+
+class _MockTurn:
+    """MockBackend 的一次回复，接口与 _OpenAITurn 相同"""
+
+    def __init__(self, backend: "MockBackend", messages: List[dict], tools: List[dict], span_name: str):
+        self.backend = backend
+        self.messages = messages
+        self.tools = tools
+        self.span_name = span_name
+        self.content = ""
+        self.tool_calls: List[dict] = []
+        self.finish_reason: Optional[str] = None
+        self.ttft: Optional[float] = None
+        self.elapsed: Optional[float] = None
+
+    @property
+    def text(self) -> str:
+        return self.content
+
+    @property
+    def calls(self) -> list:
+        return [(it["id"], it["function"]["name"], it["function"]["arguments"]) for it in self.tool_calls]
+
+    async def __aiter__(self):
+        with tracer.span(self.span_name, model=self.backend.model) as span:
+            start = time.perf_counter()
+            await asyncio.sleep(self.backend.latency)
+            self.backend.requests += 1
+            self.content, self.tool_calls = self.backend.respond(self.messages, self.tools)
+            self.finish_reason = "tool_calls" if self.tool_calls else "stop"
+            self.ttft = time.perf_counter() - start
+            for char in self.content:
+                if self.backend.token_interval:
+                    await asyncio.sleep(self.backend.token_interval)
+                yield char
+            self.elapsed = time.perf_counter() - start
+            log_timing(self.backend.model, self.ttft, self.elapsed)
+            if span.recording:
+                span.set(**request_stats({"messages": self.messages, "tools": self.tools}),
+                         ttft_ms=self.ttft * 1000, output_chars=len(self.content), tool_calls=len(self.tool_calls))
+
+
+class MockBackend(OpenAIBackend):
+    """
+    本地确定性后端，不需要模型服务，用于测试和在不同后端之间对比 Agent 本身的开销。
+    使用 OpenAI 的消息格式；规则：用户提问后，如果有可用工具，就调用第一个工具（字符串参数都填入提问内容），
+    收到工具结果后回复工具结果，否则复述提问。
+    """
+
+    name = "mock"
+
+    def __init__(self, model: str = "mock", latency: float = 0.0, token_interval: float = 0.0,
+                 use_tools: bool = True):
+        """
+        :param model: 模型名，只用于日志和历史预算
+        :param latency: 每次请求的模拟首 token 延迟（秒）
+        :param token_interval: 相邻字符的输出间隔（秒）
+        :param use_tools: 是否调用工具
+        """
+        LLMBackend.__init__(self, model)
+        self.temperature = 0.0
+        self.latency = latency
+        self.token_interval = token_interval
+        self.use_tools = use_tools
+        self.requests = 0
+        self._call_ids = 0
+
+    def respond(self, messages: List[dict], tools: List[dict]):
+        """根据历史记录生成 (回复文本, tool_calls)"""
+        last = messages[-1] if messages else {"role": "user", "content": ""}
+        if last.get("role") == "tool":
+            results = []
+            for message in reversed(messages):
+                if message.get("role") != "tool":
+                    break
+                results.insert(0, message["content"])
+            return "工具返回: " + "；".join(results), []
+        query = last.get("content") or ""
+        if not (self.use_tools and tools):
+            return f"已收到: {query}", []
+        function = tools[0]["function"]
+        properties = (function.get("parameters") or {}).get("properties") or {}
+        arguments = {k: query for k, v in properties.items() if v.get("type", "string") == "string"}
+        self._call_ids += 1
+        return "", [{
+            "id": f"call_{self._call_ids}",
+            "type": "function",
+            "function": {"name": function["name"], "arguments": json.dumps(arguments, ensure_ascii=False)}
+        }]
+
+    def stream(self, messages: List[dict], tools: List[dict], span_name: str = "llm.completion"):
+        return _MockTurn(self, messages, tools, span_name)
+
+    async def complete(self, system: str, content: str) -> str:
+        await asyncio.sleep(self.latency)
+        self.requests += 1
+        return content[:300]
+
+    async def close(self):
+        pass
+
+
+BACKENDS = {
+    "openai": OpenAIBackend,
+    "anthropic": AnthropicBackend,
+    "mock": MockBackend,
+}
+
+
+def create_backend(name: str, **kwargs) -> LLMBackend:
+    """
+    按名称创建后端
+    :param name: openai、anthropic 或 mock
+    :param kwargs: 传给后端构造函数的参数
+    :return: LLMBackend
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"未知的模型后端: {name}，可选 {', '.join(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
@@ -0,0 +1,205 @@
+# encoding=utf-8
+# created @2025/5/19
+# created by zhanzq
+#
+# 离线批量运行查询（回归集、每日评测等）：
+#   python batch.py --backend openai --server servers/weather_server.py --input queries.jsonl --output results.jsonl
+#   加上 --llm-cache record 记录模型回复，之后用 --llm-cache replay 重跑时不需要模型服务
+#
+# 输入每行一个 JSON：{"id": "q1", "query": "北京明天天气"} 或 {"id": "c1", "conversation": ["问题1", "问题2"]}，
+# 也可以直接是一个字符串。结果按完成顺序逐行写入输出文件，输出文件同时作为断点：
+# 重新运行相同命令时会跳过已完成的条目（--retry-failed 时重新运行失败的条目）。
+#
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable, List, Set
+
+from agent import Agent
+from backends import BACKENDS, create_backend
+from completion_cache import DEFAULT_DB_PATH, MODES, CachedBackend, CompletionCache, cached_backend_from_env
+from connections import TRANSPORTS, config_from_target
+from metrics import LatencyRecorder
+from result_cache import ToolResultCache
+from tracing import configure_from_env, tracer
+
+logger = logging.getLogger(__name__)
+
+
+def load_items(path: str) -> List[dict]:
+    """
+    读取输入文件，统一成 {"id", "queries"} 的形式
+    :param path: JSONL 文件路径
+    :return: list
+    """
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"query": record}
+            if "conversation" in record:
+                queries = list(record["conversation"])
+            elif "query" in record:
+                queries = [record["query"]]
+            else:
+                raise ValueError(f"{path} 第 {line_no} 行缺少 query 或 conversation 字段")
+            items.append({"id": str(record.get("id", line_no)), "queries": queries})
+    return items
+
+
+def read_checkpoint(path: str, retry_failed: bool = False) -> Set[str]:
+    """
+    读取已有的输出文件，返回已完成条目的 id；崩溃时写了一半的最后一行会被截掉
+    :param path: 输出文件路径
+    :param retry_failed: 为 True 时失败的条目不算完成
+    :return: set
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    valid_size = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            valid_size += len(line)
+            if not (retry_failed and record.get("error")):
+                done.add(record["id"])
+    if valid_size < os.path.getsize(path):
+        logger.warning(f"输出文件 {path} 末尾有不完整的记录，已截断")
+        with open(path, "r+b") as f:
+            f.truncate(valid_size)
+    return done
+
+
+async def run_batch(process_query: Callable[..., Awaitable[str]], items: List[dict], output_path: str,
+                    concurrency: int = 8, resume: bool = True, retry_failed: bool = False) -> dict:
+    """
+    并发运行一批查询，结果逐条追加写入 JSONL
+    :param process_query: 客户端的 process_query 方法，所有条目共用同一个客户端（及其 MCP 会话）
+    :param items: load_items 的返回值
+    :param output_path: 输出文件路径，同时作为断点
+    :param concurrency: 同时处理的条目数上限
+    :param resume: 是否跳过输出文件中已完成的条目
+    :param retry_failed: 断点续跑时是否重新运行失败的条目
+    :return: 汇总统计
+    """
+    done = read_checkpoint(output_path, retry_failed) if resume else set()
+    pending = [item for item in items if item["id"] not in done]
+    logger.info(f"共 {len(items)} 条，已完成 {len(items) - len(pending)} 条，本次运行 {len(pending)} 条")
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in pending:
+        queue.put_nowait(item)
+    latencies = LatencyRecorder()
+    failed = 0
+    start = time.perf_counter()
+
+    with open(output_path, "a" if resume else "w", encoding="utf-8") as out:
+
+        async def run_item(item: dict) -> dict:
+            history_messages = []
+            turns = []
+            error = None
+            item_start = time.perf_counter()
+            with tracer.span("batch_item", id=item["id"], turns=len(item["queries"])):
+                for query in item["queries"]:
+                    turn_start = time.perf_counter()
+                    try:
+                        answer = await process_query(query, history_messages=history_messages)
+                    except Exception as e:
+                        error = str(e) or type(e).__name__
+                        turns.append({"query": query, "answer": None, "elapsed": time.perf_counter() - turn_start})
+                        break
+                    turns.append({"query": query, "answer": answer, "elapsed": time.perf_counter() - turn_start})
+            return {
+                "id": item["id"],
+                "turns": turns,
+                "elapsed": time.perf_counter() - item_start,
+                "finished_at": time.time(),
+                "error": error,
+            }
+
+        async def worker():
+            nonlocal failed
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                record = await run_item(item)
+                latencies.record(record["elapsed"])
+                if record["error"]:
+                    failed += 1
+                    logger.error(f"条目 {item['id']} 失败: {record['error']}")
+                # 整行一次写入并立即刷新，崩溃时最多丢失正在处理的条目
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                completed = latencies.count
+                if completed % 100 == 0:
+                    logger.info(f"进度 {completed}/{len(pending)}，失败 {failed}")
+
+        await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, len(pending))))))
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "total": len(items),
+        "skipped": len(items) - len(pending),
+        "completed": latencies.count,
+        "failed": failed,
+        "elapsed": elapsed,
+        "throughput": latencies.count / elapsed if elapsed > 0 else 0.0,
+        **{f"latency_{k}": v for k, v in latencies.summary().items() if k != "count"},
+    }
+    return summary
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="批量运行查询")
+    parser.add_argument("--backend", choices=list(BACKENDS), default="openai", help="模型后端，mock 不需要模型服务")
+    parser.add_argument("--model", default=None, help="模型名，默认使用后端的默认模型")
+    parser.add_argument("--server", required=True, help="MCP 服务器脚本路径或地址")
+    parser.add_argument("--transport", choices=list(TRANSPORTS) + ["auto"], default=None,
+                        help="传输方式，默认按 --server 判断（脚本用 stdio，地址按路径判断）")
+    parser.add_argument("--input", required=True, help="输入 JSONL 文件")
+    parser.add_argument("--output", required=True, help="输出 JSONL 文件（同时作为断点）")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时处理的条目数")
+    parser.add_argument("--no-resume", action="store_true", help="忽略已有的输出文件，从头运行")
+    parser.add_argument("--retry-failed", action="store_true", help="断点续跑时重新运行失败的条目")
+    parser.add_argument("--llm-cache", choices=MODES, default=None,
+                        help="模型回复缓存模式，默认读取环境变量 MCP_LLM_CACHE（未设置时不缓存）")
+    parser.add_argument("--llm-cache-path", default=DEFAULT_DB_PATH, help="模型回复缓存文件")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    configure_from_env()
+    backend = create_backend(args.backend, **({"model": args.model} if args.model else {}))
+    if args.llm_cache:
+        backend = CachedBackend(backend, CompletionCache(args.llm_cache_path, mode=args.llm_cache))
+    else:
+        backend = cached_backend_from_env(backend)
+    client = Agent(backend, result_cache=ToolResultCache.from_config())
+    try:
+        await client.add_server(config_from_target(args.server, args.transport))
+        summary = await run_batch(client.process_query, load_items(args.input), args.output,
+                                  concurrency=args.concurrency, resume=not args.no_resume,
+                                  retry_failed=args.retry_failed)
+        print(json.dumps(summary, indent=4, ensure_ascii=False))
+    finally:
+        await client.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
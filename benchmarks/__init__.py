@@ -0,0 +1,4 @@
+# encoding=utf-8
+# created @2025/5/7
+# created by zhanzq
+#
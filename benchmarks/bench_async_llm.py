@@ -0,0 +1,83 @@
+# encoding=utf-8
+# created @2025/5/7
+# created by zhanzq
+#
+# 对比同步 OpenAI 客户端与异步连接池客户端在多会话并发下的总耗时：
+#   python benchmarks/bench_async_llm.py --conversations 16 --turns 3 --latency 0.3
+#
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import OpenAI
+
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from llm_clients import create_async_openai, run_conversations
+
+
+class SyncLLMClient:
+    """旧实现：在 async 方法中调用同步客户端，模型调用期间阻塞事件循环"""
+
+    def __init__(self, base_url: str):
+        self.llm = OpenAI(api_key="hello", base_url=base_url)
+
+    async def process_query(self, query: str, history_messages) -> str:
+        history_messages.append({"role": "user", "content": query})
+        response = self.llm.chat.completions.create(model="qwen2.5", messages=history_messages)
+        content = response.choices[0].message.content
+        history_messages.append({"role": "assistant", "content": content})
+        return content
+
+
+class AsyncLLMClient:
+    """新实现：AsyncOpenAI + 共享连接池"""
+
+    def __init__(self, base_url: str):
+        self.llm = create_async_openai(api_key="hello", base_url=base_url)
+
+    async def process_query(self, query: str, history_messages) -> str:
+        history_messages.append({"role": "user", "content": query})
+        response = await self.llm.chat.completions.create(model="qwen2.5", messages=history_messages)
+        content = response.choices[0].message.content
+        history_messages.append({"role": "assistant", "content": content})
+        return content
+
+
+async def run_case(name: str, client, conversations, concurrency: int) -> float:
+    start = time.perf_counter()
+    await run_conversations(client.process_query, conversations, concurrency=concurrency)
+    elapsed = time.perf_counter() - start
+    turns = sum(len(c) for c in conversations)
+    print(f"{name:<8} 耗时 {elapsed:8.3f}s  吞吐 {turns / elapsed:8.2f} 轮/秒")
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="同步/异步 LLM 客户端并发基准测试")
+    parser.add_argument("--conversations", type=int, default=16, help="会话数")
+    parser.add_argument("--turns", type=int, default=3, help="每个会话的轮数")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时进行的会话数")
+    parser.add_argument("--latency", type=float, default=0.3, help="模拟模型延迟（秒）")
+    args = parser.parse_args()
+
+    # 模拟服务运行在独立线程中，同步客户端阻塞当前事件循环时它仍能响应
+    server = FakeOpenAIServer(port=0, latency=args.latency).start_in_thread()
+    conversations = [[f"会话{i}的第{j}个问题" for j in range(args.turns)] for i in range(args.conversations)]
+    print(f"模拟服务: {server.base_url}，{args.conversations} 个会话 x {args.turns} 轮，"
+          f"并发 {args.concurrency}，模型延迟 {args.latency}s")
+
+    sync_elapsed = await run_case("sync", SyncLLMClient(server.base_url), conversations, args.concurrency)
+    async_client = AsyncLLMClient(server.base_url)
+    async_elapsed = await run_case("async", async_client, conversations, args.concurrency)
+    await async_client.llm.close()
+
+    print(f"加速比: {sync_elapsed / async_elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
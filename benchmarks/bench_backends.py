@@ -0,0 +1,83 @@
+# encoding=utf-8
+# created @2025/5/20
+# created by zhanzq
+#
+# 用同一个 Agent 循环对比不同模型后端的端到端耗时（openai 后端连接本地模拟服务，不需要真实模型）：
+#   python benchmarks/bench_backends.py --backends mock,openai --conversations 32 --turns 3
+#   python benchmarks/bench_backends.py --backends mock --server servers/weather_server.py   # 带工具调用
+#
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent import Agent
+from backends import create_backend
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from connections import TRANSPORTS, config_from_target
+from metrics import LatencyRecorder
+
+
+async def run_backend(name: str, args, base_url: str) -> dict:
+    if name == "openai":
+        backend = create_backend("openai", base_url=base_url)
+    elif name == "mock":
+        backend = create_backend("mock", latency=args.latency, token_interval=args.token_interval)
+    else:
+        backend = create_backend(name)
+    agent = Agent(backend)
+    if args.server:
+        await agent.add_server(config_from_target(args.server, args.transport))
+
+    latencies = LatencyRecorder()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run_conversation(idx: int):
+        async with semaphore:
+            history_messages = []
+            for turn in range(args.turns):
+                start = time.perf_counter()
+                await agent.process_query(f"会话{idx}的第{turn}个问题", history_messages)
+                latencies.record(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(run_conversation(i) for i in range(args.conversations)))
+    finally:
+        elapsed = time.perf_counter() - start
+        await agent.cleanup()
+    return {"backend": name, "elapsed": elapsed, "throughput": latencies.count / elapsed, **latencies.summary()}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="不同模型后端的 Agent 端到端基准测试")
+    parser.add_argument("--backends", default="mock,openai", help="逗号分隔的后端列表")
+    parser.add_argument("--conversations", type=int, default=32, help="会话数")
+    parser.add_argument("--turns", type=int, default=3, help="每个会话的轮数")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时进行的会话数")
+    parser.add_argument("--latency", type=float, default=0.1, help="模拟模型的首 token 延迟（秒）")
+    parser.add_argument("--token-interval", type=float, default=0.0, help="模拟模型相邻 token 的间隔（秒）")
+    parser.add_argument("--server", default=None, help="连接的 MCP 服务器脚本或地址，不指定时不使用工具")
+    parser.add_argument("--transport", choices=list(TRANSPORTS) + ["auto"], default=None,
+                        help="传输方式，默认按 --server 判断")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(port=0, latency=args.latency, token_interval=args.token_interval).start_in_thread()
+    rows = []
+    for name in filter(None, (part.strip() for part in args.backends.split(","))):
+        rows.append(await run_backend(name, args, server.base_url))
+
+    header = f"{'backend':<12}{'turns':>8}{'elapsed':>10}{'turns/s':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['backend']:<12}{row['count']:>8}{row['elapsed']:>10.2f}{row['throughput']:>10.1f}" + "".join(
+            f"{row[key] * 1000:>10.1f}" for key in ("p50", "p90", "p99", "max")))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,184 @@
+# encoding=utf-8
+# created @2025/5/28
+# created by zhanzq
+#
+# 网关压测：网关进程固定在一个 CPU 核上，模拟模型用 MockBackend（固定延迟 + 逐字输出），
+# 逐级增加同时在线的会话数，每个会话按 "提问 -> 读完 SSE 回复 -> 思考时间" 循环，
+# 输出每一级的吞吐、首字节与整轮耗时分位数、503 拒绝数和网关进程的 CPU 占用。
+#   python benchmarks/bench_gateway.py --levels 50,100,200,400,800 --duration 10 --latency 0.5
+#
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import LatencyRecorder
+
+QUERIES = ["查询北京明天的天气", "上海今天会下雨吗", "广州后天的最高气温是多少", "深圳这周末适合出门吗"]
+
+
+async def serve(args):
+    """子进程：运行网关"""
+    from agent import Agent
+    from backends import MockBackend
+    from connections import config_from_target
+    from gateway import AdmissionController, Gateway
+
+    agent = Agent(MockBackend(latency=args.latency, token_interval=args.token_interval))
+    if args.server:
+        await agent.add_server(config_from_target(args.server))
+    admission = AdmissionController(max_active=args.max_active, max_queue=args.max_queue,
+                                    queue_timeout=args.queue_timeout, target_latency=args.target_latency)
+    gateway = Gateway(agent, admission)
+    await gateway.start("127.0.0.1", args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await gateway.close()
+        await agent.cleanup()
+
+
+async def request(port: int, method: str, path: str, payload: Optional[dict] = None):
+    """发送一个请求（Connection: close），读完响应头后返回 (状态码, reader, writer)"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        body = json.dumps(payload or {}, ensure_ascii=False).encode("utf-8")
+        writer.write(f"{method} {path} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        status = int(status_line.split()[1])
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        return status, reader, writer
+    except BaseException:
+        writer.close()
+        raise
+
+
+async def conversation_loop(port: int, deadline: float, think: float, turns: LatencyRecorder,
+                            first_bytes: LatencyRecorder, counters: dict):
+    _, reader, writer = await request(port, "POST", "/v1/conversations")
+    conversation_id = json.loads(await reader.read())["id"]
+    writer.close()
+    # 错开各会话的第一次提问
+    await asyncio.sleep(random.uniform(0, think))
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        writer = None
+        try:
+            status, reader, writer = await request(port, "POST", f"/v1/conversations/{conversation_id}/messages",
+                                                   {"query": random.choice(QUERIES), "stream": True})
+            if status != 200:
+                counters["rejected" if status == 503 else "errors"] += 1
+                await reader.read()
+            else:
+                first = None
+                async for line in reader:
+                    if first is None and line.startswith(b"event: delta"):
+                        first = time.perf_counter() - start
+                    elif line.startswith(b"event: error"):
+                        counters["errors"] += 1
+                turns.record(time.perf_counter() - start)
+                first_bytes.record(first or 0.0)
+        except (OSError, ValueError):
+            counters["errors"] += 1
+        finally:
+            if writer is not None:
+                writer.close()
+        await asyncio.sleep(think)
+
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    """进程累计占用的 CPU 时间（Linux /proc）"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except OSError:
+        return None
+
+
+async def wait_port(port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def run(args):
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(args.port),
+               "--latency", str(args.latency), "--token-interval", str(args.token_interval),
+               "--max-active", str(args.max_active), "--max-queue", str(args.max_queue),
+               "--queue-timeout", str(args.queue_timeout), "--target-latency", str(args.target_latency)]
+    if args.server:
+        command += ["--server", args.server]
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    pin = (lambda: os.sched_setaffinity(0, {cores[0]})) if cores else None
+    if len(cores) > 1:
+        # 压测客户端不与网关争用同一个核
+        os.sched_setaffinity(0, set(cores[1:]))
+    proc = await asyncio.create_subprocess_exec(*command, preexec_fn=pin)
+    try:
+        await wait_port(args.port)
+        header = (f"{'conversations':>14}{'turns/s':>9}{'ttfb p50':>10}{'ttfb p99':>10}{'turn p50':>10}"
+                  f"{'turn p99':>10}{'503':>7}{'errors':>8}{'cpu':>7}")
+        print(f"网关固定在 CPU {cores[0] if cores else '?'}，模拟模型延迟 {args.latency}s，思考时间 {args.think}s\n")
+        print(header)
+        print("-" * len(header))
+        held = 0
+        for level in [int(x) for x in args.levels.split(",")]:
+            turns, first_bytes = LatencyRecorder(), LatencyRecorder()
+            counters = {"rejected": 0, "errors": 0}
+            cpu_start, wall_start = cpu_seconds(proc.pid), time.perf_counter()
+            deadline = time.monotonic() + args.duration
+            await asyncio.gather(*(conversation_loop(args.port, deadline, args.think, turns, first_bytes, counters)
+                                   for _ in range(level)))
+            wall = time.perf_counter() - wall_start
+            cpu_end = cpu_seconds(proc.pid)
+            cpu = f"{(cpu_end - cpu_start) / wall:.0%}" if cpu_start is not None and cpu_end is not None else "n/a"
+            print(f"{level:>14}{turns.count / wall:>9.1f}{first_bytes.percentile(50) * 1000:>8.0f}ms"
+                  f"{first_bytes.percentile(99) * 1000:>8.0f}ms{turns.percentile(50) * 1000:>8.0f}ms"
+                  f"{turns.percentile(99) * 1000:>8.0f}ms{counters['rejected']:>7}{counters['errors']:>8}{cpu:>7}")
+            if not counters["rejected"] and not counters["errors"] and turns.percentile(99) <= args.slo:
+                held = level
+        print(f"\n单核网关在 turn p99 <= {args.slo}s 且没有拒绝的情况下最多承载 {held} 个同时在线的会话（已测试的级别中）")
+    finally:
+        proc.terminate()
+        await proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="网关压测")
+    parser.add_argument("--levels", default="50,100,200,400,800", help="逗号分隔的同时在线会话数")
+    parser.add_argument("--duration", type=float, default=10, help="每一级的持续时间（秒）")
+    parser.add_argument("--think", type=float, default=1.0, help="会话两次提问之间的思考时间（秒）")
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟模型的首 token 延迟（秒）")
+    parser.add_argument("--token-interval", type=float, default=0.0, help="模拟模型相邻字符的输出间隔（秒）")
+    parser.add_argument("--slo", type=float, default=1.0, help="判断能否承载时 turn p99 的上限（秒）")
+    parser.add_argument("--server", default=None, help="网关连接的 MCP 服务器脚本或地址，不指定时不使用工具")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--max-active", type=int, default=1024, help="网关同时处理的轮数上限")
+    parser.add_argument("--max-queue", type=int, default=1024, help="网关等待队列长度上限")
+    parser.add_argument("--queue-timeout", type=float, default=10.0, help="网关排队的最长时间（秒）")
+    parser.add_argument("--target-latency", type=float, default=5.0, help="网关一轮的目标耗时（秒）")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    asyncio.run(serve(args) if args.serve else run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# encoding=utf-8
+# created @2025/5/24
+# created by zhanzq
+#
+# 大结果的后处理吞吐：旧的解析方式（整体 json.loads、不截断）与 postprocess 注册表对比
+#   python benchmarks/bench_postprocess.py --size-mb 4 --repeat 20
+#
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from postprocess import PostProcessorRegistry, parse_keling_image_result
+
+KELING_TOOL = "文生图-可灵版-MCP"
+
+
+def legacy_parse(tool_name: str, text: str) -> str:
+    """改造前 utils.parse_tool_result 的做法"""
+    if tool_name == KELING_TOOL:
+        image_info = json.loads(text)
+        data_path = image_info.get("data", {}).get("image_url")
+        return f"图片生成成功，地址为：{data_path}" if data_path else "图片生成失败"
+    return text
+
+
+def make_payloads(size: int) -> dict:
+    record = {"city": "北京", "date": "2025-05-24", "temp_low": 18, "temp_high": 29, "condition": "晴转多云"}
+    rows = json.dumps([dict(record, id=i) for i in range(size // 100)], ensure_ascii=False)
+    keling = json.dumps({"sid": "12345", "code": 0, "message": "success", "trace": "x" * size,
+                         "data": {"image_url": "https://abc/image.jpg"}})
+    return {
+        "keling_json": (KELING_TOOL, keling),
+        "json_array": ("list_records", rows),
+        "plain_text": ("read_file", "天气晴朗，适合出行。" * (size // 30)),
+    }
+
+
+def measure(fn, tool_name: str, text: str, repeat: int) -> tuple:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        output = fn(tool_name, text)
+    elapsed = time.perf_counter() - start
+    return elapsed / repeat, len(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="工具结果后处理吞吐")
+    parser.add_argument("--size-mb", type=float, default=4, help="每个结果的大致大小（MB）")
+    parser.add_argument("--repeat", type=int, default=20, help="每种结果的处理次数")
+    parser.add_argument("--max-chars", type=int, default=8000, help="结果长度上限")
+    args = parser.parse_args()
+
+    registry = PostProcessorRegistry(max_chars=args.max_chars)
+    registry.register(KELING_TOOL, parse_keling_image_result)
+
+    def pipeline(tool_name: str, text: str) -> str:
+        return registry.process("bench", tool_name, text)
+
+    header = f"{'payload':<14}{'size(MB)':>10}{'mode':>10}{'ms/op':>10}{'MB/s':>10}{'output chars':>14}"
+    print(header)
+    print("-" * len(header))
+    for name, (tool_name, text) in make_payloads(int(args.size_mb * 1024 * 1024)).items():
+        size_mb = len(text.encode("utf-8")) / 1024 / 1024
+        for mode, fn in (("legacy", legacy_parse), ("registry", pipeline)):
+            per_op, output_chars = measure(fn, tool_name, text, args.repeat)
+            print(f"{name:<14}{size_mb:>10.2f}{mode:>10}{per_op * 1000:>10.2f}{size_mb / per_op:>10.0f}"
+                  f"{output_chars:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# encoding=utf-8
+# created @2025/5/22
+# created by zhanzq
+#
+# 对比 stdio 服务器冷启动与预热进程池的新会话就绪耗时（从请求连接到可以调用工具）：
+#   python benchmarks/bench_process_pool.py --server servers/weather_server.py --sessions 20 --pool-size 2 --interval 0.5
+#
+# --interval 为相邻两个新会话的间隔；间隔小于进程启动耗时、且池不够大时，预热池也会退化为等待启动。
+#
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from connections import ServerConnection
+from metrics import LatencyRecorder
+from process_pool import StdioProcessPool
+
+
+async def run_cold(args) -> LatencyRecorder:
+    latencies = LatencyRecorder()
+    for i in range(args.sessions):
+        start = time.perf_counter()
+        connection = ServerConnection({'id': f"cold#{i}", 'script_path': args.server, 'transport': 'stdio'})
+        await connection.start()
+        latencies.record(time.perf_counter() - start)
+        await connection.session.call_tool("get_weather", {"city": "北京"})
+        await connection.close()
+        await asyncio.sleep(args.interval)
+    return latencies
+
+
+async def run_warm(args) -> tuple:
+    pool = await StdioProcessPool({'id': 'warm', 'script_path': args.server, 'transport': 'stdio'},
+                                  size=args.pool_size).start()
+    latencies = LatencyRecorder()
+    try:
+        for _ in range(args.sessions):
+            start = time.perf_counter()
+            connection = await pool.acquire()
+            latencies.record(time.perf_counter() - start)
+            await connection.session.call_tool("get_weather", {"city": "北京"})
+            await connection.close()
+            await asyncio.sleep(args.interval)
+        return latencies, pool.stats()
+    finally:
+        await pool.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="stdio 服务器冷启动与预热进程池对比")
+    parser.add_argument("--server", default="servers/weather_server.py", help="stdio MCP 服务器脚本")
+    parser.add_argument("--sessions", type=int, default=20, help="依次建立的会话数")
+    parser.add_argument("--pool-size", type=int, default=2, help="预热进程数")
+    parser.add_argument("--interval", type=float, default=0.5, help="相邻两个新会话的间隔（秒）")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    cold = await run_cold(args)
+    warm, stats = await run_warm(args)
+
+    header = f"{'mode':<8}{'sessions':>10}{'p50':>10}{'p90':>10}{'max':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, recorder in (("cold", cold), ("warm", warm)):
+        summary = recorder.summary()
+        print(f"{name:<8}{summary['count']:>10}" + "".join(
+            f"{summary[key] * 1000:>10.1f}" for key in ("p50", "p90", "max")))
+    print(f"\n预热进程启动到就绪耗时(ms): p50 {stats['spawn_ready_p50'] * 1000:.1f}  "
+          f"p90 {stats['spawn_ready_p90'] * 1000:.1f}  max {stats['spawn_ready_max'] * 1000:.1f}")
+    print(f"命中 {stats['hits']} 次，等待启动 {stats['misses']} 次，重启 {stats['restarts']} 次")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+# encoding=utf-8
+# created @2025/5/25
+# created by zhanzq
+#
+# 按问题筛选工具的收益：每次请求携带的工具 schema token 数、召回率、检索耗时，以及目录变化时的增量更新耗时。
+# 工具目录模拟 weather + 高德地图 + 讯飞三个服务器，--extra 额外生成若干无关工具模拟更大的目录。
+#   python benchmarks/bench_tool_index.py --top-k 5 --extra 40
+#
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mcp.types import Tool
+
+from history import estimate_tokens
+from schema_convert import openai_tool
+from tool_index import ToolIndex
+
+CATALOG = {
+    "server1": [
+        ("get_weather", "获取指定地点的天气预报。", {"city": "城市名称", "date": "日期，如今天、明天"}),
+    ],
+    "server2": [
+        ("maps_regeocode", "将一个高德经纬度坐标转换为行政区划地址信息", {"location": "经纬度"}),
+        ("maps_geo", "将详细的结构化地址转换为经纬度坐标", {"address": "待解析的结构化地址信息", "city": "查询的城市"}),
+        ("maps_ip_location", "IP 定位根据用户输入的 IP 地址，定位 IP 的所在位置", {"ip": "IP地址"}),
+        ("maps_weather", "根据城市名称或者标准adcode查询指定城市的天气", {"city": "城市名称或者adcode"}),
+        ("maps_search_detail", "查询关键词搜或者周边搜获取到的POI ID的详细信息", {"id": "POI ID"}),
+        ("maps_bicycling", "骑行路径规划用于规划骑行通勤方案，规划时会考虑天桥、单行线、封路等情况",
+         {"origin": "出发点经纬度", "destination": "目的地经纬度"}),
+        ("maps_direction_walking", "步行路径规划，根据输入起点终点经纬度坐标规划100km以内的步行通勤方案",
+         {"origin": "出发点经纬度", "destination": "目的地经纬度"}),
+        ("maps_direction_driving", "驾车路径规划，根据用户起终点经纬度坐标规划以小客车、轿车通勤出行的方案",
+         {"origin": "出发点经纬度", "destination": "目的地经纬度"}),
+        ("maps_direction_transit_integrated", "公交路径规划，根据用户起终点经纬度坐标规划综合各类公共交通方式（火车、公交、地铁）的通勤方案",
+         {"origin": "出发点经纬度", "destination": "目的地经纬度", "city": "起点城市", "cityd": "终点城市"}),
+        ("maps_distance", "距离测量，测量两个经纬度坐标之间的距离，支持驾车、步行以及球面距离测量",
+         {"origins": "起点经纬度，可以传多个", "destination": "终点经纬度", "type": "距离测量类型"}),
+        ("maps_text_search", "关键词搜索，根据用户传入关键词，搜索出相关的POI",
+         {"keywords": "搜索关键词", "city": "查询城市"}),
+        ("maps_around_search", "周边搜，根据用户传入关键词以及坐标location，搜索出radius半径范围的POI",
+         {"keywords": "搜索关键词", "location": "中心点经纬度", "radius": "搜索半径"}),
+    ],
+    "server3": [
+        ("文生图-可灵版-MCP", "根据文本描述生成图片，返回生成图片的地址", {"prompt": "图片内容描述", "style": "图片风格"}),
+        ("语音合成", "把文本合成为语音音频文件", {"text": "要合成的文本", "voice": "发音人"}),
+        ("机器翻译", "把文本翻译为指定语言", {"text": "待翻译文本", "to": "目标语言"}),
+        ("文档摘要", "为长文档生成内容摘要", {"text": "文档内容"}),
+    ],
+}
+
+# (问题, 期望被选中的工具)
+QUERIES = [
+    ("查询北京明天的天气", "server1_get_weather"),
+    ("从天安门开车到首都机场怎么走", "server2_maps_direction_driving"),
+    ("帮我规划一下坐地铁从西单到国贸的公交路线", "server2_maps_direction_transit_integrated"),
+    ("上海外滩附近有什么好吃的餐厅", "server2_maps_around_search"),
+    ("北京市朝阳区望京SOHO的经纬度坐标是多少", "server2_maps_geo"),
+    ("生成一张猫在月球上的图片", "server3_文生图-可灵版-MCP"),
+    ("把这段话翻译成英文：今天天气很好", "server3_机器翻译"),
+    ("我骑车从五道口到清华东门要多久", "server2_maps_bicycling"),
+    ("116.48,39.99 这个坐标是什么地址", "server2_maps_regeocode"),
+    ("把这篇文章读出来，合成语音", "server3_语音合成"),
+]
+
+
+def make_tool(name: str, description: str, params: dict) -> Tool:
+    properties = {key: {"type": "string", "description": text} for key, text in params.items()}
+    return Tool(name=name, description=description,
+                inputSchema={"type": "object", "properties": properties, "required": list(params)[:1]})
+
+
+def make_catalog(extra: int) -> dict:
+    catalog = {server_id: [make_tool(*spec) for spec in specs] for server_id, specs in CATALOG.items()}
+    topics = ["订单", "库存", "用户", "日志", "发票", "工单", "邮件", "日程"]
+    actions = ["查询", "创建", "更新", "删除", "导出"]
+    catalog["server4"] = [
+        make_tool(f"{['get', 'create', 'update', 'delete', 'export'][i % 5]}_record_{i}",
+                  f"{actions[i % 5]}{topics[i % len(topics)]}记录，支持按编号和时间范围过滤",
+                  {"record_id": f"{topics[i % len(topics)]}编号", "start_time": "开始时间", "end_time": "结束时间"})
+        for i in range(extra)
+    ]
+    return catalog
+
+
+def schema_tokens(schemas: list) -> int:
+    return estimate_tokens(json.dumps(schemas, ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按问题筛选工具的 token 与耗时收益")
+    parser.add_argument("--top-k", type=int, default=5, help="每次提供的工具数")
+    parser.add_argument("--extra", type=int, default=40, help="额外生成的无关工具数")
+    parser.add_argument("--repeat", type=int, default=200, help="每个问题的检索次数")
+    parser.add_argument("--prefill-tps", type=float, default=1000, help="估算预填充耗时用的模型吞吐（token/s）")
+    args = parser.parse_args()
+
+    catalog = make_catalog(args.extra)
+    schemas = {f"{server_id}_{tool.name}": openai_tool(tool, name=f"{server_id}_{tool.name}")
+               for server_id, tools in catalog.items() for tool in tools}
+    all_tokens = schema_tokens(list(schemas.values()))
+
+    index = ToolIndex()
+    start = time.perf_counter()
+    for server_id, tools in catalog.items():
+        index.update_server(server_id, [(f"{server_id}_{tool.name}", tool) for tool in tools])
+    build_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    index.update_server("server2", [(f"server2_{tool.name}", tool) for tool in catalog["server2"]])
+    update_ms = (time.perf_counter() - start) * 1000
+
+    print(f"工具总数: {len(index)}，全部工具 schema: {all_tokens} tokens，"
+          f"建索引 {build_ms:.2f}ms，单个服务器目录变化后增量更新 {update_ms:.2f}ms\n")
+    header = f"{'hit':>5}{'tokens':>8}{'saved':>8}{'search(us)':>12}  query"
+    print(header)
+    print("-" * len(header))
+    hits = 0
+    selected_tokens = 0
+    search_total = 0.0
+    for query, expected in QUERIES:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            selected = index.search(query, args.top_k)
+        search_us = (time.perf_counter() - start) / args.repeat * 1e6
+        # 与 Agent.get_tools 一致：没有相关工具时提供全部工具
+        tokens = schema_tokens([schemas[name] for name in selected]) if selected else all_tokens
+        hit = expected in selected
+        hits += hit
+        selected_tokens += tokens
+        search_total += search_us
+        print(f"{'Y' if hit else 'N':>5}{tokens:>8}{all_tokens - tokens:>8}{search_us:>12.1f}  {query}")
+
+    count = len(QUERIES)
+    average_tokens = selected_tokens / count
+    saved_ms = (all_tokens - average_tokens) / args.prefill_tps * 1000
+    print(f"\nrecall@{args.top_k}: {hits / count:.0%}，平均每次请求工具 schema {average_tokens:.0f} tokens"
+          f"（全部 {all_tokens}，减少 {1 - average_tokens / all_tokens:.0%}），"
+          f"平均检索 {search_total / count:.1f}us，"
+          f"按 {args.prefill_tps:.0f} token/s 估算每次请求预填充减少 {saved_ms:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# encoding=utf-8
+# created @2025/5/10
+# created by zhanzq
+#
+# MCP 工具调用压测：回放 JSONL 文件中的 {tool_name, tool_args} 记录，统计吞吐和延迟分位数
+#   闭环（固定并发）: python benchmarks/bench_tools.py --server http://localhost:8000/sse --concurrency 16
+#   开环（固定速率）: python benchmarks/bench_tools.py --server http://localhost:8000/sse --rate 200
+#   stdio 服务器:     python benchmarks/bench_tools.py --stdio servers/weather_server.py
+#   会话池:           python benchmarks/bench_tools.py --server http://localhost:8000/sse --pool-size 4 --pool-max 16
+#
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client_test import MCPClient
+from metrics import LatencyRecorder
+
+DEFAULT_REQUESTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "weather_requests.jsonl")
+
+
+def load_requests(path: str) -> list:
+    """读取 JSONL 请求文件，每行一个 {"tool_name": ..., "tool_args": {...}}"""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            records.append({"tool_name": record["tool_name"], "tool_args": record.get("tool_args", {})})
+    if not records:
+        raise ValueError(f"请求文件为空: {path}")
+    return records
+
+
+class BenchmarkRun:
+    def __init__(self, clients: list, records: list, warmup: float, duration: float):
+        self.clients = itertools.cycle(clients)
+        self.records = itertools.cycle(records)
+        self.recorder = LatencyRecorder()
+        self.errors = 0
+        self.warmup_requests = 0
+        self.measure_start = 0.0
+        self.deadline = 0.0
+        self.warmup = warmup
+        self.duration = duration
+
+    def begin(self):
+        now = time.perf_counter()
+        self.measure_start = now + self.warmup
+        self.deadline = self.measure_start + self.duration
+
+    async def issue(self, scheduled: float):
+        """
+        发送一个请求，延迟从计划发送时间算起（开环模式下避免 coordinated omission）
+        :param scheduled: 计划发送时间（perf_counter）
+        """
+        client = next(self.clients)
+        record = next(self.records)
+        ok = True
+        try:
+            await client.send_request(raise_on_error=True, **record)
+        except Exception as e:
+            ok = False
+            logging.debug(f"请求失败: {str(e)}")
+        latency = time.perf_counter() - scheduled
+        if scheduled < self.measure_start:
+            self.warmup_requests += 1
+        elif ok:
+            self.recorder.record(latency)
+        else:
+            self.errors += 1
+
+    async def closed_loop(self, concurrency: int):
+        """固定并发：每个 worker 收到响应后立即发送下一个请求"""
+
+        async def worker():
+            while time.perf_counter() < self.deadline:
+                await self.issue(time.perf_counter())
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    async def open_loop(self, rate: float, concurrency: int):
+        """固定速率：按计划时间发送请求，不等待之前的请求完成；在途请求数受 concurrency 限制"""
+        semaphore = asyncio.Semaphore(concurrency)
+        interval = 1.0 / rate
+        tasks = set()
+
+        async def bounded(scheduled: float):
+            async with semaphore:
+                await self.issue(scheduled)
+
+        scheduled = time.perf_counter()
+        while scheduled < self.deadline:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(bounded(scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            scheduled += interval
+        await asyncio.gather(*tasks)
+
+    def report(self) -> str:
+        summary = self.recorder.summary()
+        throughput = summary["count"] / self.duration if self.duration else 0.0
+        return "\n".join([
+            f"预热请求数: {self.warmup_requests}",
+            f"成功请求数: {summary['count']}，失败请求数: {self.errors}",
+            f"吞吐: {throughput:.2f} req/s",
+            "延迟(ms): mean {mean:.2f}  p50 {p50:.2f}  p90 {p90:.2f}  p99 {p99:.2f}  max {max:.2f}".format(
+                **{k: v * 1000 for k, v in summary.items() if k != "count"}
+            ),
+        ])
+
+
+async def connect_clients(args) -> list:
+    clients = []
+    if args.pool_size:
+        # 每个SSE服务器一个会话池，由池负责把并发请求分散到多个会话
+        for sse_url in args.server:
+            client = MCPClient()
+            await client.connect_pool(sse_url, min_size=args.pool_size, max_size=args.pool_max or args.pool_size,
+                                      max_in_flight=args.max_in_flight)
+            clients.append(client)
+    for _ in range(args.connections):
+        for sse_url in ([] if args.pool_size else args.server):
+            client = MCPClient()
+            await client.connect_to_server(sse_url=sse_url)
+            clients.append(client)
+        for script_path in args.stdio:
+            client = MCPClient()
+            await client.connect_to_stdio_server(script_path)
+            clients.append(client)
+    return clients
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="MCP 工具调用压测")
+    parser.add_argument("--requests", default=DEFAULT_REQUESTS, help="JSONL 请求文件，每行 {tool_name, tool_args}")
+    parser.add_argument("--server", action="append", default=[], help="SSE 服务器地址，可重复指定")
+    parser.add_argument("--stdio", action="append", default=[], help="stdio 服务器脚本路径，可重复指定")
+    parser.add_argument("--connections", type=int, default=1, help="每个服务器建立的会话数")
+    parser.add_argument("--pool-size", type=int, default=0, help="SSE 服务器使用会话池时的初始会话数，为 0 时不使用会话池")
+    parser.add_argument("--pool-max", type=int, default=0, help="会话池最大会话数，默认等于 --pool-size")
+    parser.add_argument("--max-in-flight", type=int, default=8, help="会话池中每个会话的在途请求上限")
+    parser.add_argument("--concurrency", type=int, default=8, help="闭环模式的并发数，开环模式的最大在途请求数")
+    parser.add_argument("--rate", type=float, default=0, help="开环模式的目标速率(req/s)，为 0 时使用闭环模式")
+    parser.add_argument("--warmup", type=float, default=3.0, help="预热时间（秒），期间的请求不计入统计")
+    parser.add_argument("--duration", type=float, default=10.0, help="统计时间（秒）")
+    parser.add_argument("--hdr-output", help="将延迟分布以 HdrHistogram 文本格式写入该文件（单位毫秒）")
+    args = parser.parse_args()
+
+    if not args.server and not args.stdio:
+        args.server = ["http://localhost:8000/sse"]
+    # 压测时关闭每个请求的 info 日志
+    logging.getLogger().setLevel(logging.WARNING)
+
+    records = load_requests(args.requests)
+    clients = await connect_clients(args)
+    run = BenchmarkRun(clients, records, args.warmup, args.duration)
+    mode = f"开环 {args.rate} req/s" if args.rate > 0 else f"闭环 并发 {args.concurrency}"
+    print(f"\n{len(records)} 条请求模板，{len(clients)} 个会话，{mode}，预热 {args.warmup}s，统计 {args.duration}s")
+    try:
+        run.begin()
+        if args.rate > 0:
+            await run.open_loop(args.rate, args.concurrency)
+        else:
+            await run.closed_loop(args.concurrency)
+        print(run.report())
+        if args.hdr_output:
+            with open(args.hdr_output, "w", encoding="utf-8") as f:
+                f.write(run.recorder.hdr_percentile_distribution())
+            print(f"延迟分布已写入: {args.hdr_output}")
+    finally:
+        for client in clients:
+            await client.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
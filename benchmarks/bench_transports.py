@@ -0,0 +1,125 @@
+# encoding=utf-8
+# created @2025/5/22
+# created by zhanzq
+#
+# 对比同一个 MCP 服务器在 stdio、SSE、Streamable HTTP 三种传输下的工具调用延迟和吞吐：
+#   python benchmarks/bench_transports.py --server servers/weather_server.py --calls 500 --concurrency 16 --duration 10
+#   python benchmarks/bench_transports.py --transports sse,streamable-http --http2
+#
+# HTTP 传输的服务器由客户端以 launch 方式启动（轮询端口就绪），每种传输使用各自的进程和端口。
+#
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_tools import DEFAULT_REQUESTS, load_requests
+from connections import TRANSPORTS, ServerConnection
+from metrics import LatencyRecorder
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_config(transport: str, args) -> dict:
+    config = {'id': transport, 'script_path': args.server, 'transport': transport}
+    if transport != "stdio":
+        config.update(launch=True, host="127.0.0.1", port=free_port(), http2=args.http2)
+    return config
+
+
+async def run_transport(transport: str, args, records: list) -> dict:
+    connection = ServerConnection(server_config(transport, args))
+    session = await connection.start(timeout=args.connect_timeout)
+    templates = itertools.cycle(records)
+    try:
+        # 预热：建立连接池中的连接、填充服务器端缓存
+        for _ in range(args.warmup):
+            record = next(templates)
+            await session.call_tool(record["tool_name"], record["tool_args"])
+
+        # 串行调用：单次调用的往返延迟
+        sequential = LatencyRecorder()
+        for _ in range(args.calls):
+            record = next(templates)
+            start = time.perf_counter()
+            await session.call_tool(record["tool_name"], record["tool_args"])
+            sequential.record(time.perf_counter() - start)
+
+        # 并发调用：固定时间内的吞吐
+        concurrent = LatencyRecorder()
+        errors = 0
+        deadline = time.perf_counter() + args.duration
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                record = next(templates)
+                start = time.perf_counter()
+                try:
+                    await session.call_tool(record["tool_name"], record["tool_args"])
+                except Exception as e:
+                    errors += 1
+                    logging.debug(f"请求失败: {str(e)}")
+                    continue
+                concurrent.record(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    finally:
+        await connection.close()
+
+    return {
+        "transport": transport,
+        "connect": connection.timings.get("total", 0.0),
+        "sequential": sequential.summary(),
+        "throughput": concurrent.count / elapsed if elapsed > 0 else 0.0,
+        "concurrent": concurrent.summary(),
+        "errors": errors,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="MCP 传输方式基准测试")
+    parser.add_argument("--server", default="servers/weather_server.py", help="MCP 服务器脚本")
+    parser.add_argument("--transports", default=",".join(TRANSPORTS), help="逗号分隔的传输方式")
+    parser.add_argument("--requests", default=DEFAULT_REQUESTS, help="JSONL 请求文件，每行 {tool_name, tool_args}")
+    parser.add_argument("--warmup", type=int, default=50, help="每种传输的预热调用数")
+    parser.add_argument("--calls", type=int, default=500, help="串行调用数")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发阶段的并发数")
+    parser.add_argument("--duration", type=float, default=10.0, help="并发阶段的时长（秒）")
+    parser.add_argument("--http2", action="store_true", help="HTTP 传输使用 HTTP/2（需要安装 h2）")
+    parser.add_argument("--connect-timeout", type=float, default=30.0, help="启动并连接服务器的超时时间（秒）")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    records = load_requests(args.requests)
+    rows = []
+    for transport in filter(None, (part.strip() for part in args.transports.split(","))):
+        rows.append(await run_transport(transport, args, records))
+
+    header = (f"{'transport':<18}{'connect':>10}{'seq p50':>10}{'seq p99':>10}"
+              f"{'req/s':>10}{'conc p50':>10}{'conc p99':>10}{'errors':>8}")
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['transport']:<18}{row['connect'] * 1000:>10.1f}"
+              f"{row['sequential']['p50'] * 1000:>10.2f}{row['sequential']['p99'] * 1000:>10.2f}"
+              f"{row['throughput']:>10.1f}"
+              f"{row['concurrent']['p50'] * 1000:>10.2f}{row['concurrent']['p99'] * 1000:>10.2f}{row['errors']:>8}")
+    print("\nconnect 为启动（HTTP 传输含进程启动和端口就绪）到 list_tools 完成的耗时，延迟单位均为毫秒")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
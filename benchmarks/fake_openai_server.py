@@ -0,0 +1,167 @@
+# encoding=utf-8
+# created @2025/5/7
+# created by zhanzq
+#
+# 本地模拟的 OpenAI 兼容接口服务，只用标准库实现，供基准测试使用：
+#   python benchmarks/fake_openai_server.py --port 11435 --latency 0.5
+#
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+import uuid
+
+
+def build_completion(request: dict) -> dict:
+    """根据请求构造一个固定格式的 chat.completion 响应"""
+    messages = request.get("messages", [])
+    last = messages[-1].get("content") if messages else ""
+    content = f"已收到: {last}"
+    prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": content},
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content),
+            "total_tokens": prompt_tokens + len(content),
+        },
+    }
+
+
+def build_chunks(completion: dict) -> list:
+    """把完整的补全拆成 chat.completion.chunk 序列，每个字符一个增量"""
+    content = completion["choices"][0]["message"]["content"]
+    base = {"id": completion["id"], "object": "chat.completion.chunk",
+            "created": completion["created"], "model": completion["model"]}
+    chunks = [dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])]
+    for char in content:
+        chunks.append(dict(base, choices=[{"index": 0, "delta": {"content": char}, "finish_reason": None}]))
+    chunks.append(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+    return chunks
+
+
+class FakeOpenAIServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 11435, latency: float = 0.5,
+                 token_interval: float = 0.01):
+        """
+        :param host: 监听地址
+        :param port: 监听端口，为 0 时随机分配
+        :param latency: 每次补全请求的模拟延迟（秒），流式请求时为首 token 延迟
+        :param token_interval: 流式请求时相邻两个 token 的间隔（秒）
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.token_interval = token_interval
+        self.requests = 0
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                method, path, _ = lines[0].split(" ", 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        k, v = line.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if method == "POST" and path.rstrip("/").endswith("/chat/completions"):
+                    self.requests += 1
+                    request = json.loads(body or b"{}")
+                    await asyncio.sleep(self.latency)
+                    if request.get("stream"):
+                        await self._stream(writer, request)
+                        continue
+                    payload = json.dumps(build_completion(request)).encode("utf-8")
+                    status = "200 OK"
+                else:
+                    payload = json.dumps({"error": {"message": f"not found: {path}"}}).encode("utf-8")
+                    status = "404 Not Found"
+
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\nConnection: keep-alive\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def _stream(self, writer: asyncio.StreamWriter, request: dict):
+        """以 SSE + chunked 编码逐个 token 返回"""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Transfer-Encoding: chunked\r\nConnection: keep-alive\r\n\r\n")
+        events = [f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                  for chunk in build_chunks(build_completion(request))]
+        events.append("data: [DONE]\n\n")
+        for i, event in enumerate(events):
+            if i > 1:
+                await asyncio.sleep(self.token_interval)
+            data = event.encode("utf-8")
+            writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def start_in_thread(self):
+        """在独立线程的事件循环中运行，避免被测试进程中的同步调用阻塞"""
+        started = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        started.wait()
+        return self
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="本地模拟的 OpenAI 兼容接口服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.5, help="每次补全的模拟延迟（秒）")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="流式响应相邻 token 的间隔（秒）")
+    args = parser.parse_args()
+
+    server = await FakeOpenAIServer(args.host, args.port, args.latency, args.token_interval).start()
+    print(f"模拟服务已启动: {server.base_url}")
+    await server._server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
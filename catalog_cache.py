@@ -0,0 +1,130 @@
+# encoding=utf-8
+# created @2025/5/6
+# created by zhanzq
+#
+
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+from mcp import ClientSession, types
+
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class ToolCatalogCache:
+    """
+    单个会话的工具目录缓存。
+    连接时填充一次，之后在 TTL 过期或收到 tools/list_changed 通知时才重新调用 list_tools()，
+    并按格式缓存已经转换好的工具 schema，避免每轮对话都重复转换。
+    """
+
+    def __init__(self, ttl: Optional[float] = 300.0):
+        """
+        :param ttl: 缓存有效期（秒），为 None 时只依赖 list_changed 通知刷新
+        """
+        self.ttl = ttl
+        self.session: Optional[ClientSession] = None
+        self.tools: List[types.Tool] = []
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        # 每次刷新加 1，依据工具列表建立的数据（如检索索引）按它判断是否过期
+        self.version = 0
+        self._converted: Dict[str, List[dict]] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._listeners: List[Callable[[List[types.Tool]], None]] = []
+
+    def attach(self, session: ClientSession):
+        """绑定会话，重新绑定时旧缓存作废"""
+        self.session = session
+        self.invalidate()
+
+    def detach(self, session: Optional[ClientSession] = None):
+        """
+        连接断开时解除绑定，已缓存的工具列表保留到重连后刷新
+        :param session: 断开的会话，已经绑定了新会话时忽略
+        """
+        if session is None or session is self.session:
+            self.session = None
+
+    def add_listener(self, callback: Callable[[List[types.Tool]], None]):
+        """注册目录刷新后的回调，参数为新的工具列表（如更新 Agent 的路由表）"""
+        self._listeners.append(callback)
+
+    def invalidate(self):
+        """标记缓存失效，下一次读取时重新拉取工具列表"""
+        self._loaded_at = None
+
+    def is_fresh(self) -> bool:
+        if self._loaded_at is None:
+            return False
+        if self.ttl is None:
+            return True
+        return time.monotonic() - self._loaded_at < self.ttl
+
+    async def refresh(self) -> List[types.Tool]:
+        """强制从服务器拉取工具列表，并清空已转换的 schema"""
+        if self.session is None:
+            raise RuntimeError("ToolCatalogCache 尚未绑定会话")
+        with tracer.span("list_tools") as span:
+            response = await self.session.list_tools()
+            self.tools = list(response.tools)
+            span.set(tools=len(self.tools))
+        self._converted = {}
+        self._loaded_at = time.monotonic()
+        self.refreshes += 1
+        self.version += 1
+        for callback in self._listeners:
+            callback(self.tools)
+        logger.debug(f"工具目录已刷新，共 {len(self.tools)} 个工具")
+        return self.tools
+
+    async def get_tools(self) -> List[types.Tool]:
+        if self.is_fresh():
+            self.hits += 1
+            return self.tools
+        async with self._lock:
+            # 等锁期间可能已被其它协程刷新
+            if self.is_fresh():
+                self.hits += 1
+                return self.tools
+            self.misses += 1
+            return await self.refresh()
+
+    async def get_schemas(self, fmt: str, converter: Callable[[types.Tool], dict]) -> List[dict]:
+        """
+        获取指定格式的工具 schema 列表，同一份目录只转换一次
+        :param fmt: 格式名，如 'openai'、'anthropic'
+        :param converter: 将 MCP Tool 转换为目标格式的函数
+        :return: list
+        """
+        tools = await self.get_tools()
+        schemas = self._converted.get(fmt)
+        if schemas is None:
+            schemas = [converter(tool) for tool in tools]
+            self._converted[fmt] = schemas
+        return schemas
+
+    async def handle_message(self, message) -> None:
+        """
+        作为 ClientSession 的 message_handler，收到 tools/list_changed 通知时作废缓存
+        """
+        notification = getattr(message, "root", message)
+        if isinstance(notification, types.ToolListChangedNotification):
+            logger.info("收到 tools/list_changed 通知，工具目录缓存已失效")
+            self.invalidate()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "tools": len(self.tools),
+        }
@@ -4,27 +4,25 @@
 #
 
 import asyncio
-from contextlib import AsyncExitStack
-import json
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
-from mcp.client.sse import sse_client
 import os
-from utils import parse_tool_result
 
+from agent import Agent
+from backends import OpenAIBackend
+from completion_cache import cached_backend_from_env
+from result_cache import ToolResultCache
+from tracing import configure_from_env
 
-from openai import OpenAI
 
-
-class MCPClient:
+class MCPClient(Agent):
     def __init__(self):
-        # 使用字典存储多个会话
-        self.sessions = {}
-        self.exit_stack = AsyncExitStack()
-
         # 尝试获取API密钥
         api_key = os.environ.get("ANTHROPIC_API_KEY", "hello")
-        self.llm = OpenAI(api_key=api_key, base_url="http://localhost:11434/v1")
+        # 异步客户端 + 连接池，模型调用期间不阻塞事件循环（包括MCP的SSE读流）
+        backend = OpenAIBackend(model="qwen2.5", api_key=api_key, base_url="http://localhost:11434/v1")
+        # 为工具名添加服务器前缀以区分；工具结果缓存在 tool_cache.json 中开启；
+        # 每次提问只提供最相关的 MCP_TOOL_TOP_K 个工具（为 0 时提供全部）；模型回复缓存由 MCP_LLM_CACHE 开启
+        super().__init__(cached_backend_from_env(backend), prefix_tools=True, result_cache=ToolResultCache.from_config(),
+                         tool_top_k=int(os.environ.get("MCP_TOOL_TOP_K", "8")))
 
     async def connect_to_server(self, server_config: dict):
         """连接到MCP服务器
@@ -34,181 +32,20 @@ class MCPClient:
             {
                 'id': 服务器唯一标识,
                 'script_path': 服务器脚本路径,
-                'transport': 传输方式('sse'或'stdio'),
-                'sse_url': SSE URL(当transport为'sse'时需要)
+                'transport': 传输方式('stdio'、'sse'、'streamable-http' 或 'auto'，可选),
+                'url': 服务器地址(HTTP 传输时需要，也可以写作 'sse_url'),
+                'connect_timeout': 连接超时时间（秒，可选）,
+                'tool_timeout': 工具调用每次尝试的超时时间（秒，可选）,
+                'retries': 幂等工具的最多重试次数（可选）,
+                'breaker_threshold': 连续失败多少次后熔断（可选）,
+                'breaker_reset': 熔断多久后试探恢复（秒，可选）
             }
         """
-        server_id = server_config['id']
-        transport = server_config.get('transport', 'sse')
-
-        if transport == "sse":
-            print(f"使用SSE传输方式连接服务器 {server_id}")
-            sse_url = server_config.get('sse_url', "http://localhost:8000/sse")
-            print(f"连接到SSE服务器: {sse_url}")
-
-            try:
-                sse_transport = await self.exit_stack.enter_async_context(
-                    sse_client(sse_url)
-                )
-                if isinstance(sse_transport, tuple) and len(sse_transport) == 2:
-                    read_stream, write_stream = sse_transport
-                    session = await self.exit_stack.enter_async_context(
-                        ClientSession(read_stream, write_stream)
-                    )
-                    self.sessions[server_id] = session
-                else:
-                    raise ValueError(f"SSE传输格式不正确: {sse_transport}")
-            except Exception as e:
-                print(f"连接到SSE服务器 {server_id} 失败: {str(e)}")
-                raise
-        else:
-            print(f"使用标准输入输出传输方式连接服务器 {server_id}")
-            server_params = self.start_server_stdio(server_config['script_path'])
-            stdio_transport = await self.exit_stack.enter_async_context(stdio_client(server_params))
-            stdio, write = stdio_transport
-            session = await self.exit_stack.enter_async_context(ClientSession(stdio, write))
-            self.sessions[server_id] = session
-
-        await session.initialize()
-        response = await session.list_tools()
-        print(f"\n已连接到服务器 {server_id}，可用工具:", [tool.name for tool in response.tools])
-
-    async def process_query(self, query: str, history_messages) -> str:
-        """处理查询，使用所有可用服务器的工具"""
-        history_messages.append({"role": "user", "content": query})
-
-        # 收集所有服务器的工具
-        all_tools = []
-        for server_id, session in self.sessions.items():
-            response = await session.list_tools()
-            for tool in response.tools:
-                # 为工具名添加服务器前缀以区分
-                tool_with_prefix = {
-                    "type": "function",
-                    "function": {
-                        "name": f"{server_id}_{tool.name}",
-                        "description": f"[{server_id}] {tool.description}",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                k: {
-                                    "type": v.get("type"),
-                                    "description": v.get("description")
-                                } for k, v in tool.inputSchema.get("properties").items()
-                            },
-                            "required": list(tool.inputSchema.keys())
-                        }
-                    }
-                }
-                all_tools.append(tool_with_prefix)
-
-        # 处理响应和工具调用的逻辑保持不变，但需要解析工具名中的服务器ID
-        response = self.llm.chat.completions.create(
-            model="qwen2.5",
-            messages=history_messages,
-            tools=all_tools,
-            tool_choice="auto",
-            temperature=0.2
-        )
-
-        # ... 其余处理逻辑相似，但在调用工具时需要解析服务器ID ...
-        tool_results = []
-        final_text = []
-
-        assistant_message_content = []
-        for content in response.choices:
-            if content.finish_reason == "stop":
-                final_text.append(content.message.content)
-                assistant_message_content.append(content.message.content)
-                history_messages.append({
-                    "role": "assistant",
-                    "content": content.message.content
-                })
-            elif content.finish_reason == "tool_calls":
-                for tool_call in content.message.tool_calls:
-                    # 解析服务器ID和实际工具名
-                    server_id, tool_name = tool_call.function.name.split('_', 1)
-                    tool_args = json.loads(tool_call.function.arguments)
-
-                    # Execute tool call
-                    try:
-                        result = await self.sessions[server_id].call_tool(tool_name, tool_args)
-                        tool_results.append({"call": tool_name, "result": result})
-                        final_text.append(f"[Calling tool {tool_name} with args {tool_args}]")
-                        tool_result_content = parse_tool_result(tool_name, result.content[0].text)
-                    except Exception as e:
-                        tool_result_content = f"Error: {str(e)}"
-                        final_text.append(f"[Error calling tool {tool_name}: {str(e)}]")
-
-                    assistant_message_content.append(content.message.content)
-                    history_messages.append({
-                        "role": "assistant",
-                        "tool_calls": [{
-                            "id": it.id,
-                            "type": it.type,
-                            "function": {
-                                "name": it.function.name,
-                                "arguments": it.function.arguments
-                            }
-                        } for it in content.message.tool_calls]
-                    })
-                    history_messages.append({
-                        "role": "tool",
-                        "content": tool_result_content
-                    })
-
-                    # Get next response from Claude
-                    response = self.llm.chat.completions.create(
-                        model="qwen2.5",
-                        messages=history_messages,
-                        tools=all_tools,
-                        tool_choice="auto",
-                        temperature=0.2
-                    )
-
-                    final_text.append(response.choices[0].message.content)
-                    history_messages.append({
-                        "role": "assistant",
-                        "content": response.choices[0].message.content
-                    })
-        # print(json.dumps(history_messages, indent=4, ensure_ascii=False))
-        return "\n".join(final_text)
-
-    async def chat_loop(self):
-        """Run an interactive chat loop"""
-        print("\nMCP客户端已启动！")
-        print("输入你的问题或输入'quit'退出。")
-        print("示例查询: '查询北京的天气'")
-
-        histroy_messages = []
-        while True:
-            try:
-                query = input("\n问题: ").strip()
-
-                if query.lower() in ['quit', '退出', 'exit', 'q']:
-                    break
-
-                if not query:
-                    continue
-
-                print("\n正在处理你的请求，请稍候...")
-                response = await self.process_query(query, history_messages=histroy_messages)
-                print("\n" + response)
-
-            except KeyboardInterrupt:
-                print("\n收到中断信号，正在退出...")
-                break
-            except Exception as e:
-                print(f"\n错误: {str(e)}")
-                import traceback
-                traceback.print_exc()
-
-    async def cleanup(self):
-        """清理所有资源"""
-        await self.exit_stack.aclose()
+        return await self.add_server(server_config)
 
 
 async def main():
+    configure_from_env()
     client = MCPClient()
     try:
         # 配置两个服务器
@@ -223,20 +60,29 @@ async def main():
             'id': 'server2',
             'script_path': '',
             'transport': 'sse',
-            'sse_url': 'https://mcp.amap.com/sse?key=dd7072d3fbb1ef79013b8207bdb6ea54'
+            'sse_url': 'https://mcp.amap.com/sse?key=dd7072d3fbb1ef79013b8207bdb6ea54',
+            # 远程服务器：单次调用最多等 15s，连续失败 3 次后熔断 60s，期间其工具不提供给模型
+            'tool_timeout': 15,
+            'breaker_threshold': 3,
+            'breaker_reset': 60
         }
 
         server3_config = {
             'id': 'server3',
             'script_path': '',
             'transport': 'sse',
-            'sse_url': 'https://xingchen-api.xf-yun.com/mcp/xingchen/flow/7315369205743927298/sse'
+            'sse_url': 'https://xingchen-api.xf-yun.com/mcp/xingchen/flow/7315369205743927298/sse',
+            # 文生图较慢，超时放宽；该工具不是幂等的，不会重试
+            'tool_timeout': 60,
+            'breaker_threshold': 3,
+            'breaker_reset': 60
         }
 
-        # 连接到多个服务器
-        await client.connect_to_server(server1_config)
-        # await client.connect_to_server(server2_config)
-        await client.connect_to_server(server3_config)
+        # 并发连接到多个服务器
+        connected = await client.connect_all([server1_config, server3_config])  # 需要时加入 server2_config
+        if not connected:
+            print("没有可用的服务器")
+            return
 
         # 运行聊天循环
         await client.chat_loop()
@@ -1,4 +1,5 @@
 import asyncio
+import functools
 import json
 import logging
 from contextlib import AsyncExitStack
@@ -6,7 +7,13 @@ from typing import Optional
 
 from mcp import ClientSession
 from mcp.client.sse import sse_client
+from mcp.client.stdio import stdio_client
 
+from connections import stdio_server_params
+from process_pool import close_pools
+from result_cache import ToolResultCache
+from session_pool import SessionPool
+from tool_exec import ToolCallError
 from utils import parse_tool_result
 
 # 配置日志记录器
@@ -24,6 +31,10 @@ class MCPClient:
     def __init__(self):
         # Initialize session and client objects
         self.session: Optional[ClientSession] = None
+        self.pool: Optional[SessionPool] = None
+        # 工具结果缓存，在 tool_cache.json 中开启
+        self.result_cache: Optional[ToolResultCache] = ToolResultCache.from_config()
+        self.server_id = ""
         self.exit_stack = AsyncExitStack()
 
     async def connect_to_server(self, sse_url: str):
@@ -31,6 +42,7 @@ class MCPClient:
         :param sse_url: SSE URL
         """
         print(f"连接到SSE服务器: {sse_url}")
+        self.server_id = sse_url
 
         try:
             sse_transport = await self.exit_stack.enter_async_context(
@@ -50,17 +62,67 @@ class MCPClient:
             print(f"连接到SSE服务器 {sse_url} 失败: {str(e)}")
             raise
 
+    async def connect_to_stdio_server(self, server_script_path: str):
+        """以标准输入输出方式启动并连接到MCP服务器
+        :param server_script_path: 服务器脚本路径(.py或.js)
+        """
+        print(f"连接到stdio服务器: {server_script_path}")
+        self.server_id = server_script_path
+        server_params = stdio_server_params(server_script_path)
+        read_stream, write_stream = await self.exit_stack.enter_async_context(stdio_client(server_params))
+        self.session = await self.exit_stack.enter_async_context(ClientSession(read_stream, write_stream))
+        await self.session.initialize()
+        response = await self.session.list_tools()
+        print(f"\n已连接到服务器 {server_script_path}，可用工具:", [tool.name for tool in response.tools])
+
+    async def connect_pool(self, sse_url: str, min_size: int = 2, max_size: int = 8, max_in_flight: int = 8):
+        """建立会话池，之后 send_request 会把并发请求分散到池中的多个会话上
+        :param sse_url: SSE URL
+        :param min_size: 最少保持的会话数
+        :param max_size: 最多会话数
+        :param max_in_flight: 每个会话同时进行的请求数上限
+        """
+        print(f"连接到SSE服务器: {sse_url}（会话池 {min_size}~{max_size}）")
+        self.server_id = sse_url
+        self.pool = SessionPool(
+            {'id': sse_url, 'transport': 'sse', 'sse_url': sse_url},
+            min_size=min_size, max_size=max_size, max_in_flight=max_in_flight
+        )
+        await self.pool.start()
+        tools = self.pool.sessions[0].connection.tool_cache.tools
+        print(f"\n已连接到服务器 {sse_url}，可用工具:", [tool.name for tool in tools])
+
     async def send_request(self, **kwargs):
+        """
+        调用一次工具
+        :param tool_name: 工具名，默认 get_weather
+        :param tool_args: 工具参数，dict 或 JSON 字符串
+        :param raise_on_error: 为 True 时调用失败直接抛出异常，而不是返回 "Error: ..." 字符串
+        :return: str
+        """
         tool_name = kwargs.get("tool_name", "get_weather")
         tool_args = kwargs.get("tool_args", {"city": "北京", "date": "今天"})
+        raise_on_error = kwargs.get("raise_on_error", False)
         if isinstance(tool_args, str):
             tool_args = json.loads(tool_args)
         # Execute tool call
         try:
-            result = await self.session.call_tool(tool_name, tool_args)
+            if self.pool is not None:
+                call = functools.partial(self.pool.call_tool, tool_name, tool_args)
+            else:
+                call = functools.partial(self.session.call_tool, tool_name, tool_args)
+            if self.result_cache is not None:
+                result = await self.result_cache.get_or_call(self.server_id, tool_name, tool_args, call)
+            else:
+                result = await call()
             logging.debug(f"call: {tool_name}, args: {json.dumps(tool_args, ensure_ascii=False)} result: {result}")
-            tool_result = parse_tool_result(tool_name, result.content[0].text)
+            if getattr(result, "isError", False):
+                # 工具返回了错误结果，与 tool_exec.call_tool 一样按失败处理，压测中不计为成功的请求
+                raise ToolCallError(result.content[0].text if result.content else f"工具 {tool_name} 返回了错误")
+            tool_result = parse_tool_result(tool_name, result.content[0].text, server_id=self.server_id)
         except Exception as e:
+            if raise_on_error:
+                raise
             tool_result = f"Error: {str(e)}"
             logging.error(f"[Error calling tool {tool_name}: {str(e)}]")
 
@@ -70,6 +132,12 @@ class MCPClient:
 
     async def cleanup(self):
         """Clean up resources"""
+        if self.result_cache is not None:
+            logging.info(f"工具结果缓存统计: {self.result_cache.stats()}")
+        if self.pool is not None:
+            logging.info(f"会话池统计: {self.pool.stats()}")
+            await self.pool.close()
+            await close_pools()
         await self.exit_stack.aclose()
 
 
@@ -0,0 +1,246 @@
+# encoding=utf-8
+# created @2025/5/27
+# created by zhanzq
+#
+# 模型回复的磁盘缓存，用于回归测试和离线评测的确定性重放。
+# 键是 (后端, 模型, 消息, 工具, 采样参数) 的内容哈希，回复存放在本地 SQLite 文件中，超过容量上限时按最近使用时间淘汰。
+# 三种模式：
+#   read-through  命中时直接重放，未命中时请求模型并记录
+#   record        总是请求模型，并覆盖已有的记录
+#   replay        只重放，未命中时报错（不需要模型服务）
+# 通过环境变量开启，例如 MCP_LLM_CACHE=replay:llm_cache.db
+#
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from backends import LLMBackend
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+READ_THROUGH = "read-through"
+RECORD = "record"
+REPLAY = "replay"
+MODES = (READ_THROUGH, RECORD, REPLAY)
+
+DEFAULT_DB_PATH = "llm_cache.db"
+
+# 流式回复结束后需要保存的状态，覆盖 OpenAIStream/AnthropicStream/_MockTurn 的字段
+_TURN_STATE = ("content", "tool_calls", "finish_reason", "content_blocks", "stop_reason")
+
+
+class CompletionCacheMiss(LookupError):
+    """replay 模式下缓存中没有对应的回复"""
+
+
+def completion_key(request: dict) -> str:
+    """请求内容的哈希，字典按键排序，保证相同内容得到相同的键"""
+    canonical = json.dumps(request, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """
+    SQLite 中的模型回复缓存。读写在线程池中执行，不阻塞事件循环；
+    记录总大小超过 max_bytes 时删除最久未使用的记录，直到降到上限的 90%。
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, mode: str = READ_THROUGH, max_bytes: int = 256 * 1024 * 1024):
+        """
+        :param path: 数据库文件路径
+        :param mode: read-through、record 或 replay
+        :param max_bytes: 缓存总大小上限（字节）
+        """
+        if mode not in MODES:
+            raise ValueError(f"未知的缓存模式: {mode}，可选 {', '.join(MODES)}")
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, model TEXT, value TEXT, size INTEGER, created REAL, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+        self._conn.commit()
+        self.bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    @classmethod
+    def from_env(cls, env_var: str = "MCP_LLM_CACHE") -> Optional["CompletionCache"]:
+        """
+        根据环境变量创建缓存，格式为 模式[:路径]，例如 read-through、replay:eval_cache.db；
+        容量上限由 MCP_LLM_CACHE_MB 设置。未设置时返回 None
+        """
+        spec = os.environ.get(env_var, "").strip()
+        if not spec:
+            return None
+        mode, _, path = spec.partition(":")
+        max_mb = float(os.environ.get("MCP_LLM_CACHE_MB", "256"))
+        return cls(path or DEFAULT_DB_PATH, mode=mode, max_bytes=int(max_mb * 1024 * 1024))
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key))
+                self._conn.commit()
+        return row[0] if row is not None else None
+
+    def _put(self, key: str, model: str, value: str):
+        size = len(key) + len(value.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?)",
+                               (key, model, value, size, now, now))
+            self.bytes += size - (old[0] if old else 0)
+            if self.bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+            self._conn.commit()
+
+    def _evict(self, target: int):
+        rows = self._conn.execute("SELECT key, size FROM completions ORDER BY last_used").fetchall()
+        removed = []
+        for key, size in rows:
+            if self.bytes <= target:
+                break
+            removed.append((key,))
+            self.bytes -= size
+        self._conn.executemany("DELETE FROM completions WHERE key = ?", removed)
+        self.evictions += len(removed)
+
+    async def get(self, key: str) -> Optional[dict]:
+        """读取记录，record 模式总是返回 None"""
+        if self.mode == RECORD:
+            return None
+        value = await asyncio.to_thread(self._get, key)
+        if value is None:
+            self.misses += 1
+            if self.mode == REPLAY:
+                raise CompletionCacheMiss(f"缓存中没有对应的模型回复（key={key[:12]}），replay 模式不请求模型")
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    async def put(self, key: str, model: str, value: dict):
+        await asyncio.to_thread(self._put, key, model, json.dumps(value, ensure_ascii=False))
+        self.writes += 1
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "hits": self.hits, "misses": self.misses, "writes": self.writes,
+                "evictions": self.evictions, "bytes": self.bytes}
+
+
+class _CachedTurn:
+    """
+    包装后端的一次流式回复：命中时把记录的状态写回原始回复对象并一次性产出文本，
+    未命中时照常流式请求，结束后记录。其余属性（text、calls、tool_calls 等）都读原始回复对象。
+    """
+
+    def __init__(self, cache: CompletionCache, turn, key: str, model: str, span_name: str):
+        self.cache = cache
+        self.turn = turn
+        self.key = key
+        self.model = model
+        self.span_name = span_name
+        self.cached = False
+
+    def __getattr__(self, name):
+        return getattr(self.turn, name)
+
+    async def __aiter__(self):
+        start = time.perf_counter()
+        state = await self.cache.get(self.key)
+        if state is not None:
+            with tracer.span(self.span_name, model=self.model, cached=True):
+                for field, value in state.items():
+                    setattr(self.turn, field, value)
+                self.turn.ttft = self.turn.elapsed = time.perf_counter() - start
+                self.cached = True
+                if self.turn.text:
+                    yield self.turn.text
+            return
+        async for text in self.turn:
+            yield text
+        # 只记录完整结束的回复
+        await self.cache.put(self.key, self.model, {field: getattr(self.turn, field) for field in _TURN_STATE
+                                                    if field in vars(self.turn)})
+
+
+class CachedBackend(LLMBackend):
+    """给任意后端加上回复缓存，消息格式和工具转换都沿用被包装的后端"""
+
+    def __init__(self, backend: LLMBackend, cache: CompletionCache):
+        """
+        :param backend: 被包装的后端
+        :param cache: 回复缓存
+        """
+        super().__init__(backend.model)
+        self.backend = backend
+        self.cache = cache
+        self.name = backend.name
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def _key(self, kind: str, **request) -> str:
+        return completion_key({"kind": kind, "backend": self.backend.name, "model": self.backend.model,
+                               "params": self.backend.sampling_params(), **request})
+
+    def convert_tool(self, tool, name: Optional[str] = None, description: Optional[str] = None) -> dict:
+        return self.backend.convert_tool(tool, name=name, description=description)
+
+    def stream(self, messages: List[dict], tools: List[dict], span_name: str = "llm.completion"):
+        key = self._key("stream", messages=messages, tools=tools)
+        return _CachedTurn(self.cache, self.backend.stream(messages, tools, span_name=span_name), key,
+                           self.backend.model, span_name)
+
+    def user_message(self, query: str) -> dict:
+        return self.backend.user_message(query)
+
+    def tool_messages(self, turn, results: List[dict]) -> List[dict]:
+        return self.backend.tool_messages(turn, results)
+
+    def final_message(self, turn) -> dict:
+        return self.backend.final_message(turn)
+
+    async def complete(self, system: str, content: str) -> str:
+        key = self._key("complete", system=system, content=content)
+        state = await self.cache.get(key)
+        if state is not None:
+            return state["text"]
+        text = await self.backend.complete(system, content)
+        await self.cache.put(key, self.backend.model, {"text": text})
+        return text
+
+    async def close(self):
+        logger.info(f"模型回复缓存统计: {self.cache.stats()}")
+        try:
+            await self.backend.close()
+        finally:
+            self.cache.close()
+
+
+def cached_backend_from_env(backend: LLMBackend, env_var: str = "MCP_LLM_CACHE") -> LLMBackend:
+    """环境变量中配置了回复缓存时返回包装后的后端，否则原样返回"""
+    cache = CompletionCache.from_env(env_var)
+    return backend if cache is None else CachedBackend(backend, cache)
@@ -0,0 +1,511 @@
+# encoding=utf-8
+# created @2025/5/9
+# created by zhanzq
+#
+
+import asyncio
+import logging
+import os
+import sys
+import time
+from contextlib import AsyncExitStack
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.sse import sse_client
+from mcp.client.stdio import get_default_environment, stdio_client
+from mcp.client.streamable_http import streamablehttp_client
+
+from catalog_cache import ToolCatalogCache
+from resilience import backoff_delay, is_connection_error
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# 单个服务器的默认连接超时时间（秒），包括握手、initialize() 和 list_tools()
+DEFAULT_CONNECT_TIMEOUT = 15.0
+
+TRANSPORTS = ("stdio", "sse", "streamable-http")
+# FastMCP 两种 HTTP 传输的默认路径
+DEFAULT_PATHS = {"sse": "/sse", "streamable-http": "/mcp"}
+
+# 自动重连的退避参数（秒）和默认心跳间隔（秒）
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+DEFAULT_HEARTBEAT = 30.0
+
+# 自动协商的结果按 URL 缓存，同一服务器的多个会话（如会话池）只探测一次
+_negotiated: Dict[str, str] = {}
+
+
+def stdio_server_params(server_script_path: str) -> StdioServerParameters:
+    is_python = server_script_path.endswith('.py')
+    command = "python" if is_python else "node"
+    return StdioServerParameters(
+        command=command,
+        args=[server_script_path],
+        # 服务器脚本按 MCP_TRANSPORT 选择传输方式，默认是 sse
+        env=dict(get_default_environment(), MCP_TRANSPORT="stdio")
+    )
+
+
+def server_url(server_config: dict) -> Optional[str]:
+    """配置中的服务器地址；launch 模式下未指定地址时按 host/port 和传输方式生成"""
+    url = server_config.get('url') or server_config.get('sse_url')
+    if url is None and server_config.get('launch'):
+        transport = server_config.get('transport')
+        path = DEFAULT_PATHS.get("streamable-http" if transport in (None, "auto", "http") else transport, "/mcp")
+        url = f"http://{server_config.get('host', '127.0.0.1')}:{server_config.get('port', 8000)}{path}"
+    return url
+
+
+def config_from_target(target: str, transport: Optional[str] = None) -> dict:
+    """
+    命令行中的服务器参数转换为服务器配置：http(s) 地址直接连接，否则视为服务器脚本（默认 stdio 启动）
+    :param target: 服务器地址或脚本路径
+    :param transport: 传输方式，为 None 时自动判断
+    :return: dict
+    """
+    if target.startswith(("http://", "https://")):
+        config = {'id': target, 'url': target}
+    else:
+        config = {'id': target, 'script_path': target}
+    if transport:
+        config['transport'] = transport
+    return config
+
+
+def resolve_transport(server_config: dict) -> str:
+    """
+    确定传输方式：显式配置优先；未配置时有地址则按路径判断（/sse、/mcp），判断不了时自动协商，没有地址则用 stdio
+    :param server_config: 服务器配置字典
+    :return: stdio、sse、streamable-http 或 auto
+    """
+    transport = server_config.get('transport')
+    if transport == "http":
+        return "streamable-http"
+    if transport in TRANSPORTS or transport == "auto":
+        return transport
+    if transport:
+        raise ValueError(f"不支持的传输方式: {transport}，可选 {', '.join(TRANSPORTS)} 或 auto")
+    url = server_url(server_config)
+    if url is None:
+        return "stdio"
+    path = urlsplit(url).path.rstrip("/")
+    for name, default_path in DEFAULT_PATHS.items():
+        if path.endswith(default_path):
+            return name
+    return "auto"
+
+
+def http_client_factory(http2: bool = False):
+    """
+    MCP HTTP 传输使用的 httpx 客户端工厂：一个会话内的所有请求复用同一组 keep-alive 连接，
+    http2=True 时在一条连接上多路复用（需要安装 h2，未安装时退回 HTTP/1.1）
+    """
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("未安装 h2，退回 HTTP/1.1 keep-alive")
+            http2 = False
+
+    def factory(headers: Optional[dict] = None, timeout: Optional[httpx.Timeout] = None, auth=None):
+        return httpx.AsyncClient(
+            headers=headers,
+            timeout=timeout or httpx.Timeout(30.0, read=300.0),
+            auth=auth,
+            http2=http2,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60.0)
+        )
+
+    return factory
+
+
+async def negotiate_transport(url: str, timeout: float = 5.0) -> str:
+    """
+    判断 url 上是 SSE 还是 Streamable HTTP 服务器：SSE 服务器对 GET 请求立即返回 endpoint 事件，
+    其它情况按 Streamable HTTP 处理。结果按 url 缓存
+    :param url: 服务器地址
+    :param timeout: 探测超时时间（秒）
+    :return: sse 或 streamable-http
+    """
+    if url in _negotiated:
+        return _negotiated[url]
+    transport = "streamable-http"
+
+    async def probe():
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            async with client.stream("GET", url, headers={"Accept": "text/event-stream"}) as response:
+                if response.status_code != 200 or "text/event-stream" not in response.headers.get("content-type", ""):
+                    return False
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        return line[len("event:"):].strip() == "endpoint"
+        return False
+
+    try:
+        if await asyncio.wait_for(probe(), timeout=timeout):
+            transport = "sse"
+    except (httpx.HTTPError, asyncio.TimeoutError) as e:
+        logger.info(f"探测 {url} 的传输方式失败（{str(e) or type(e).__name__}），按 streamable-http 连接")
+    _negotiated[url] = transport
+    logger.info(f"{url} 协商的传输方式: {transport}")
+    return transport
+
+
+async def wait_until_ready(host: str, port: int, proc: Optional[asyncio.subprocess.Process] = None,
+                           timeout: float = 30.0) -> float:
+    """
+    轮询直到端口可以连接，间隔从 20ms 开始逐步加大；进程提前退出时立即报错
+    :param host: 主机
+    :param port: 端口
+    :param proc: 服务器进程，可选
+    :param timeout: 超时时间（秒）
+    :return: 等待耗时（秒）
+    """
+    start = time.monotonic()
+    interval = 0.02
+    while True:
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=1.0)
+            writer.close()
+            return time.monotonic() - start
+        except (OSError, asyncio.TimeoutError):
+            pass
+        if proc is not None and proc.returncode is not None:
+            raise RuntimeError(f"服务器进程启动失败，退出码 {proc.returncode}")
+        if time.monotonic() - start > timeout:
+            raise TimeoutError(f"服务器 {host}:{port} 在 {timeout}s 内未就绪")
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, 0.2)
+
+
+class HealingSession:
+    """
+    ServerConnection 的会话包装：总是使用当前的会话，重连期间等待新会话就绪；
+    调用因连接断开而失败时通知连接重连并抛出异常，是否重放由调用方决定（见 resilience.ServerGuard）
+    """
+
+    def __init__(self, connection: "ServerConnection"):
+        self.connection = connection
+        self.interrupted = 0
+
+    async def call_tool(self, name: str, arguments: Optional[dict] = None):
+        session = await self.connection.wait_connected()
+        try:
+            return await session.call_tool(name, arguments)
+        except Exception as e:
+            if is_connection_error(e):
+                self.interrupted += 1
+                self.connection.mark_broken(session)
+            raise
+
+    def __getattr__(self, name):
+        # 其它方法直接使用当前会话
+        session = self.connection.session
+        if session is None:
+            raise ConnectionError(f"服务器 {self.connection.server_id} 正在重连")
+        return getattr(session, name)
+
+
+class ServerConnection:
+    """
+    单个MCP服务器的连接。
+    传输层和会话的上下文都在一个专属任务里进入和退出（anyio 的 cancel scope 要求在同一个任务中退出），
+    因此多个服务器可以并发连接，并且各自独立关闭。
+    """
+
+    def __init__(self, server_config: dict):
+        """
+        :param server_config: 服务器配置字典
+            {
+                'id': 服务器唯一标识,
+                'script_path': 服务器脚本路径,
+                'transport': 传输方式('stdio'、'sse'、'streamable-http' 或 'auto'，可选，默认按地址判断),
+                'url': 服务器地址（HTTP 传输时需要，旧配置中的 'sse_url' 同样有效）,
+                'http2': HTTP 传输是否使用 HTTP/2（可选）,
+                'launch': 是否由客户端启动 script_path 并等待端口就绪（可选，配合 'host'、'port'）,
+                'warm_pool': stdio 服务器的预热进程数（可选，见 process_pool.py）,
+                'connect_timeout': 连接超时时间（秒，可选）,
+                'reconnect': 连接断开后是否自动重连（可选，默认 True）,
+                'heartbeat': 心跳间隔（秒，可选，为 0 时不发心跳）,
+                'tools_ttl': 工具目录缓存有效期（秒，可选）
+            }
+        """
+        self.config = server_config
+        self.server_id = server_config['id']
+        self.transport = resolve_transport(server_config)
+        self.session: Optional[ClientSession] = None
+        self.tool_cache = ToolCatalogCache(ttl=server_config.get('tools_ttl', 300))
+        # 各启动阶段耗时（秒）
+        self.timings = {}
+        # 连接断开后是否自动重连，以及心跳间隔（秒，为 0 时不发心跳）
+        self.reconnect = server_config.get('reconnect', True)
+        self.reconnect_max_delay = server_config.get('reconnect_max_delay', RECONNECT_MAX_DELAY)
+        self.heartbeat = server_config.get('heartbeat', DEFAULT_HEARTBEAT)
+        # 重连指标
+        self.disconnects = 0
+        self.reconnects = 0
+        self.downtime = 0.0
+        self._down_since: Optional[float] = None
+        # 自动重连的会话包装，工具调用应通过它进行
+        self.healing = HealingSession(self)
+        self._task: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Future] = None
+        self._closing = asyncio.Event()
+        self._broken = asyncio.Event()
+        self._connected = asyncio.Event()
+        # close() 或连接断开时唤醒连接任务
+        self._wake = asyncio.Event()
+
+    async def _launch(self, exit_stack: AsyncExitStack):
+        """启动 HTTP 服务器进程并轮询端口直到就绪，连接关闭时结束进程"""
+        host, port = self.config.get('host', '127.0.0.1'), self.config.get('port', 8000)
+        if self.transport == "auto":
+            # 自己启动的服务器不需要协商
+            self.transport = "streamable-http"
+        # 新版 mcp 不再读取 FASTMCP_HOST/FASTMCP_PORT，监听地址以命令行参数显式传给服务脚本
+        env = dict(os.environ, FASTMCP_HOST=host, FASTMCP_PORT=str(port), MCP_TRANSPORT=self.transport)
+        proc = await asyncio.create_subprocess_exec(sys.executable, self.config['script_path'],
+                                                    "--host", host, "--port", str(port), env=env)
+
+        async def stop():
+            if proc.returncode is None:
+                proc.terminate()
+                try:
+                    await asyncio.wait_for(proc.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    proc.kill()
+                    await proc.wait()
+
+        exit_stack.push_async_callback(stop)
+        self.timings["launch"] = await wait_until_ready(host, port, proc,
+                                                        timeout=self.config.get('connect_timeout',
+                                                                                DEFAULT_CONNECT_TIMEOUT))
+
+    async def _open_transport(self, exit_stack: AsyncExitStack):
+        if self.transport == "stdio":
+            logger.info(f"使用标准输入输出传输方式连接服务器 {self.server_id}")
+            server_params = stdio_server_params(self.config['script_path'])
+            return await exit_stack.enter_async_context(stdio_client(server_params))
+
+        if self.config.get('launch'):
+            await self._launch(exit_stack)
+        url = server_url(self.config)
+        if not url:
+            raise ValueError(f"服务器 {self.server_id} 使用 {self.transport} 传输，但没有配置 url")
+        if self.transport == "auto":
+            self.transport = await negotiate_transport(url)
+        factory = http_client_factory(http2=self.config.get('http2', False))
+        if self.transport == "sse":
+            logger.info(f"连接到SSE服务器 {self.server_id}: {url}")
+            sse_transport = await exit_stack.enter_async_context(sse_client(url, httpx_client_factory=factory))
+            if not (isinstance(sse_transport, tuple) and len(sse_transport) == 2):
+                raise ValueError(f"SSE传输格式不正确: {sse_transport}")
+            return sse_transport
+        logger.info(f"连接到Streamable HTTP服务器 {self.server_id}: {url}")
+        # 第三个返回值是获取 Mcp-Session-Id 的函数，这里不需要
+        read_stream, write_stream, _ = await exit_stack.enter_async_context(
+            streamablehttp_client(url, httpx_client_factory=factory)
+        )
+        return read_stream, write_stream
+
+    async def _serve_once(self):
+        """建立一次连接（传输层、initialize()、list_tools()），并保持到 close() 被调用或连接断开"""
+        async with AsyncExitStack() as exit_stack:
+            start = time.perf_counter()
+            with tracer.span("connect.transport", server=self.server_id, transport=self.transport) as span:
+                read_stream, write_stream = await self._open_transport(exit_stack)
+                # auto 在这里才确定实际的传输方式
+                span.set(transport=self.transport)
+                session = await exit_stack.enter_async_context(
+                    ClientSession(read_stream, write_stream, message_handler=self.tool_cache.handle_message)
+                )
+            self.timings["transport"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with tracer.span("connect.initialize", server=self.server_id):
+                await session.initialize()
+            self.timings["initialize"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            self.tool_cache.attach(session)
+            await self.tool_cache.refresh()
+            self.timings["list_tools"] = time.perf_counter() - start
+
+            self._broken.clear()
+            self.session = session
+            if not self._ready.done():
+                self._ready.set_result(session)
+            else:
+                self._on_reconnected()
+            self._connected.set()
+            heartbeat = asyncio.create_task(self._heartbeat(session)) if self.heartbeat else None
+            try:
+                # 保持上下文打开，直到 close() 被调用或检测到连接断开
+                await self._wake.wait()
+            finally:
+                self._connected.clear()
+                self.session = None
+                # 不再用断开的会话刷新工具目录，重连后 attach 新会话
+                self.tool_cache.detach(session)
+                if heartbeat is not None:
+                    heartbeat.cancel()
+            if self._broken.is_set() and not self._closing.is_set():
+                raise ConnectionError("连接已断开")
+
+    async def _run(self):
+        attempt = 0
+        try:
+            while True:
+                try:
+                    await self._serve_once()
+                except Exception as e:
+                    if not self._ready.done():
+                        # 首次连接失败直接交给 start()
+                        raise
+                    if self._down_since is None:
+                        # 新的一次断开，退避从头开始
+                        attempt = 0
+                        self.disconnects += 1
+                        self._down_since = time.monotonic()
+                        logger.error(f"服务器 {self.server_id} 的连接异常断开: {str(e) or type(e).__name__}")
+                    else:
+                        logger.warning(f"服务器 {self.server_id} 重连失败: {str(e) or type(e).__name__}")
+                if self._closing.is_set() or not self.reconnect:
+                    return
+                delay = backoff_delay(attempt, RECONNECT_BASE_DELAY, self.reconnect_max_delay)
+                attempt += 1
+                self._wake.clear()
+                logger.info(f"{delay:.2f}s 后重连服务器 {self.server_id}（第 {attempt} 次）")
+                try:
+                    await asyncio.wait_for(self._closing.wait(), timeout=delay)
+                    return
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException as e:
+            if not self._ready.done():
+                if isinstance(e, asyncio.CancelledError):
+                    self._ready.cancel()
+                else:
+                    self._ready.set_exception(e)
+            raise
+        finally:
+            self.session = None
+
+    def _on_reconnected(self):
+        downtime = time.monotonic() - self._down_since if self._down_since is not None else 0.0
+        self._down_since = None
+        self.reconnects += 1
+        self.downtime += downtime
+        logger.info(f"服务器 {self.server_id} 已重连，中断 {downtime:.2f}s")
+        # 作为一个 span 导出，配合 MCP_TRACE 的 histogram/otlp 导出器统计中断时长
+        with tracer.span("connect.reconnect", server=self.server_id, downtime_ms=downtime * 1000,
+                         reconnects=self.reconnects):
+            pass
+
+    async def _heartbeat(self, session: ClientSession):
+        """定期 ping，连接断开但没有请求在进行时也能及时发现"""
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                await asyncio.wait_for(session.send_ping(), timeout=min(self.heartbeat, 10.0))
+            except Exception as e:
+                logger.warning(f"服务器 {self.server_id} 心跳失败: {str(e) or type(e).__name__}")
+                self.mark_broken(session)
+                return
+
+    def mark_broken(self, session: Optional[ClientSession] = None):
+        """
+        标记连接已断开，触发重连
+        :param session: 出错时使用的会话；已经重连到新会话时忽略
+        """
+        if session is not None and session is not self.session:
+            return
+        if self.session is not None:
+            self._broken.set()
+            self._wake.set()
+
+    async def wait_connected(self, timeout: Optional[float] = None) -> ClientSession:
+        """等待连接可用（重连期间会阻塞），返回当前会话"""
+        while self.session is None:
+            if self._closing.is_set() or self._task is None or self._task.done():
+                raise ConnectionError(f"服务器 {self.server_id} 的连接已关闭")
+            await asyncio.wait_for(self._connected.wait(), timeout=timeout)
+        return self.session
+
+    def stats(self) -> dict:
+        downtime = self.downtime
+        if self._down_since is not None:
+            downtime += time.monotonic() - self._down_since
+        return {
+            "connected": self.session is not None,
+            "disconnects": self.disconnects,
+            "reconnects": self.reconnects,
+            "downtime": downtime,
+            "interrupted_calls": self.healing.interrupted,
+        }
+
+    async def start(self, timeout: Optional[float] = None) -> ClientSession:
+        """
+        建立连接并完成 initialize() 和 list_tools()
+        :param timeout: 连接超时时间（秒），为 None 时使用配置中的 connect_timeout
+        :return: ClientSession
+        """
+        if timeout is None:
+            timeout = self.config.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT)
+        self._ready = asyncio.get_running_loop().create_future()
+        self._task = asyncio.create_task(self._run(), name=f"mcp-{self.server_id}")
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._ready), timeout=timeout)
+        except BaseException:
+            await self.close()
+            raise
+        finally:
+            self.timings["total"] = time.perf_counter() - start
+
+    @property
+    def is_alive(self) -> bool:
+        """会话已建立且传输层任务仍在运行"""
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    async def close(self):
+        """关闭会话和传输层"""
+        self._closing.set()
+        self._wake.set()
+        if self._task is None:
+            return
+        if not self._ready.done() or self.session is None:
+            # 还没连上或正在重连，直接取消连接任务
+            self._task.cancel()
+        try:
+            await self._task
+        except BaseException:
+            pass
+        if not self._ready.cancelled():
+            # 取走异常，避免 "Future exception was never retrieved" 警告
+            self._ready.exception()
+        self._task = None
+
+
+def format_startup_table(rows) -> str:
+    """
+    将各服务器的启动耗时整理成表格
+    :param rows: [(server_id, timings, error), ...]
+    :return: str
+    """
+    header = f"{'server':<16}{'status':<8}{'transport':>11}{'initialize':>12}{'list_tools':>12}{'total':>10}  error"
+    lines = [header, "-" * len(header)]
+    for server_id, timings, error in rows:
+        cells = "".join(
+            f"{timings[key]:>{width}.3f}" if key in timings else f"{'-':>{width}}"
+            for key, width in (("transport", 11), ("initialize", 12), ("list_tools", 12), ("total", 10))
+        )
+        status = "ok" if error is None else "failed"
+        lines.append(f"{server_id:<16}{status:<8}{cells}  {error or ''}")
+    return "\n".join(lines)
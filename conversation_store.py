@@ -0,0 +1,300 @@
+# encoding=utf-8
+# created @2025/5/29
+# created by zhanzq
+#
+# 会话历史的持久化。HistoryManager 每轮结束时只追加这一轮的新消息，摘要单独记录，不重写整段历史；
+# 重新打开会话时只加载摘要和最近若干轮，较早的消息留在磁盘上。
+#   SQLiteConversationStore  所有会话存放在一个 SQLite 文件中
+#   JsonlConversationStore   每个会话一个只追加的 JSONL 文件，加载时从文件末尾向前读取
+# 通过环境变量选择，例如 MCP_CONVERSATION_STORE=sqlite:conversations.db 或 jsonl:conversations
+#
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+from history import is_turn_start
+
+# load() 的返回值：(消息列表, 摘要, 摘要覆盖到的序号, 第一条消息的序号)
+Loaded = Tuple[List[dict], str, int, int]
+
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9_.-]")
+
+# 从文件末尾向前读取时每次读取的字节数
+_READ_BLOCK = 64 * 1024
+
+
+def _reversed_lines(f, block_size: int = _READ_BLOCK) -> Iterator[bytes]:
+    """从文件末尾向前逐行产出（不含换行符），只读取用到的部分"""
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    rest = b""
+    while position > 0:
+        size = min(block_size, position)
+        position -= size
+        f.seek(position)
+        lines = (f.read(size) + rest).split(b"\n")
+        # 第一段可能是上一块中某一行的后半部分，留到下一次拼接
+        rest = lines.pop(0)
+        for line in reversed(lines):
+            if line:
+                yield line
+    if rest:
+        yield rest
+
+
+class ConversationStore:
+    """会话存储接口，序号是消息在整个会话中的位置（从 0 开始）"""
+
+    def append(self, conversation_id: str, start_seq: int, messages: List[dict]):
+        """
+        追加消息
+        :param conversation_id: 会话ID
+        :param start_seq: 第一条消息的序号
+        :param messages: 消息列表
+        """
+        raise NotImplementedError
+
+    def save_summary(self, conversation_id: str, summary: str, seq: int):
+        """
+        记录摘要
+        :param conversation_id: 会话ID
+        :param summary: 摘要
+        :param seq: 摘要覆盖了序号小于 seq 的消息
+        """
+        raise NotImplementedError
+
+    def load(self, conversation_id: str, recent_turns: Optional[int] = None) -> Optional[Loaded]:
+        """
+        加载摘要和摘要之后最近的 recent_turns 轮
+        :param conversation_id: 会话ID
+        :param recent_turns: 加载的轮数，为 None 时加载摘要之后的全部消息，为 0 时只加载摘要
+        :return: (消息列表, 摘要, 摘要覆盖到的序号, 第一条消息的序号)，会话不存在时返回 None；
+                 只加载了最近几轮时，两个序号之间的消息留在磁盘上，尚未并入摘要
+        """
+        raise NotImplementedError
+
+    def load_range(self, conversation_id: str, start_seq: int, end_seq: int) -> List[dict]:
+        """
+        读取序号在 [start_seq, end_seq) 之间的消息，用于把 load() 没有加载的部分补进摘要
+        :param conversation_id: 会话ID
+        :param start_seq: 起始序号（包含）
+        :param end_seq: 结束序号（不包含）
+        :return: 按序号排列的消息列表
+        """
+        raise NotImplementedError
+
+    def delete(self, conversation_id: str) -> bool:
+        """删除会话，返回会话是否存在"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteConversationStore(ConversationStore):
+    """所有会话存放在一个 SQLite 文件中，按 (会话ID, 序号) 索引，只加载需要的那几轮"""
+
+    def __init__(self, path: str = "conversations.db"):
+        """
+        :param path: 数据库文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "conversation_id TEXT, seq INTEGER, turn_start INTEGER, message TEXT, "
+            "PRIMARY KEY (conversation_id, seq)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries (conversation_id TEXT PRIMARY KEY, summary TEXT, seq INTEGER)"
+        )
+        self._conn.commit()
+
+    def append(self, conversation_id: str, start_seq: int, messages: List[dict]):
+        rows = [(conversation_id, start_seq + i, int(is_turn_start(message)), json.dumps(message, ensure_ascii=False))
+                for i, message in enumerate(messages)]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def save_summary(self, conversation_id: str, summary: str, seq: int):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO summaries VALUES (?, ?, ?)", (conversation_id, summary, seq))
+            self._conn.commit()
+
+    def load(self, conversation_id: str, recent_turns: Optional[int] = None) -> Optional[Loaded]:
+        with self._lock:
+            row = self._conn.execute("SELECT summary, seq FROM summaries WHERE conversation_id = ?",
+                                     (conversation_id,)).fetchone()
+            summary, covered = row if row is not None else ("", 0)
+            first = covered
+            last = self._conn.execute("SELECT MAX(seq) FROM messages WHERE conversation_id = ?",
+                                      (conversation_id,)).fetchone()[0]
+            if row is None and last is None:
+                return None
+            if recent_turns == 0:
+                return [], summary, covered, max(first, last + 1 if last is not None else 0)
+            if recent_turns is not None:
+                # 第 recent_turns 个最近的轮次开始位置，之前的消息不读取
+                start = self._conn.execute(
+                    "SELECT seq FROM messages WHERE conversation_id = ? AND turn_start = 1 AND seq >= ? "
+                    "ORDER BY seq DESC LIMIT 1 OFFSET ?", (conversation_id, first, recent_turns - 1)
+                ).fetchone()
+                if start is not None:
+                    first = start[0]
+            rows = self._conn.execute(
+                "SELECT seq, message FROM messages WHERE conversation_id = ? AND seq >= ? ORDER BY seq",
+                (conversation_id, first)
+            ).fetchall()
+        return [json.loads(message) for _, message in rows], summary, covered, rows[0][0] if rows else first
+
+    def load_range(self, conversation_id: str, start_seq: int, end_seq: int) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message FROM messages WHERE conversation_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (conversation_id, start_seq, end_seq)
+            ).fetchall()
+        return [json.loads(message) for message, in rows]
+
+    def delete(self, conversation_id: str) -> bool:
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,)).rowcount
+            deleted += self._conn.execute("DELETE FROM summaries WHERE conversation_id = ?",
+                                          (conversation_id,)).rowcount
+            self._conn.commit()
+        return deleted > 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JsonlConversationStore(ConversationStore):
+    """
+    每个会话一个只追加的 JSONL 文件，每行是 {"seq": 序号, "message": 消息}，同序号的记录以后写入的为准；
+    摘要很小，单独保存在 <会话>.summary.json 中，整体替换。
+    加载时从文件末尾向前读取，凑够最近的 recent_turns 轮或读到摘要之前的消息就停止，不解析更早的部分
+    """
+
+    def __init__(self, directory: str = "conversations"):
+        """
+        :param directory: 存放会话文件的目录
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, conversation_id: str, suffix: str = ".jsonl") -> str:
+        name = _UNSAFE_CHARS.sub("_", conversation_id)
+        if name != conversation_id or name.startswith("."):
+            # 替换过字符的ID可能重名，加上哈希区分
+            name = f"{name}-{hashlib.sha1(conversation_id.encode('utf-8')).hexdigest()[:8]}"
+        return os.path.join(self.directory, f"{name}{suffix}")
+
+    def append(self, conversation_id: str, start_seq: int, messages: List[dict]):
+        lines = "".join(json.dumps({"seq": start_seq + i, "message": message}, ensure_ascii=False) + "\n"
+                        for i, message in enumerate(messages))
+        with open(self._path(conversation_id), "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def save_summary(self, conversation_id: str, summary: str, seq: int):
+        path = self._path(conversation_id, ".summary.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"seq": seq, "summary": summary}, f, ensure_ascii=False)
+        # 先写临时文件再替换，进程崩溃时不会留下写了一半的摘要
+        os.replace(path + ".tmp", path)
+
+    def _load_summary(self, conversation_id: str) -> Optional[Tuple[str, int]]:
+        try:
+            with open(self._path(conversation_id, ".summary.json"), encoding="utf-8") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        return record["summary"], record["seq"]
+
+    def load(self, conversation_id: str, recent_turns: Optional[int] = None) -> Optional[Loaded]:
+        saved = self._load_summary(conversation_id)
+        summary, first = saved if saved is not None else ("", 0)
+        path = self._path(conversation_id)
+        if not os.path.exists(path):
+            return None if saved is None else ([], summary, first, first)
+        messages = {}
+        turns = 0
+        last = first - 1
+        with open(path, "rb") as f:
+            for line in _reversed_lines(f):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 写到一半的行（进程崩溃），忽略
+                    continue
+                seq = record["seq"]
+                last = max(last, seq)
+                if seq < first or recent_turns is not None and turns >= recent_turns:
+                    # 摘要之前的消息，或已经凑够 recent_turns 轮，更早的记录都不需要
+                    break
+                if seq in messages:
+                    continue
+                messages[seq] = record["message"]
+                if is_turn_start(record["message"]):
+                    turns += 1
+        window = sorted(messages.items())
+        if recent_turns == 0:
+            return [], summary, first, max(first, last + 1)
+        return [message for _, message in window], summary, first, window[0][0] if window else first
+
+    def load_range(self, conversation_id: str, start_seq: int, end_seq: int) -> List[dict]:
+        messages = {}
+        try:
+            f = open(self._path(conversation_id), "rb")
+        except FileNotFoundError:
+            return []
+        with f:
+            for line in _reversed_lines(f):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                seq = record["seq"]
+                if seq < start_seq:
+                    break
+                if seq < end_seq and seq not in messages:
+                    messages[seq] = record["message"]
+        return [message for _, message in sorted(messages.items())]
+
+    def delete(self, conversation_id: str) -> bool:
+        deleted = False
+        for suffix in (".jsonl", ".summary.json"):
+            try:
+                os.remove(self._path(conversation_id, suffix))
+                deleted = True
+            except FileNotFoundError:
+                pass
+        return deleted
+
+
+def create_store(spec: str) -> ConversationStore:
+    """
+    按 类型[:路径] 创建会话存储，类型为 sqlite 或 jsonl，例如 sqlite:conversations.db
+    :param spec: 存储说明
+    :return: ConversationStore
+    """
+    kind, _, path = spec.strip().partition(":")
+    if kind == "sqlite":
+        return SQLiteConversationStore(path or "conversations.db")
+    if kind == "jsonl":
+        return JsonlConversationStore(path or "conversations")
+    raise ValueError(f"未知的会话存储: {spec}，可选 sqlite[:路径] 或 jsonl[:目录]")
+
+
+def store_from_env(env_var: str = "MCP_CONVERSATION_STORE") -> Optional[ConversationStore]:
+    """根据环境变量创建会话存储，格式同 create_store；未设置时返回 None"""
+    spec = os.environ.get(env_var, "").strip()
+    return create_store(spec) if spec else None
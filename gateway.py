@@ -0,0 +1,517 @@
+# encoding=utf-8
+# created @2025/5/28
+# created by zhanzq
+#
+# HTTP/SSE 网关：一个进程内为多个用户提供对话服务。
+#   python gateway.py --server servers/weather_server.py --backend openai --port 8080
+#
+# 所有会话共用同一个 Agent（MCP 连接、工具目录、模型连接池），每个会话有独立的 HistoryManager。
+#   POST   /v1/conversations                    创建会话，返回 {"id": ...}
+#   POST   /v1/conversations/{id}/messages      {"query": "...", "stream": true}，stream 为 true 时以 SSE 返回
+#   DELETE /v1/conversations/{id}               删除会话
+#   GET    /health                              准入控制、会话数等统计
+# 准入控制：同时处理的轮数有上限，超出的请求在有界队列中等待，队列满或等待超时返回 503 和 Retry-After；
+# 上限按 AIMD 自适应调整，一轮耗时超过 target_latency（上游模型或工具变慢）时降低，恢复后逐步提高。
+# 指定 --store 时会话持久化到 SQLite 或 JSONL 中（见 conversation_store.py），空闲或超出内存上限的会话
+# 从内存中移除，下次收到消息时只加载摘要和最近若干轮。
+#
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Optional
+
+from agent import Agent
+from backends import BACKENDS, create_backend
+from completion_cache import cached_backend_from_env
+from connections import TRANSPORTS, config_from_target
+from conversation_store import ConversationStore, create_store, store_from_env
+from history import HistoryManager
+from metrics import LatencyRecorder
+from process_pool import close_pools
+from servers.launcher import json_response, read_head
+from tracing import configure_from_env
+
+logger = logging.getLogger(__name__)
+
+# 耗时统计只保留最近的样本数（滑动窗口），长时间运行时内存不增长
+STATS_WINDOW = 10000
+
+
+class Overloaded(RuntimeError):
+    """网关繁忙，请求没有被接受"""
+
+    def __init__(self, reason: str, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(reason)
+
+
+class AdmissionController:
+    """
+    并发上限 + 有界等待队列。上限在 [min_active, max_active] 之间按 AIMD 调整：
+    一轮耗时超过 target_latency 时乘以 backoff（每个 target_latency 窗口最多降一次），
+    否则每完成 limit 轮约加 1。
+    """
+
+    def __init__(self, max_active: int = 64, min_active: int = 4, max_queue: int = 256,
+                 queue_timeout: float = 10.0, target_latency: float = 20.0, backoff: float = 0.75):
+        """
+        :param max_active: 同时处理的轮数上限
+        :param min_active: 自适应调整的下限
+        :param max_queue: 等待队列长度上限，超出时直接拒绝
+        :param queue_timeout: 在队列中等待的最长时间（秒）
+        :param target_latency: 一轮的目标耗时（秒），超过时认为上游变慢
+        :param backoff: 降低上限时乘的系数
+        """
+        self.max_active = max_active
+        self.min_active = min(min_active, max_active)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.limit = float(max_active)
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.decreases = 0
+        self.queue_wait = LatencyRecorder(max_samples=STATS_WINDOW)
+        self._waiters: "deque[asyncio.Future]" = deque()
+        self._last_decrease = 0.0
+
+    def _retry_after(self) -> float:
+        return max(1.0, self.target_latency * len(self._waiters) / max(1, int(self.limit)))
+
+    async def acquire(self):
+        """占用一个处理名额，繁忙时排队；队列满或等待超时抛出 Overloaded"""
+        if self.active < int(self.limit) and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            self.queue_wait.record(0.0)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded("等待队列已满", self._retry_after())
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done():
+                # 超时或取消的同时刚好拿到了名额，转交给下一个等待者
+                self.active -= 1
+                self._wake()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.timed_out += 1
+            raise Overloaded(f"排队超过 {self.queue_timeout:.1f}s", self._retry_after())
+        # _wake() 移交名额时已经计入 active
+        self.admitted += 1
+        self.queue_wait.record(time.perf_counter() - start)
+
+    def _wake(self):
+        while self._waiters and self.active < int(self.limit):
+            waiter = self._waiters.popleft()
+            self.active += 1
+            waiter.set_result(None)
+
+    def release(self, latency: float):
+        """
+        归还名额并按本轮耗时调整上限
+        :param latency: 本轮耗时（秒），失败的轮次也计入
+        """
+        self.active -= 1
+        now = time.monotonic()
+        if latency > self.target_latency:
+            if now - self._last_decrease >= self.target_latency:
+                self.limit = max(self.min_active, self.limit * self.backoff)
+                self._last_decrease = now
+                self.decreases += 1
+                logger.warning(f"一轮耗时 {latency:.1f}s 超过目标 {self.target_latency:.1f}s，"
+                               f"并发上限降为 {int(self.limit)}")
+        else:
+            self.limit = min(self.max_active, self.limit + 1 / self.limit)
+        self._wake()
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "decreases": self.decreases,
+            **{f"queue_wait_{k}": v for k, v in self.queue_wait.summary().items() if k != "count"},
+        }
+
+
+class Conversation:
+    """一个会话：独立的历史记录，同一时间只处理一条消息"""
+
+    def __init__(self, conversation_id: str, history: HistoryManager):
+        self.id = conversation_id
+        self.history = history
+        self.lock = asyncio.Lock()
+        self.turns = 0
+        self.last_used = time.monotonic()
+        # 上次计入网关内存统计时的字节数
+        self.memory_bytes = history.memory_bytes
+
+
+class Gateway:
+    """多会话共用一个 Agent 的 HTTP/SSE 服务"""
+
+    def __init__(self, agent: Agent, admission: Optional[AdmissionController] = None,
+                 max_conversations: int = 10000, idle_timeout: float = 1800.0,
+                 store: Optional[ConversationStore] = None, max_memory_bytes: int = 0, recent_turns: int = 20):
+        """
+        :param agent: 已连接服务器的 Agent，所有会话共用
+        :param admission: 准入控制，默认使用 AdmissionController()
+        :param max_conversations: 内存中保留的会话数上限，超出时移除最久未使用的空闲会话
+        :param idle_timeout: 会话空闲多久后从内存中移除（秒）
+        :param store: 会话存储，为 None 时会话只保存在内存中，移除后无法恢复
+        :param max_memory_bytes: 内存中会话历史的总字节数上限，超出时移除最久未使用的空闲会话，0 表示不限制
+        :param recent_turns: 从存储中恢复会话时加载的最近轮数
+        """
+        self.agent = agent
+        self.admission = admission or AdmissionController()
+        self.max_conversations = max_conversations
+        self.idle_timeout = idle_timeout
+        self.store = store
+        self.max_memory_bytes = max_memory_bytes
+        self.recent_turns = recent_turns
+        self.conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self.memory_bytes = 0
+        self.latency = LatencyRecorder(max_samples=STATS_WINDOW)
+        self.failed = 0
+        self.cancelled = 0
+        self.loads = 0
+        self.evictions = 0
+        self._server = None
+        self._sweeper = None
+
+    def create_conversation(self, conversation_id: Optional[str] = None,
+                            history: Optional[HistoryManager] = None) -> Conversation:
+        conversation_id = conversation_id or uuid.uuid4().hex
+        if history is None:
+            history = HistoryManager(self.agent.backend.model, summarizer=self.agent.summarize_history,
+                                     store=self.store, conversation_id=conversation_id)
+        conversation = self.conversations[conversation_id] = Conversation(conversation_id, history)
+        self.memory_bytes += conversation.memory_bytes
+        self._evict(conversation_id)
+        return conversation
+
+    async def get_conversation(self, conversation_id: str) -> Conversation:
+        """取出会话（内存中没有时从存储中加载，存储中也没有时创建），并标记为最近使用"""
+        conversation = self.conversations.get(conversation_id)
+        if conversation is None and self.store is not None:
+            history = await asyncio.to_thread(HistoryManager.load, self.store, conversation_id,
+                                              self.agent.backend.model, recent_turns=self.recent_turns,
+                                              summarizer=self.agent.summarize_history)
+            # 加载期间同一会话的另一个请求可能已经创建了它
+            conversation = self.conversations.get(conversation_id)
+            if conversation is None and history is not None:
+                self.loads += 1
+                return self.create_conversation(conversation_id, history)
+        if conversation is None:
+            return self.create_conversation(conversation_id)
+        self.conversations.move_to_end(conversation_id)
+        conversation.last_used = time.monotonic()
+        return conversation
+
+    def _remove(self, conversation_id: str) -> Optional[Conversation]:
+        conversation = self.conversations.pop(conversation_id, None)
+        if conversation is not None:
+            self.memory_bytes -= conversation.memory_bytes
+        return conversation
+
+    def _evict(self, keep: Optional[str] = None):
+        """会话数或内存超出上限时，从最久未使用的一端移除空闲会话（已写入存储的可以再加载）"""
+        victims = []
+        count, memory = len(self.conversations), self.memory_bytes
+        for key, conversation in self.conversations.items():
+            over_count = count > self.max_conversations
+            over_memory = self.max_memory_bytes and memory > self.max_memory_bytes
+            if not over_count and not over_memory:
+                break
+            if key != keep and not conversation.lock.locked():
+                victims.append(key)
+                count -= 1
+                memory -= conversation.memory_bytes
+        for key in victims:
+            self._remove(key)
+        self.evictions += len(victims)
+
+    async def run_turn(self, conversation: Conversation, query: str, emit: Callable[[str], Awaitable[None]]):
+        """
+        处理会话中的一条消息，逐个片段交给 emit
+        :param conversation: 会话
+        :param query: 用户的问题
+        :param emit: 输出回复片段的协程函数
+        """
+        try:
+            await self._run_turn(conversation, query, emit)
+        except BaseException:
+            # 被拒绝（503）或第一轮就失败的会话没有任何内容，不留在内存中，
+            # 否则随意编造的会话ID和被拒绝的请求会不断堆积空会话
+            if not conversation.turns and not len(conversation.history) \
+                    and self.conversations.get(conversation.id) is conversation:
+                self._remove(conversation.id)
+            raise
+        self.memory_bytes += conversation.history.memory_bytes - conversation.memory_bytes
+        conversation.memory_bytes = conversation.history.memory_bytes
+        self._evict(conversation.id)
+
+    async def _run_turn(self, conversation: Conversation, query: str, emit: Callable[[str], Awaitable[None]]):
+        async with conversation.lock:
+            await self.admission.acquire()
+            start = time.perf_counter()
+            try:
+                async for text in self.agent.stream_query(query, conversation.history):
+                    await emit(text)
+            except BaseException as e:
+                # 失败或客户端断开：丢弃这一轮，下一条消息不会带上没有结果的工具调用
+                conversation.history.drop_last_turn()
+                if isinstance(e, asyncio.CancelledError):
+                    self.cancelled += 1
+                else:
+                    self.failed += 1
+                raise
+            finally:
+                latency = time.perf_counter() - start
+                self.admission.release(latency)
+            self.latency.record(latency)
+            conversation.turns += 1
+            # 存储写入放到线程池中，end_turn 时已没有需要写入的消息
+            await asyncio.to_thread(conversation.history.flush)
+            conversation.history.end_turn()
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(min(60.0, self.idle_timeout))
+            deadline = time.monotonic() - self.idle_timeout
+            for key, conversation in list(self.conversations.items()):
+                if conversation.last_used < deadline and not conversation.lock.locked():
+                    self._remove(key)
+                    self.evictions += 1
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    head = await read_head(reader)
+                    if head is None:
+                        break
+                    request_line, headers, _ = head
+                    method, target, _ = request_line.split(" ", 2)
+                    path = target.split("?", 1)[0].rstrip("/")
+                    length = int(headers.get("content-length") or 0)
+                    body = await reader.readexactly(length) if length else b""
+                except (ValueError, asyncio.LimitOverrunError):
+                    # 起始行或报文头不合法：返回 400，之后的字节无法可靠分帧，关闭连接
+                    writer.write(json_response("400 Bad Request", {"error": "请求格式不正确"}))
+                    await writer.drain()
+                    break
+                keep_alive = await self._route(method, path, headers, body, reader, writer)
+                if not keep_alive or headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, headers: dict, body: bytes, reader, writer) -> bool:
+        """处理一个请求，返回连接是否可以继续复用"""
+        parts = path.strip("/").split("/")
+        if method == "GET" and path == "/health":
+            writer.write(json_response("200 OK", self.stats()))
+        elif method == "POST" and parts == ["v1", "conversations"]:
+            conversation = self.create_conversation()
+            writer.write(json_response("201 Created", {"id": conversation.id}))
+        elif method == "DELETE" and len(parts) == 3 and parts[:2] == ["v1", "conversations"]:
+            conversation = self.conversations.get(parts[2])
+            if conversation is not None and conversation.lock.locked():
+                # 正在处理的一轮结束时会把消息写回存储，删除后会话又会出现
+                writer.write(json_response("409 Conflict", {"error": "该会话还有消息在处理中，稍后再删除"}))
+                await writer.drain()
+                return True
+            found = self._remove(parts[2]) is not None
+            if self.store is not None:
+                found = await asyncio.to_thread(self.store.delete, parts[2]) or found
+            writer.write(json_response("200 OK" if found else "404 Not Found", {"deleted": found}))
+        elif method == "POST" and len(parts) == 4 and parts[:2] == ["v1", "conversations"] and parts[3] == "messages":
+            return await self._message(parts[2], headers, body, reader, writer)
+        else:
+            writer.write(json_response("404 Not Found", {"error": f"{method} {path} 不存在"}))
+        await writer.drain()
+        return True
+
+    async def _message(self, conversation_id: str, headers: dict, body: bytes, reader, writer) -> bool:
+        try:
+            request = json.loads(body or b"{}")
+            query = str(request["query"]).strip()
+        except (ValueError, KeyError, TypeError):
+            writer.write(json_response("400 Bad Request", {"error": "请求体应为 {\"query\": \"...\"}"}))
+            await writer.drain()
+            return True
+        conversation = await self.get_conversation(conversation_id)
+        if conversation.lock.locked():
+            writer.write(json_response("409 Conflict", {"error": "该会话的上一条消息还在处理中"}))
+            await writer.drain()
+            return True
+        stream = request.get("stream", "text/event-stream" in headers.get("accept", ""))
+        if stream:
+            await self._stream_message(conversation, query, reader, writer)
+            return False
+
+        parts = []
+
+        async def collect(text: str):
+            parts.append(text)
+
+        try:
+            await self.run_turn(conversation, query, collect)
+        except Overloaded as e:
+            writer.write(_overloaded_response(e))
+        except Exception as e:
+            writer.write(json_response("500 Internal Server Error", {"error": str(e) or type(e).__name__}))
+        else:
+            writer.write(json_response("200 OK", {"id": conversation.id, "answer": "".join(parts)}))
+        await writer.drain()
+        return True
+
+    async def _stream_message(self, conversation: Conversation, query: str, reader, writer):
+        """
+        以 SSE 返回回复片段：event: delta 为文本片段，event: done 为结束，event: error 为失败。
+        排队期间不发送响应头，被拒绝时仍可以返回 503；客户端断开时取消这一轮
+        """
+        started = False
+
+        async def send(event: str, data: dict):
+            nonlocal started
+            if not started:
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                             b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+                started = True
+            writer.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+            # 客户端读得慢时在这里等待，不会无限堆积输出
+            await writer.drain()
+
+        start = time.perf_counter()
+        turn = asyncio.ensure_future(self.run_turn(conversation, query, lambda text: send("delta", {"text": text})))
+        disconnect = asyncio.ensure_future(reader.read(1))
+        try:
+            await asyncio.wait({turn, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if not turn.done():
+                logger.info(f"会话 {conversation.id} 的客户端已断开，取消本轮")
+                turn.cancel()
+                await asyncio.gather(turn, return_exceptions=True)
+                return
+            error = turn.exception()
+            if isinstance(error, Overloaded) and not started:
+                writer.write(_overloaded_response(error))
+            elif error is not None:
+                await send("error", {"error": str(error) or type(error).__name__})
+            else:
+                await send("done", {"id": conversation.id, "elapsed": round(time.perf_counter() - start, 3)})
+            await writer.drain()
+        finally:
+            disconnect.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "conversations": len(self.conversations),
+            "memory_bytes": self.memory_bytes,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "admission": self.admission.stats(),
+            **{f"turn_{k}": v for k, v in self.latency.summary().items()},
+        }
+
+    async def start(self, host: str = "0.0.0.0", port: int = 8080):
+        self._server = await asyncio.start_server(self._handle, host, port, backlog=1024)
+        self._sweeper = asyncio.create_task(self._sweep())
+        logger.info(f"网关已启动: http://{host}:{port}")
+        return self
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+
+def _overloaded_response(error: Overloaded) -> bytes:
+    body = json.dumps({"error": str(error), "retry_after": error.retry_after}, ensure_ascii=False).encode("utf-8")
+    return (f"HTTP/1.1 503 Service Unavailable\r\nContent-Type: application/json\r\n"
+            f"Retry-After: {math.ceil(error.retry_after)}\r\nContent-Length: {len(body)}\r\n\r\n").encode(
+        "latin-1") + body
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="多会话 HTTP/SSE 网关")
+    parser.add_argument("--server", action="append", default=[], help="MCP 服务器脚本路径或地址，可重复指定")
+    parser.add_argument("--transport", choices=list(TRANSPORTS) + ["auto"], default=None,
+                        help="传输方式，默认按 --server 判断")
+    parser.add_argument("--backend", choices=list(BACKENDS), default="openai", help="模型后端")
+    parser.add_argument("--model", default=None, help="模型名，默认使用后端的默认模型")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-active", type=int, default=64, help="同时处理的轮数上限")
+    parser.add_argument("--max-queue", type=int, default=256, help="等待队列长度上限")
+    parser.add_argument("--queue-timeout", type=float, default=10.0, help="排队的最长时间（秒）")
+    parser.add_argument("--target-latency", type=float, default=20.0, help="一轮的目标耗时（秒），超过时降低并发上限")
+    parser.add_argument("--tool-top-k", type=int, default=0, help="每次提问只提供最相关的 k 个工具，0 表示全部")
+    parser.add_argument("--store", default=None,
+                        help="会话存储，sqlite[:路径] 或 jsonl[:目录]，默认读取环境变量 MCP_CONVERSATION_STORE")
+    parser.add_argument("--max-memory-mb", type=float, default=0, help="内存中会话历史的总大小上限（MB），0 表示不限制")
+    parser.add_argument("--recent-turns", type=int, default=20, help="从存储中恢复会话时加载的最近轮数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    configure_from_env()
+    backend = cached_backend_from_env(create_backend(args.backend, **({"model": args.model} if args.model else {})))
+    agent = Agent(backend, prefix_tools=len(args.server) > 1, tool_top_k=args.tool_top_k)
+    configs = [config_from_target(target, args.transport) for target in args.server]
+    if len(configs) > 1:
+        for index, config in enumerate(configs):
+            config['id'] = f"server{index + 1}"
+    admission = AdmissionController(max_active=args.max_active, max_queue=args.max_queue,
+                                    queue_timeout=args.queue_timeout, target_latency=args.target_latency)
+    store = create_store(args.store) if args.store else store_from_env()
+    gateway = Gateway(agent, admission, store=store, max_memory_bytes=int(args.max_memory_mb * 1024 * 1024),
+                      recent_turns=args.recent_turns)
+    try:
+        await agent.connect_all(configs)
+        await gateway.start(args.host, args.port)
+        await asyncio.Event().wait()
+    finally:
+        await gateway.close()
+        logger.info(f"网关统计: {gateway.stats()}")
+        try:
+            await agent.cleanup()
+        finally:
+            # agent.cleanup 中途失败时也要结束预热进程，close_pools 可以重复调用
+            await close_pools()
+            if store is not None:
+                store.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,283 @@
+# encoding=utf-8
+# created @2025/5/13
+# created by zhanzq
+#
+
+import asyncio
+import json
+import logging
+import re
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 各模型每次请求允许的历史记录 token 预算（不含工具 schema 和回复）
+MODEL_TOKEN_BUDGETS = {
+    "qwen2.5": 24000,
+    "claude-3-5-sonnet-20241022": 150000,
+}
+DEFAULT_TOKEN_BUDGET = 8000
+
+SUMMARY_PROMPT = "请用中文简要总结以下对话，保留用户的偏好、已确认的事实和工具调用得到的关键结果，不超过300字。"
+
+_CJK_PATTERN = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+
+try:
+    import tiktoken
+
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken 未安装或编码文件不可用时退化为估算
+    _ENCODING = None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的 token 数，安装了 tiktoken 时精确计算，否则中日韩字符按 1 个 token、其余按 4 个字符 1 个 token 估算
+    :param text: 文本
+    :return: int
+    """
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_text(message: dict) -> str:
+    """取出消息中参与计费的文本，兼容 OpenAI 的 tool_calls 和 Anthropic 的内容块"""
+    content = message.get("content")
+    if isinstance(content, str):
+        text = content
+    elif content is None:
+        text = ""
+    else:
+        text = json.dumps(content, ensure_ascii=False, default=str)
+    if message.get("tool_calls"):
+        text += json.dumps(message["tool_calls"], ensure_ascii=False)
+    return text
+
+
+def message_tokens(message: dict) -> int:
+    # 每条消息额外计入角色等格式开销
+    return estimate_tokens(message_text(message)) + 4
+
+
+def is_turn_start(message: dict) -> bool:
+    """用户的提问开启新的一轮；Anthropic 的 tool_result 虽然是 user 角色，但属于上一轮"""
+    if message.get("role") != "user":
+        return False
+    content = message.get("content")
+    if isinstance(content, list):
+        return not any(isinstance(block, dict) and block.get("type") == "tool_result" for block in content)
+    return True
+
+
+def message_bytes(message: dict) -> int:
+    """消息文本占用的字节数，用于估算会话的内存占用"""
+    return len(message_text(message).encode("utf-8"))
+
+
+def render_for_summary(messages: List[dict]) -> str:
+    """将一段历史记录整理成纯文本，供摘要模型阅读"""
+    return "\n".join(f"{message.get('role')}: {message_text(message)}" for message in messages)
+
+
+class HistoryManager:
+    """
+    带 token 预算的会话历史。
+    全部消息按轮保存，每次请求只发送摘要 + 预算内最近的若干轮；
+    一轮包含用户提问及其后的 assistant/tool 消息，因此工具调用和工具结果总是成对出现。
+    历史超过预算的一定比例时，在后台把较早的轮次合并进摘要。
+    指定 store 时，每轮结束只把这一轮的新消息追加到存储中，摘要单独记录，不重写整段历史。
+    """
+
+    def __init__(self, model: str, budget: Optional[int] = None, keep_recent_turns: int = 4,
+                 summarizer: Optional[Callable[[List[dict], str], Awaitable[str]]] = None,
+                 summary_trigger: float = 0.75, store=None, conversation_id: Optional[str] = None):
+        """
+        :param model: 模型名，用于查找默认 token 预算
+        :param budget: token 预算，为 None 时使用 MODEL_TOKEN_BUDGETS 中的值
+        :param keep_recent_turns: 摘要时保留不动的最近轮数
+        :param summarizer: 异步摘要函数 (待摘要消息, 已有摘要) -> 新摘要，为 None 时只做窗口截断
+        :param summary_trigger: 历史 token 数超过预算的该比例时触发摘要
+        :param store: 会话存储（conversation_store.ConversationStore），为 None 时只保存在内存中
+        :param conversation_id: 会话在存储中的ID
+        """
+        self.model = model
+        self.budget = budget or MODEL_TOKEN_BUDGETS.get(model, DEFAULT_TOKEN_BUDGET)
+        self.keep_recent_turns = keep_recent_turns
+        self.summarizer = summarizer
+        self.summary_trigger = summary_trigger
+        self.summary = ""
+        self.last_prompt_tokens = 0
+        self.summaries = 0
+        self._messages: List[dict] = []
+        self._tokens: List[int] = []
+        self._summary_task: Optional[asyncio.Task] = None
+        self.store = store
+        self.conversation_id = conversation_id
+        # 消息占用的字节数，增删时增量维护
+        self.memory_bytes = 0
+        # _messages[0] 在整个会话中的序号，以及已写入存储的消息数
+        self._base = 0
+        self._flushed = 0
+        # 摘要覆盖了序号小于它的消息；窗口加载后它可能小于 _base，中间的消息还在磁盘上、没有并入摘要
+        self._summary_seq = 0
+
+    @classmethod
+    def load(cls, store, conversation_id: str, model: str, recent_turns: Optional[int] = 20,
+             **kwargs) -> Optional["HistoryManager"]:
+        """
+        从存储中恢复会话：只加载摘要和最近的 recent_turns 轮
+        :param store: 会话存储
+        :param conversation_id: 会话ID
+        :param model: 模型名
+        :param recent_turns: 加载的轮数，为 None 时加载摘要之后的全部消息，为 0 时只加载摘要
+        :param kwargs: 其余参数同 __init__
+        :return: HistoryManager，会话不存在时返回 None
+        """
+        loaded = store.load(conversation_id, recent_turns)
+        if loaded is None:
+            return None
+        messages, summary, covered, first = loaded
+        history = cls(model, store=store, conversation_id=conversation_id, **kwargs)
+        history.summary = summary
+        history._summary_seq = covered
+        history._base = first
+        history.extend(messages)
+        history._flushed = len(messages)
+        return history
+
+    def append(self, message: dict):
+        self._messages.append(message)
+        self._tokens.append(message_tokens(message))
+        self.memory_bytes += message_bytes(message)
+
+    def extend(self, messages: List[dict]):
+        for message in messages:
+            self.append(message)
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self._tokens)
+
+    def _turn_starts(self) -> List[int]:
+        starts = [i for i, message in enumerate(self._messages) if is_turn_start(message)]
+        if not starts or starts[0] != 0:
+            starts.insert(0, 0)
+        return starts
+
+    def _summary_messages(self) -> List[dict]:
+        if not self.summary:
+            return []
+        # 以一问一答的形式放在最前面，OpenAI 和 Anthropic 都能接受
+        return [
+            {"role": "user", "content": f"以下是之前对话的摘要：\n{self.summary}"},
+            {"role": "assistant", "content": "好的，我已了解之前的对话内容。"},
+        ]
+
+    def prompt(self) -> List[dict]:
+        """
+        生成本次请求要发送的消息：摘要 + 预算内最近的完整轮次，最新一轮总是保留
+        :return: list
+        """
+        prefix = self._summary_messages()
+        remaining = self.budget - sum(message_tokens(message) for message in prefix)
+        starts = self._turn_starts()
+        first = len(self._messages)
+        for start in reversed(starts):
+            cost = sum(self._tokens[start:first])
+            if first != len(self._messages) and cost > remaining:
+                break
+            remaining -= cost
+            first = start
+        messages = prefix + self._messages[first:]
+        self.last_prompt_tokens = self.budget - remaining
+        if first > 0:
+            logger.debug(f"历史记录超出预算，丢弃最早的 {first} 条消息")
+        return messages
+
+    def drop_last_turn(self):
+        """丢弃最后一轮（用户提问及其后的消息），用于该轮失败或被取消时，避免留下没有结果的工具调用"""
+        starts = [i for i, message in enumerate(self._messages) if is_turn_start(message)]
+        if starts:
+            self.memory_bytes -= sum(message_bytes(message) for message in self._messages[starts[-1]:])
+            del self._messages[starts[-1]:]
+            del self._tokens[starts[-1]:]
+            self._flushed = min(self._flushed, starts[-1])
+
+    def flush(self):
+        """把尚未写入存储的消息追加到存储中"""
+        if self.store is None or self._flushed >= len(self._messages):
+            return
+        self.store.append(self.conversation_id, self._base + self._flushed, self._messages[self._flushed:])
+        self._flushed = len(self._messages)
+
+    def end_turn(self):
+        """一轮对话结束后调用：写入存储，必要时在后台启动摘要"""
+        self.flush()
+        if self.summarizer is None or self._summary_task is not None:
+            return
+        if self.total_tokens < self.budget * self.summary_trigger:
+            return
+        starts = self._turn_starts()
+        if len(starts) <= self.keep_recent_turns:
+            return
+        cut = starts[-self.keep_recent_turns] if self.keep_recent_turns else len(self._messages)
+        self._summary_task = asyncio.create_task(self._summarize(cut))
+
+    async def _summarize(self, cut: int):
+        try:
+            aged = self._messages[:cut]
+            gap = []
+            if self.store is not None and self._summary_seq < self._base:
+                # 加载时跳过的较早轮次还没有进过摘要，和这次移出的消息一起摘要，否则它们会被跳过
+                gap = await asyncio.to_thread(self.store.load_range, self.conversation_id,
+                                              self._summary_seq, self._base)
+            summary = await self.summarizer(gap + aged, self.summary)
+            # 摘要期间只会在末尾追加消息，前 cut 条不变，可以直接替换
+            self.memory_bytes -= sum(message_bytes(message) for message in aged)
+            del self._messages[:cut]
+            del self._tokens[:cut]
+            self._base += cut
+            self._summary_seq = self._base
+            self._flushed = max(0, self._flushed - cut)
+            self.summary = summary
+            self.summaries += 1
+            if self.store is not None:
+                self.store.save_summary(self.conversation_id, summary, self._base)
+            logger.info(f"已将 {cut} 条较早的消息合并进摘要，当前历史 {self.total_tokens} tokens")
+        except Exception as e:
+            logger.error(f"历史记录摘要失败: {str(e)}")
+        finally:
+            self._summary_task = None
+
+    async def wait_summary(self):
+        """等待正在进行的后台摘要完成"""
+        if self._summary_task is not None:
+            await self._summary_task
+
+    def stats(self) -> dict:
+        return {
+            "messages": len(self._messages),
+            "turns": len([m for m in self._messages if is_turn_start(m)]),
+            "history_tokens": self.total_tokens,
+            "prompt_tokens": self.last_prompt_tokens,
+            "budget": self.budget,
+            "summaries": self.summaries,
+            "memory_bytes": self.memory_bytes + len(self.summary.encode("utf-8")),
+        }
+
+
+def prompt_messages(history_messages) -> list:
+    """process_query 同时支持普通列表和 HistoryManager"""
+    if isinstance(history_messages, HistoryManager):
+        return history_messages.prompt()
+    return history_messages
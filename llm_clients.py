@@ -0,0 +1,73 @@
+# encoding=utf-8
+# created @2025/5/7
+# created by zhanzq
+#
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# 默认连接池大小，多个会话并发时共用同一组 keep-alive 连接
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_MAX_KEEPALIVE = 32
+
+
+def create_http_client(max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                       max_keepalive: int = DEFAULT_MAX_KEEPALIVE,
+                       timeout: float = 120.0) -> httpx.AsyncClient:
+    """
+    创建带连接池的异步 HTTP 客户端
+    :param max_connections: 最大连接数
+    :param max_keepalive: 最大空闲 keep-alive 连接数
+    :param timeout: 请求超时时间（秒）
+    :return: httpx.AsyncClient
+    """
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+    return httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(timeout, connect=10.0))
+
+
+def create_async_openai(api_key: str, base_url: str, **pool_kwargs):
+    """创建 OpenAI 兼容接口（Qwen/ollama）的异步客户端"""
+    # 按需导入，只用其中一种模型时不要求两个SDK都安装
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=create_http_client(**pool_kwargs))
+
+
+def create_async_anthropic(api_key: str, **pool_kwargs):
+    """创建 Anthropic 异步客户端"""
+    from anthropic import AsyncAnthropic
+    return AsyncAnthropic(api_key=api_key, http_client=create_http_client(**pool_kwargs))
+
+
+async def run_conversations(process_query: Callable[..., Awaitable[str]],
+                            conversations: List[List[str]],
+                            concurrency: int = 8) -> List[List[str]]:
+    """
+    在同一进程内并发运行多个会话，每个会话有独立的历史记录，会话内的问题按顺序处理
+    :param process_query: 客户端的 process_query 方法
+    :param conversations: 会话列表，每个会话是一组按顺序提问的问题
+    :param concurrency: 同时进行的会话数上限
+    :return: 与 conversations 一一对应的回答列表
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(idx: int, queries: List[str]) -> List[str]:
+        async with semaphore:
+            history_messages = []
+            answers = []
+            start = time.perf_counter()
+            for query in queries:
+                try:
+                    answers.append(await process_query(query, history_messages=history_messages))
+                except Exception as e:
+                    logger.error(f"会话 {idx} 处理问题失败: {str(e)}")
+                    answers.append(f"Error: {str(e)}")
+            logger.info(f"会话 {idx} 完成，共 {len(queries)} 轮，耗时 {time.perf_counter() - start:.2f}s")
+            return answers
+
+    return await asyncio.gather(*(run_one(idx, queries) for idx, queries in enumerate(conversations)))
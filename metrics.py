@@ -0,0 +1,135 @@
+# encoding=utf-8
+# created @2025/5/10
+# created by zhanzq
+#
+
+import math
+from collections import deque
+from typing import List, Optional
+
+
+class LatencyRecorder:
+    """
+    延迟样本记录器，保存全部样本（或最近 max_samples 个），用于计算分位数并输出 HdrHistogram 格式的分布
+    """
+
+    def __init__(self, max_samples: Optional[int] = None):
+        """
+        :param max_samples: 只保留最近的样本数（滑动窗口），为 None 时保存全部样本；长时间运行的服务用它限制内存
+        """
+        self._samples: List[float] = []
+        self._sorted = True
+        self.total = 0.0
+        # 按记录顺序保存的最近样本，_samples 是读取时由它生成的排序副本
+        self._window: Optional[deque] = deque(maxlen=max_samples) if max_samples else None
+
+    def record(self, value: float):
+        """
+        记录一个样本
+        :param value: 延迟（秒）
+        """
+        if self._window is not None:
+            if len(self._window) == self._window.maxlen:
+                self.total -= self._window[0]
+            self._window.append(value)
+        else:
+            self._samples.append(value)
+        self._sorted = False
+        self.total += value
+
+    def merge(self, other: "LatencyRecorder"):
+        if self._window is not None or other._window is not None:
+            for value in (other._window if other._window is not None else other._samples):
+                self.record(value)
+            return
+        self._samples.extend(other._samples)
+        self._sorted = False
+        self.total += other.total
+
+    def reset(self):
+        self._samples = []
+        self._sorted = True
+        self.total = 0.0
+        if self._window is not None:
+            self._window.clear()
+
+    def _sorted_samples(self) -> List[float]:
+        # 记录时只追加，读取分位数时才排序
+        if not self._sorted:
+            if self._window is not None:
+                self._samples = sorted(self._window)
+            else:
+                self._samples.sort()
+            self._sorted = True
+        return self._samples
+
+    @property
+    def count(self) -> int:
+        return len(self._window) if self._window is not None else len(self._samples)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def max(self) -> float:
+        return self._sorted_samples()[-1] if self.count else 0.0
+
+    def percentile(self, p: float) -> float:
+        """
+        计算分位数（nearest-rank）
+        :param p: 百分位，取值 0~100
+        :return: float
+        """
+        samples = self._sorted_samples()
+        if not samples:
+            return 0.0
+        rank = max(1, math.ceil(p / 100 * len(samples)))
+        return samples[min(rank, len(samples)) - 1]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+    def hdr_percentile_distribution(self, ticks_per_half_distance: int = 5, unit_scale: float = 1000.0) -> str:
+        """
+        以 HdrHistogram 的 "percentile distribution" 文本格式输出，可以直接用 HdrHistogram 的绘图工具查看
+        :param ticks_per_half_distance: 每个“半距离”区间输出的分位点数
+        :param unit_scale: 输出单位换算，默认秒转毫秒
+        :return: str
+        """
+        lines = [f"{'Value':>12} {'Percentile':>14} {'TotalCount':>10} {'1/(1-Percentile)':>14}", ""]
+        count = self.count
+        if count:
+            percentiles = []
+            # 与 HdrHistogram 一致：越接近 100% 分位点越密
+            half_distance = 50.0
+            p = 0.0
+            while p < 100.0 and half_distance > 100.0 / (count * 2):
+                step = half_distance / ticks_per_half_distance
+                for _ in range(ticks_per_half_distance):
+                    percentiles.append(p)
+                    p += step
+                half_distance /= 2
+            percentiles.append(100.0)
+            for p in percentiles:
+                value = self.percentile(p) * unit_scale
+                total_count = max(1, math.ceil(p / 100 * count))
+                inverse = "" if p >= 100.0 else f"{1 / (1 - p / 100):14.2f}"
+                lines.append(f"{value:12.3f} {p / 100:14.12f} {total_count:10d} {inverse}")
+        lines.append(f"#[Mean    = {self.mean * unit_scale:12.3f}, StdDeviation   = {self._stddev() * unit_scale:12.3f}]")
+        lines.append(f"#[Max     = {self.max * unit_scale:12.3f}, Total count    = {count:12d}]")
+        return "\n".join(lines) + "\n"
+
+    def _stddev(self) -> float:
+        samples = self._sorted_samples()
+        if not samples:
+            return 0.0
+        mean = self.mean
+        return math.sqrt(sum((v - mean) ** 2 for v in samples) / len(samples))
@@ -0,0 +1,165 @@
+# encoding=utf-8
+# created @2025/5/24
+# created by zhanzq
+#
+# 工具结果的后处理：按 (服务器, 工具名) 注册处理函数，查找是一次字典访问；
+# 处理完的结果超过长度上限时先截断再写入历史记录，避免一次大结果占满上下文。
+#   @registry.register("工具名")                 所有服务器上的同名工具
+#   @registry.register("工具名", server_id="s1")  只针对某个服务器，优先于上一种
+#
+
+import json
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 结果写入历史记录前的默认长度上限（字符），为 0 时不限制
+DEFAULT_MAX_RESULT_CHARS = 8000
+
+Processor = Callable[[str], str]
+
+# 直接定位 image_url 字段，不构建完整的 JSON 对象；兼容 Python repr 风格的单引号
+_IMAGE_URL = re.compile(r"""["']image_url["']\s*:\s*(?:"((?:[^"\\]|\\.)*)"|'([^'\\]*)')""")
+
+
+def parse_keling_image_result(image_exec_result: str) -> str:
+    """
+    解析可灵图像生成接口的返回结果，提取生成的图片 URL。
+    Args:
+        image_exec_result (str): 可灵图像接口返回的数据，包括状态码、信息和图像 URL。
+    Returns:
+        str: 图片地址说明；结果不是 JSON 对象时（如服务器返回的错误信息）原样返回。
+    Example:
+        >>> result = '{"sid": "12345", "code": 0, "message": "success", "data": {"image_url": "https://abc/image.jpg"}}'
+        >>> parse_keling_image_result(result)
+        '图片生成成功，地址为：https://abc/image.jpg'
+    """
+    if not image_exec_result.lstrip().startswith("{"):
+        return image_exec_result
+    # 先用 str.find 定位字段名（远快于在整段文本上跑正则），再在该位置匹配
+    match = None
+    pos = image_exec_result.find("image_url")
+    while pos > 0 and match is None:
+        match = _IMAGE_URL.match(image_exec_result, pos - 1)
+        pos = image_exec_result.find("image_url", pos + 1)
+    if match is None:
+        return "图片生成失败"
+    if match.group(1) is not None:
+        # 双引号字符串可能带转义，按 JSON 字符串解码
+        data_path = json.loads(f'"{match.group(1)}"')
+    else:
+        data_path = match.group(2)
+    if data_path:
+        return f"图片生成成功，地址为：{data_path}"
+    return "图片生成失败"
+
+
+def truncate_text(text: str, max_chars: int) -> str:
+    """保留开头和结尾，中间用省略说明代替"""
+    if len(text) <= max_chars:
+        return text
+    head = max_chars * 2 // 3
+    tail = max_chars - head
+    return f"{text[:head]}\n...[已省略 {len(text) - head - tail} 个字符]...\n{text[-tail:]}"
+
+
+def shrink_json_array(text: str, max_chars: int) -> Optional[str]:
+    """
+    JSON 数组按元素截断：逐个解析元素，放不下时停止，后面的部分不再解析
+    :param text: 以 [ 开头的 JSON 文本
+    :param max_chars: 长度上限
+    :return: 截断后的 JSON 文本和说明；不是合法的 JSON 数组（包括 ] 之后还有其它内容）或一项都放不下时返回 None，
+        由调用方按字符截断
+    """
+    budget = max_chars - 64
+    if budget <= 2 or not text.rstrip().endswith("]"):
+        return None
+    decoder = json.JSONDecoder()
+    pos = text.index("[") + 1
+    kept: List[str] = []
+    size = 2
+    length = len(text)
+    while True:
+        while pos < length and text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= length:
+            return None
+        if text[pos] == "]":
+            if text[pos + 1:].strip():
+                return None
+            break
+        try:
+            item, pos = decoder.raw_decode(text, pos)
+        except ValueError:
+            return None
+        encoded = json.dumps(item, ensure_ascii=False)
+        if size + len(encoded) + 1 > budget:
+            if not kept:
+                return None
+            return f"[{','.join(kept)}]\n...[结果过长，仅保留前 {len(kept)} 项，原结果 {length} 个字符]"
+        kept.append(encoded)
+        size += len(encoded) + 1
+    # 整个数组都放得下（原文空白较多），返回紧凑形式
+    return f"[{','.join(kept)}]"
+
+
+def shrink_result(text: str, max_chars: int) -> str:
+    """超过长度上限的结果：JSON 数组按元素截断，其它按字符截断"""
+    if text.lstrip().startswith("["):
+        shrunk = shrink_json_array(text, max_chars)
+        if shrunk is not None and len(shrunk) <= max_chars + 128:
+            return shrunk
+    return truncate_text(text, max_chars)
+
+
+class PostProcessorRegistry:
+    """工具结果后处理函数的注册表"""
+
+    def __init__(self, max_chars: int = DEFAULT_MAX_RESULT_CHARS):
+        """
+        :param max_chars: 结果长度上限（字符），为 0 时不限制
+        """
+        self.max_chars = max_chars
+        self.truncated = 0
+        # (服务器ID 或 None, 工具名) -> 处理函数列表，按注册顺序执行
+        self._processors: Dict[Tuple[Optional[str], str], List[Processor]] = {}
+        # (服务器ID, 工具名) -> 实际使用的处理函数，首次查找后缓存
+        self._resolved: Dict[Tuple[str, str], Tuple[Processor, ...]] = {}
+
+    def register(self, tool_name: str, processor: Optional[Processor] = None, server_id: Optional[str] = None):
+        """
+        注册处理函数，可以作为装饰器使用
+        :param tool_name: 工具在服务器上的原始名称
+        :param processor: 处理函数 str -> str
+        :param server_id: 只对该服务器生效，为 None 时对所有服务器生效
+        """
+        if processor is None:
+            return lambda fn: self.register(tool_name, fn, server_id) or fn
+        self._processors.setdefault((server_id, tool_name), []).append(processor)
+        self._resolved.clear()
+
+    def processors(self, server_id: str, tool_name: str) -> Tuple[Processor, ...]:
+        key = (server_id, tool_name)
+        chain = self._resolved.get(key)
+        if chain is None:
+            chain = tuple(self._processors.get(key) or self._processors.get((None, tool_name)) or ())
+            self._resolved[key] = chain
+        return chain
+
+    def process(self, server_id: str, tool_name: str, text: str) -> str:
+        """
+        依次执行该工具的处理函数，再按长度上限截断
+        :param server_id: 服务器标识
+        :param tool_name: 工具在服务器上的原始名称
+        :param text: 工具返回的文本
+        :return: str
+        """
+        for processor in self.processors(server_id, tool_name):
+            text = processor(text)
+        if self.max_chars and len(text) > self.max_chars:
+            self.truncated += 1
+            text = shrink_result(text, self.max_chars)
+        return text
+
+
+default_registry = PostProcessorRegistry()
+default_registry.register("文生图-可灵版-MCP", parse_keling_image_result)
@@ -0,0 +1,240 @@
+# encoding=utf-8
+# created @2025/5/22
+# created by zhanzq
+#
+# 预热的 stdio 服务器进程池。
+# Python/Node 的 MCP 服务器冷启动（解释器启动 + 导入依赖 + initialize）要几百毫秒到几秒，
+# 进程池预先启动若干个进程并完成 initialize() 和 list_tools()，新会话直接取走一个已就绪的连接，
+# 取走后在后台补充；空闲进程崩溃时自动重启。
+#
+# 取走的连接归调用方所有，用完直接关闭（MCP 会话有状态，进程不回收复用）。
+#
+
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, List, Optional
+
+from connections import DEFAULT_CONNECT_TIMEOUT, ServerConnection, resolve_transport
+from metrics import LatencyRecorder
+
+logger = logging.getLogger(__name__)
+
+# 进程启动失败后的重试间隔（秒），连续失败时加倍
+RESPAWN_BACKOFF = 0.5
+RESPAWN_BACKOFF_MAX = 30.0
+
+
+class StdioProcessPool:
+    """
+    同一个 stdio 服务器脚本的预热进程池。
+    池中始终保持 size 个已完成 initialize() 的连接（含正在启动的），acquire() 有就绪连接时立即返回。
+    """
+
+    def __init__(self, server_config: dict, size: int = 2, check_interval: float = 1.0):
+        """
+        :param server_config: 服务器配置字典，格式同 ServerConnection，传输方式必须是 stdio
+        :param size: 保持的预热进程数
+        :param check_interval: 检查空闲进程是否存活的间隔（秒）
+        """
+        if resolve_transport(server_config) != "stdio":
+            raise ValueError(f"预热进程池只支持 stdio 服务器: {server_config.get('id')}")
+        self.server_config = server_config
+        self.size = size
+        self.check_interval = check_interval
+        self.idle: List[ServerConnection] = []
+        self.spawn_ready = LatencyRecorder()
+        self.acquire_wait = LatencyRecorder()
+        self.spawned = 0
+        self.restarts = 0
+        self.failures = 0
+        self.hits = 0
+        self.misses = 0
+        self._spawning = 0
+        self._backoff = RESPAWN_BACKOFF
+        self._condition = asyncio.Condition()
+        self._supervisor: Optional[asyncio.Task] = None
+        self._background = set()
+        self._closed = False
+
+    async def start(self, wait: bool = True):
+        """
+        启动预热进程和后台监控任务
+        :param wait: 是否等待第一批进程全部就绪
+        """
+        self._supervisor = asyncio.create_task(self._supervise(), name=f"process-pool-{self.server_config['id']}")
+        spawns = self._replenish()
+        if wait and spawns:
+            await asyncio.gather(*spawns, return_exceptions=True)
+        return self
+
+    def _replenish(self) -> List[asyncio.Task]:
+        """补足进程数，返回新启动的任务"""
+        tasks = []
+        for _ in range(self.size - len(self.idle) - self._spawning):
+            self._spawning += 1
+            task = asyncio.create_task(self._spawn())
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+            tasks.append(task)
+        return tasks
+
+    async def _spawn(self):
+        # 调用方负责事先把 _spawning 加一
+        config = dict(self.server_config, id=f"{self.server_config['id']}#warm{self.spawned}")
+        self.spawned += 1
+        connection = ServerConnection(config)
+        try:
+            await connection.start()
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"预热进程 {config['id']} 启动失败: {str(e) or type(e).__name__}，{self._backoff:.1f}s 后重试")
+            await asyncio.sleep(self._backoff)
+            self._backoff = min(self._backoff * 2, RESPAWN_BACKOFF_MAX)
+            async with self._condition:
+                self._spawning -= 1
+                self._condition.notify_all()
+            return
+        self._backoff = RESPAWN_BACKOFF
+        elapsed = connection.timings["total"]
+        self.spawn_ready.record(elapsed)
+        logger.info(f"预热进程 {config['id']} 已就绪，启动耗时 {elapsed * 1000:.0f}ms")
+        async with self._condition:
+            self._spawning -= 1
+            if self._closed:
+                closing = True
+            else:
+                closing = False
+                self.idle.append(connection)
+            self._condition.notify_all()
+        if closing:
+            await connection.close()
+
+    async def _supervise(self):
+        """回收已退出的空闲进程并补足进程数"""
+        while not self._closed:
+            dead = [connection for connection in self.idle if not connection.is_alive]
+            if dead:
+                async with self._condition:
+                    self.idle = [connection for connection in self.idle if connection not in dead]
+                self.restarts += len(dead)
+                for connection in dead:
+                    logger.warning(f"预热进程 {connection.server_id} 已退出，重新启动")
+                    await connection.close()
+            self._replenish()
+            await asyncio.sleep(self.check_interval)
+
+    async def acquire(self, server_id: Optional[str] = None, timeout: Optional[float] = None) -> ServerConnection:
+        """
+        取出一个已就绪的连接，并在后台补充新进程
+        :param server_id: 连接的服务器标识，默认为进程池配置中的 id
+        :param timeout: 没有就绪连接时的最长等待时间（秒）
+        :return: 已完成 initialize() 和 list_tools() 的 ServerConnection，由调用方关闭
+        """
+        start = time.perf_counter()
+        hit = True
+
+        async def take() -> ServerConnection:
+            nonlocal hit
+            async with self._condition:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("预热进程池已关闭")
+                    while self.idle:
+                        connection = self.idle.pop(0)
+                        if connection.is_alive:
+                            return connection
+                        self.restarts += 1
+                        self._close_in_background(connection)
+                    hit = False
+                    self._replenish()
+                    await self._condition.wait()
+
+        connection = await asyncio.wait_for(take(), timeout=timeout)
+        self._replenish()
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.acquire_wait.record(time.perf_counter() - start)
+        connection.server_id = server_id or self.server_config['id']
+        return connection
+
+    def _close_in_background(self, connection: ServerConnection):
+        task = asyncio.create_task(connection.close())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def close(self):
+        self._closed = True
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+        async with self._condition:
+            idle, self.idle = self.idle, []
+            self._condition.notify_all()
+        await asyncio.gather(*(connection.close() for connection in idle))
+        await asyncio.gather(*self._background, return_exceptions=True)
+
+    def stats(self) -> dict:
+        ready = self.spawn_ready.summary()
+        return {
+            "idle": len(self.idle),
+            "spawning": self._spawning,
+            "spawned": self.spawned,
+            "restarts": self.restarts,
+            "failures": self.failures,
+            "hits": self.hits,
+            "misses": self.misses,
+            "spawn_ready_p50": ready["p50"],
+            "spawn_ready_p90": ready["p90"],
+            "spawn_ready_max": ready["max"],
+            "acquire_wait_p50": self.acquire_wait.percentile(50),
+            "acquire_wait_max": self.acquire_wait.max,
+        }
+
+
+# 同一配置的进程池在进程内共享
+_pools: Dict[str, StdioProcessPool] = {}
+
+
+def pool_key(server_config: dict) -> str:
+    """
+    进程池的键：除 id 以外的全部配置项。脚本相同但重连、超时等配置不同的调用方使用各自的进程池，
+    不会拿到按别人的配置启动的连接；id 不同（如会话池的 weather#0、weather#1）时仍然共享
+    """
+    return json.dumps({k: v for k, v in server_config.items() if k != 'id'}, sort_keys=True, default=str)
+
+
+async def get_pool(server_config: dict) -> StdioProcessPool:
+    """按配置返回共享的进程池，第一次使用时创建；池大小取配置中的 warm_pool"""
+    key = pool_key(server_config)
+    pool = _pools.get(key)
+    if pool is None:
+        pool = _pools[key] = StdioProcessPool(server_config, size=int(server_config.get('warm_pool', 2)))
+        await pool.start(wait=False)
+    return pool
+
+
+async def open_connection(server_config: dict) -> ServerConnection:
+    """
+    建立到服务器的连接：配置了 warm_pool 的 stdio 服务器从预热进程池中取，其它情况直接连接
+    :param server_config: 服务器配置字典
+    :return: 已就绪的 ServerConnection
+    """
+    if server_config.get('warm_pool') and resolve_transport(server_config) == "stdio":
+        pool = await get_pool(server_config)
+        timeout = server_config.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT)
+        return await pool.acquire(server_config['id'], timeout=timeout)
+    connection = ServerConnection(server_config)
+    await connection.start()
+    return connection
+
+
+async def close_pools():
+    """关闭所有共享的进程池，进程退出前调用"""
+    pools = list(_pools.values())
+    _pools.clear()
+    for pool in pools:
+        logger.info(f"预热进程池 {pool.server_config['script_path']} 统计: {pool.stats()}")
+    await asyncio.gather(*(pool.close() for pool in pools))
@@ -0,0 +1,220 @@
+# encoding=utf-8
+# created @2025/5/23
+# created by zhanzq
+#
+# 工具调用的容错：每次尝试单独超时、幂等工具按带抖动的指数退避重试、每个服务器一个熔断器。
+# 熔断器打开期间调用直接失败，Agent 也不再把该服务器的工具提供给模型，
+# 某个远程服务器变慢或不可用时，单轮对话的耗时仍然有上限。
+#
+
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Iterable, Optional
+
+import anyio
+import httpx
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
+
+logger = logging.getLogger(__name__)
+
+# 熔断器状态
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """服务器的熔断器处于打开状态"""
+
+    def __init__(self, server_id: str, retry_in: float):
+        self.server_id = server_id
+        self.retry_in = retry_in
+        super().__init__(f"服务器 {server_id} 暂时不可用（熔断中，{retry_in:.0f}s 后重试）")
+
+
+class CircuitBreaker:
+    """
+    连续失败 failure_threshold 次后打开，reset_timeout 秒后进入半开状态，放行一个试探调用：
+    成功则关闭，失败则重新打开
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        :param failure_threshold: 连续失败多少次后打开
+        :param reset_timeout: 打开后多久允许试探（秒）
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.rejected = 0
+        self._state = CLOSED
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probing = False
+        return self._state
+
+    @property
+    def retry_in(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        """是否放行一次调用；半开状态同时只放行一个试探调用"""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self._probing = False
+        self._state = CLOSED
+
+    def release_probe(self):
+        """试探调用既没有成功也没有失败（被取消）时释放名额，下一个调用可以继续试探"""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self._state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self._state != OPEN:
+                self.opens += 1
+            self._state = OPEN
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "opens": self.opens, "rejected": self.rejected}
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """第 attempt 次重试前的等待时间：full jitter，即在 [0, min(max_delay, base_delay * 2^attempt)] 内均匀随机"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def is_connection_error(error: BaseException) -> bool:
+    """连接层面的错误（流已关闭、连接被重置等），而不是服务器返回的业务错误"""
+    if isinstance(error, McpError):
+        return getattr(getattr(error, "error", None), "code", None) == CONNECTION_CLOSED
+    return isinstance(error, (ConnectionError, EOFError, anyio.ClosedResourceError, anyio.BrokenResourceError,
+                              anyio.EndOfStream, httpx.TransportError))
+
+
+def is_idempotent(tool) -> bool:
+    """服务器在工具注解中声明为幂等或只读的工具"""
+    annotations = getattr(tool, "annotations", None)
+    return bool(annotations is not None and (getattr(annotations, "idempotentHint", None)
+                                             or getattr(annotations, "readOnlyHint", None)))
+
+
+class ServerGuard:
+    """单个服务器的调用保护：超时、重试、熔断"""
+
+    def __init__(self, server_id: str, timeout: float = 30.0, retries: int = 2, base_delay: float = 0.2,
+                 max_delay: float = 2.0, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 idempotent_tools: Iterable[str] = ()):
+        """
+        :param server_id: 服务器标识
+        :param timeout: 每次尝试的超时时间（秒）
+        :param retries: 幂等工具失败后的最多重试次数，非幂等工具不重试
+        :param base_delay: 重试退避的基础间隔（秒）
+        :param max_delay: 重试退避的最大间隔（秒）
+        :param failure_threshold: 连续失败多少次后熔断
+        :param reset_timeout: 熔断多久后试探恢复（秒）
+        :param idempotent_tools: 额外指定为幂等、可以重试的工具名
+        """
+        self.server_id = server_id
+        self.timeout = timeout
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.idempotent_tools = set(idempotent_tools)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.calls = 0
+        self.retried = 0
+        self.timeouts = 0
+        self.tool_errors = 0
+
+    @classmethod
+    def from_config(cls, server_config: dict, default_timeout: float = 30.0) -> "ServerGuard":
+        """
+        从服务器配置创建，可选的配置项：
+        'tool_timeout'、'retries'、'breaker_threshold'、'breaker_reset'、'idempotent_tools'
+        """
+        return cls(
+            server_config['id'],
+            timeout=server_config.get('tool_timeout', default_timeout),
+            retries=server_config.get('retries', 2),
+            failure_threshold=server_config.get('breaker_threshold', 5),
+            reset_timeout=server_config.get('breaker_reset', 30.0),
+            idempotent_tools=server_config.get('idempotent_tools', ())
+        )
+
+    @property
+    def available(self) -> bool:
+        """熔断器未打开（半开时也算可用，以便模型的调用成为试探）"""
+        return self.breaker.state != OPEN
+
+    def can_retry(self, tool) -> bool:
+        return tool.name in self.idempotent_tools or is_idempotent(tool)
+
+    async def call(self, fetch: Callable[[], Awaitable], tool_name: str = "", idempotent: bool = False,
+                   timeout: Optional[float] = None):
+        """
+        带超时、重试和熔断地执行一次工具调用
+        :param fetch: 发起调用的协程函数
+        :param tool_name: 工具名，用于日志
+        :param idempotent: 是否允许失败后重试
+        :param timeout: 每次尝试的超时时间（秒），为 None 时使用 self.timeout
+        :return: fetch 的结果
+        """
+        attempts = 1 + (self.retries if idempotent else 0)
+        self.calls += 1
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                raise CircuitOpenError(self.server_id, self.breaker.retry_in)
+            try:
+                result = await asyncio.wait_for(fetch(), timeout=timeout or self.timeout)
+            except asyncio.CancelledError:
+                # 调用方取消（如网关的客户端断开）不说明服务器的状况，不计入熔断，但要释放半开状态的试探名额，
+                # 否则熔断器会一直停在半开状态并拒绝所有调用
+                self.breaker.release_probe()
+                raise
+            except Exception as e:
+                if isinstance(e, McpError) and not is_connection_error(e):
+                    # 服务器正常返回了错误，连接本身没有问题，不计入熔断也不重试
+                    self.breaker.record_success()
+                    raise
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeouts += 1
+                self.breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    raise
+                # 连接断开时，重试会在重连后的新会话上重放请求（见 connections.HealingSession）
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                self.retried += 1
+                logger.warning(f"调用 {self.server_id}/{tool_name} 失败（{str(e) or type(e).__name__}），"
+                               f"{delay:.2f}s 后第 {attempt + 1} 次重试")
+                await asyncio.sleep(delay)
+                continue
+            # 工具返回了错误结果（isError）：服务器正常响应，与 McpError 一样不计入熔断也不重试，单独统计
+            if getattr(result, "isError", False):
+                self.tool_errors += 1
+            self.breaker.record_success()
+            return result
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "retried": self.retried, "timeouts": self.timeouts,
+                "tool_errors": self.tool_errors, **self.breaker.stats()}
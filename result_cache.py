@@ -0,0 +1,182 @@
+# encoding=utf-8
+# created @2025/5/15
+# created by zhanzq
+#
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tool_cache.json")
+
+
+def normalize_args(value):
+    """参数归一化：字典按键排序、去掉值为 None 的键，字符串去掉首尾空白，整数值的浮点数转为整数"""
+    if isinstance(value, dict):
+        return {k: normalize_args(v) for k, v in sorted(value.items()) if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [normalize_args(v) for v in value]
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def make_key(server_id: str, tool_name: str, tool_args) -> tuple:
+    canonical = json.dumps(normalize_args(tool_args or {}), ensure_ascii=False, separators=(",", ":"))
+    return server_id, tool_name, canonical
+
+
+def result_size(result) -> int:
+    """估算 CallToolResult 占用的内存（按文本内容字节数计）"""
+    size = 0
+    for content in getattr(result, "content", None) or []:
+        size += len((getattr(content, "text", None) or getattr(content, "data", None) or "").encode("utf-8"))
+    return size + 64
+
+
+class ToolResultCache:
+    """
+    工具调用结果缓存（需要在配置中开启）。
+    只缓存标记为 pure 的工具，按 (服务器, 工具名, 归一化参数) 做键，每个工具单独的 TTL；
+    按 LRU 淘汰并限制总内存；相同的并发调用只会真正请求一次（single-flight）。
+    """
+
+    def __init__(self, tool_policies: Optional[dict] = None, default_policy: Optional[dict] = None,
+                 max_bytes: int = 16 * 1024 * 1024):
+        """
+        :param tool_policies: {工具名: {"ttl": 秒, "pure": bool}}
+        :param default_policy: 未单独配置的工具使用的策略，默认不缓存
+        :param max_bytes: 缓存占用内存上限（字节）
+        """
+        self.tool_policies = tool_policies or {}
+        self.default_policy = default_policy or {"ttl": 0, "pure": False}
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.bypassed = 0
+        # key -> (过期时间, 结果, 大小)
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._inflight = {}
+
+    @classmethod
+    def from_config(cls, path: str = DEFAULT_CONFIG_PATH) -> Optional["ToolResultCache"]:
+        """
+        从配置文件创建缓存，文件不存在或未开启时返回 None
+        :param path: 配置文件路径，默认是与 tools.json 同目录的 tool_cache.json
+        :return: ToolResultCache 或 None
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        if not config.get("enabled", False):
+            return None
+        return cls(
+            tool_policies=config.get("tools", {}),
+            default_policy=config.get("default"),
+            max_bytes=int(config.get("max_mb", 16) * 1024 * 1024),
+        )
+
+    def policy(self, tool_name: str) -> dict:
+        return self.tool_policies.get(tool_name, self.default_policy)
+
+    def cacheable(self, tool_name: str) -> bool:
+        policy = self.policy(tool_name)
+        return bool(policy.get("pure")) and policy.get("ttl", 0) > 0
+
+    def _get(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result, size = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.bytes -= size
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _put(self, key: tuple, result, ttl: float):
+        size = result_size(result)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[2]
+        self._entries[key] = (time.monotonic() + ttl, result, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    async def get_or_call(self, server_id: str, tool_name: str, tool_args: dict,
+                          fetch: Callable[[], Awaitable]):
+        """
+        命中缓存直接返回，否则调用 fetch；同一个键同时只有一个 fetch 在执行
+        :param server_id: 服务器标识
+        :param tool_name: 工具名
+        :param tool_args: 工具参数
+        :param fetch: 真正调用工具的协程函数，返回 CallToolResult
+        :return: CallToolResult
+        """
+        if not self.cacheable(tool_name):
+            self.bypassed += 1
+            return await fetch()
+
+        key = make_key(server_id, tool_name, tool_args)
+        result = self._get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        task = asyncio.ensure_future(fetch())
+        self._inflight[key] = task
+
+        def done(finished: asyncio.Future):
+            self._inflight.pop(key, None)
+            if finished.cancelled() or finished.exception() is not None:
+                return
+            result = finished.result()
+            # 工具返回错误时不缓存
+            if not getattr(result, "isError", False):
+                self._put(key, result, self.policy(tool_name)["ttl"])
+
+        task.add_done_callback(done)
+        # shield：调用方超时或取消时，其它等待同一结果的调用不受影响
+        return await asyncio.shield(task)
+
+    def invalidate(self, server_id: Optional[str] = None):
+        """清空缓存，指定 server_id 时只清空该服务器的结果"""
+        for key in [k for k in self._entries if server_id is None or k[0] == server_id]:
+            self.bytes -= self._entries.pop(key)[2]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,124 @@
+# encoding=utf-8
+# created @2025/5/26
+# created by zhanzq
+#
+# 工具路由表：暴露给模型的工具名 -> (服务器ID, 会话, 原始工具名, 工具)。
+# 工具名要满足模型接口的限制（OpenAI/Anthropic 均为 ^[a-zA-Z0-9_-]{1,64}$），
+# 不满足、超长或与其它服务器重名时改用 "截断后的名字_哈希" 形式的别名（哈希由服务器ID和原始工具名决定）；
+# 同一服务器的工具在目录刷新、重连后保持原来的名字，历史记录中模型已经用过的工具名仍然可以路由。
+#
+
+import hashlib
+import re
+from typing import Dict, Iterable, NamedTuple, Optional
+
+# 模型接口对工具名的长度限制
+MAX_TOOL_NAME_LENGTH = 64
+
+_INVALID_CHARS = re.compile(r"[^a-zA-Z0-9_-]+")
+_SEPARATOR_RUN = re.compile(r"[_-]{2,}")
+
+
+class Route(NamedTuple):
+    server_id: str
+    session: object
+    name: str
+    tool: object
+
+    @property
+    def schema(self) -> dict:
+        return self.tool.inputSchema
+
+
+def make_alias(server_id: str, tool_name: str, prefix: bool, taken, max_length: int = MAX_TOOL_NAME_LENGTH) -> str:
+    """
+    生成暴露给模型的工具名
+    :param server_id: 服务器标识
+    :param tool_name: 工具在服务器上的原始名称
+    :param prefix: 是否加上服务器ID前缀
+    :param taken: 已被占用的名字
+    :param max_length: 名字的最大长度
+    :return: str
+    """
+    base = f"{server_id}_{tool_name}" if prefix else tool_name
+    if len(base) <= max_length and base not in taken and not _INVALID_CHARS.search(base):
+        return base
+    # 非法字符（如中文工具名）替换掉，只保留可读的部分，靠哈希区分
+    name = _SEPARATOR_RUN.sub("_", _INVALID_CHARS.sub("_", base)).strip("_-") or "tool"
+    digest = hashlib.sha1(f"{server_id}\0{tool_name}".encode("utf-8")).hexdigest()
+    # 哈希前缀本身冲突的概率极低，冲突时加长哈希
+    for size in range(8, len(digest) + 1, 4):
+        alias = f"{name[:max_length - size - 1].rstrip('_')}_{digest[:size]}"
+        if alias not in taken:
+            return alias
+    raise ValueError(f"无法为工具 {server_id}/{tool_name} 生成不冲突的名字")
+
+
+class RoutingTable:
+    """
+    暴露给模型的工具名到服务器工具的映射，查找是一次字典访问。
+    按服务器更新：新表构建完成后整体替换，读取方不会看到更新到一半的状态；
+    其它服务器的别名保持不变，已经转换好的工具 schema 不需要重新生成。
+    """
+
+    def __init__(self, prefix: bool = False, max_length: int = MAX_TOOL_NAME_LENGTH):
+        """
+        :param prefix: 是否在工具名前加上服务器ID
+        :param max_length: 工具名的最大长度
+        """
+        self.prefix = prefix
+        self.max_length = max_length
+        self.updates = 0
+        # 工具名 -> Route
+        self._routes: Dict[str, Route] = {}
+        # 服务器ID -> {原始工具名: 工具名}
+        self._aliases: Dict[str, Dict[str, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    def __contains__(self, server_id: str) -> bool:
+        return server_id in self._aliases
+
+    def update_server(self, server_id: str, session, tools: Iterable):
+        """
+        替换某个服务器的全部路由
+        :param server_id: 服务器标识
+        :param session: 调用该服务器工具使用的会话
+        :param tools: mcp.types.Tool 列表
+        """
+        previous = self._aliases.get(server_id, {})
+        routes = {name: route for name, route in self._routes.items() if route.server_id != server_id}
+        aliases = {}
+        # 先保留该服务器原有工具的名字，目录刷新前后同一个工具的名字不变
+        pending = []
+        for tool in tools:
+            if tool.name in aliases:
+                continue
+            name = previous.get(tool.name)
+            if name is not None and name not in routes:
+                routes[name] = Route(server_id, session, tool.name, tool)
+                aliases[tool.name] = name
+            else:
+                pending.append(tool)
+        for tool in pending:
+            if tool.name in aliases:
+                continue
+            name = make_alias(server_id, tool.name, self.prefix, routes, self.max_length)
+            routes[name] = Route(server_id, session, tool.name, tool)
+            aliases[tool.name] = name
+        self._routes = routes
+        self._aliases = {**self._aliases, server_id: aliases}
+        self.updates += 1
+
+    def remove_server(self, server_id: str):
+        self._routes = {name: route for name, route in self._routes.items() if route.server_id != server_id}
+        self._aliases = {key: value for key, value in self._aliases.items() if key != server_id}
+        self.updates += 1
+
+    def get(self, name: str) -> Optional[Route]:
+        return self._routes.get(name)
+
+    def alias(self, server_id: str, tool_name: str) -> str:
+        """服务器上的原始工具名对应的暴露名"""
+        return self._aliases[server_id][tool_name]
@@ -0,0 +1,325 @@
+# encoding=utf-8
+# created @2025/5/21
+# created by zhanzq
+#
+# MCP 工具 schema 的转换与参数校验。
+# inputSchema 原样保留（枚举、嵌套对象、数组、$defs 等），只做必要的整理；整理结果和编译好的参数校验器
+# 都按 schema 内容的哈希缓存，同一个 schema 无论出现在多少个工具、多少个后端中都只处理一次。
+#
+
+import hashlib
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+# 值为子 schema 的关键字
+_SCHEMA_KEYWORDS = ("items", "additionalProperties", "not", "contains", "if", "then", "else")
+# 值为子 schema 列表的关键字
+_SCHEMA_LIST_KEYWORDS = ("anyOf", "oneOf", "allOf", "prefixItems")
+# 值为 {名称: 子 schema} 的关键字
+_SCHEMA_MAP_KEYWORDS = ("properties", "patternProperties", "$defs", "definitions")
+
+_JSON_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "object": (dict,),
+    "array": (list, tuple),
+    "null": (type(None),),
+}
+
+_hash_by_id: Dict[int, tuple] = {}
+_normalized_cache: Dict[str, dict] = {}
+_validator_cache: Dict[str, "ArgumentValidator"] = {}
+
+
+def schema_hash(schema: Optional[dict]) -> str:
+    """schema 内容的哈希，键顺序不影响结果"""
+    # 同一个 schema 对象（工具目录中的 inputSchema）反复出现时，不必每次重新序列化
+    entry = _hash_by_id.get(id(schema))
+    if entry is not None and entry[0] is schema:
+        return entry[1]
+    canonical = json.dumps(schema or {}, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    digest = hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+    if len(_hash_by_id) >= 4096:
+        _hash_by_id.clear()
+    # 保存对象本身，防止对象被回收后 id 被复用
+    _hash_by_id[id(schema)] = (schema, digest)
+    return digest
+
+
+def _strip_titles(schema):
+    """去掉 pydantic 自动生成的 title，减少发送给模型的 token；属性名为 title 的参数不受影响"""
+    if not isinstance(schema, dict):
+        return schema
+    result = {}
+    for key, value in schema.items():
+        if key == "title":
+            continue
+        if key in _SCHEMA_KEYWORDS:
+            result[key] = _strip_titles(value)
+        elif key in _SCHEMA_LIST_KEYWORDS and isinstance(value, list):
+            result[key] = [_strip_titles(item) for item in value]
+        elif key in _SCHEMA_MAP_KEYWORDS and isinstance(value, dict):
+            result[key] = {name: _strip_titles(item) for name, item in value.items()}
+        else:
+            result[key] = value
+    return result
+
+
+def normalize_schema(schema: Optional[dict]) -> dict:
+    """
+    把 MCP 的 inputSchema 整理成函数调用接口可以接受的参数 schema：
+    顶层保证是 object 且有 properties，required 只保留确实存在的参数，其余结构原样保留
+    :param schema: tool.inputSchema
+    :return: dict，调用方不应修改返回值
+    """
+    key = schema_hash(schema)
+    normalized = _normalized_cache.get(key)
+    if normalized is not None:
+        return normalized
+    normalized = _strip_titles(schema or {})
+    normalized["type"] = "object"
+    properties = normalized.setdefault("properties", {})
+    if "required" in normalized:
+        normalized["required"] = [name for name in normalized["required"] if name in properties]
+        if not normalized["required"]:
+            del normalized["required"]
+    _normalized_cache[key] = normalized
+    return normalized
+
+
+def openai_tool(tool, name: Optional[str] = None, description: Optional[str] = None) -> dict:
+    """OpenAI 兼容接口（Qwen/ollama）的工具格式"""
+    return {
+        "type": "function",
+        "function": {
+            "name": name or tool.name,
+            "description": description if description is not None else (tool.description or ""),
+            "parameters": normalize_schema(tool.inputSchema)
+        }
+    }
+
+
+def anthropic_tool(tool, name: Optional[str] = None, description: Optional[str] = None) -> dict:
+    """Anthropic 的工具格式"""
+    return {
+        "name": name or tool.name,
+        "description": description if description is not None else (tool.description or ""),
+        "input_schema": normalize_schema(tool.inputSchema)
+    }
+
+
+class ToolArgumentError(ValueError):
+    """模型给出的工具参数不符合 schema"""
+
+    def __init__(self, tool_name: str, errors: List[str]):
+        self.tool_name = tool_name
+        self.errors = errors
+        super().__init__(f"工具 {tool_name} 的参数不合法: " + "；".join(errors))
+
+
+class ArgumentValidator:
+    """
+    由 JSON Schema 编译出的参数校验器。
+    编译时把 schema 展开成嵌套的检查函数（正则预编译、$ref 预解析），校验时不再解释 schema。
+    支持 type、enum、const、required、properties、additionalProperties、items、
+    min/max 系列、pattern、anyOf/oneOf/allOf 和本地 $ref；其它关键字忽略（宽松处理）。
+    """
+
+    def __init__(self, schema: dict):
+        self._root = schema
+        self._refs: Dict[str, Callable] = {}
+        self._check = self._compile(schema)
+
+    def __call__(self, value) -> List[str]:
+        """返回错误列表，为空表示通过"""
+        errors: List[str] = []
+        self._check(value, "参数", errors)
+        return errors
+
+    def _resolve_ref(self, ref: str) -> Callable:
+        if ref in self._refs:
+            return self._refs[ref]
+        if not ref.startswith("#/"):
+            # 外部引用无法校验，直接放行
+            return lambda value, path, errors: None
+        target = self._root
+        for part in ref[2:].split("/"):
+            target = target.get(part.replace("~1", "/").replace("~0", "~"), {})
+        # 先放一个占位，支持递归引用
+        holder: List[Callable] = []
+        self._refs[ref] = lambda value, path, errors: holder[0](value, path, errors)
+        holder.append(self._compile(target))
+        return self._refs[ref]
+
+    def _compile(self, schema) -> Callable[[Any, str, List[str]], None]:
+        if not isinstance(schema, dict) or not schema:
+            return lambda value, path, errors: None
+        checks: List[Callable[[Any, str, List[str]], None]] = []
+
+        if "$ref" in schema:
+            checks.append(self._resolve_ref(schema["$ref"]))
+
+        if "type" in schema:
+            types = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+            allowed = tuple(t for name in types for t in _JSON_TYPES.get(name, ()))
+            integer_only = "integer" in types and "number" not in types
+            expected = "/".join(types)
+
+            def check_type(value, path, errors):
+                # bool 是 int 的子类，需要单独排除
+                if isinstance(value, bool) and "boolean" not in types:
+                    errors.append(f"{path} 应为 {expected}，实际为 boolean")
+                elif not isinstance(value, allowed):
+                    if integer_only and isinstance(value, float) and value.is_integer():
+                        return
+                    errors.append(f"{path} 应为 {expected}，实际为 {type(value).__name__}")
+
+            if allowed:
+                checks.append(check_type)
+
+        if "enum" in schema:
+            options = schema["enum"]
+
+            def check_enum(value, path, errors):
+                if value not in options:
+                    errors.append(f"{path} 应为 {options} 之一，实际为 {value!r}")
+
+            checks.append(check_enum)
+
+        if "const" in schema:
+            const = schema["const"]
+
+            def check_const(value, path, errors):
+                if value != const:
+                    errors.append(f"{path} 应为 {const!r}")
+
+            checks.append(check_const)
+
+        if isinstance(schema.get("pattern"), str):
+            pattern = re.compile(schema["pattern"])
+
+            def check_pattern(value, path, errors):
+                if isinstance(value, str) and not pattern.search(value):
+                    errors.append(f"{path} 不匹配 {pattern.pattern}")
+
+            checks.append(check_pattern)
+
+        for keyword, compare, message in (("minimum", lambda v, b: v < b, "不能小于"),
+                                          ("maximum", lambda v, b: v > b, "不能大于"),
+                                          ("exclusiveMinimum", lambda v, b: v <= b, "必须大于"),
+                                          ("exclusiveMaximum", lambda v, b: v >= b, "必须小于")):
+            if isinstance(schema.get(keyword), (int, float)) and not isinstance(schema.get(keyword), bool):
+                bound = schema[keyword]
+
+                def check_bound(value, path, errors, bound=bound, compare=compare, message=message):
+                    if isinstance(value, (int, float)) and not isinstance(value, bool) and compare(value, bound):
+                        errors.append(f"{path} {message} {bound}")
+
+                checks.append(check_bound)
+
+        for keyword, kinds, compare, message in (("minLength", str, lambda n, b: n < b, "长度不能小于"),
+                                                 ("maxLength", str, lambda n, b: n > b, "长度不能大于"),
+                                                 ("minItems", (list, tuple), lambda n, b: n < b, "元素数不能小于"),
+                                                 ("maxItems", (list, tuple), lambda n, b: n > b, "元素数不能大于")):
+            if isinstance(schema.get(keyword), int):
+                bound = schema[keyword]
+
+                def check_size(value, path, errors, bound=bound, kinds=kinds, compare=compare, message=message):
+                    if isinstance(value, kinds) and compare(len(value), bound):
+                        errors.append(f"{path} {message} {bound}")
+
+                checks.append(check_size)
+
+        properties = schema.get("properties")
+        required = schema.get("required") or []
+        additional = schema.get("additionalProperties", True)
+        if isinstance(properties, dict) or required or additional is not True:
+            property_checks = {name: self._compile(sub) for name, sub in (properties or {}).items()}
+            additional_check = self._compile(additional) if isinstance(additional, dict) else None
+
+            def check_object(value, path, errors):
+                if not isinstance(value, dict):
+                    return
+                for name in required:
+                    if name not in value:
+                        errors.append(f"缺少必填参数 {path}.{name}" if path != "参数" else f"缺少必填参数 {name}")
+                for name, item in value.items():
+                    item_path = name if path == "参数" else f"{path}.{name}"
+                    check = property_checks.get(name)
+                    if check is not None:
+                        check(item, item_path, errors)
+                    elif additional is False:
+                        errors.append(f"不支持的参数 {item_path}")
+                    elif additional_check is not None:
+                        additional_check(item, item_path, errors)
+
+            checks.append(check_object)
+
+        if isinstance(schema.get("items"), dict):
+            item_check = self._compile(schema["items"])
+
+            def check_items(value, path, errors):
+                if isinstance(value, (list, tuple)):
+                    for i, item in enumerate(value):
+                        item_check(item, f"{path}[{i}]", errors)
+
+            checks.append(check_items)
+
+        for keyword in ("anyOf", "oneOf"):
+            if isinstance(schema.get(keyword), list):
+                branches = [self._compile(sub) for sub in schema[keyword]]
+
+                def check_any(value, path, errors, branches=branches):
+                    for branch in branches:
+                        branch_errors: List[str] = []
+                        branch(value, path, branch_errors)
+                        if not branch_errors:
+                            return
+                    errors.append(f"{path} 不符合任何一种可选格式")
+
+                checks.append(check_any)
+
+        if isinstance(schema.get("allOf"), list):
+            checks.extend(self._compile(sub) for sub in schema["allOf"])
+
+        if len(checks) == 1:
+            return checks[0]
+
+        def check_all(value, path, errors):
+            for check in checks:
+                check(value, path, errors)
+
+        return check_all
+
+
+def compile_validator(schema: Optional[dict]) -> ArgumentValidator:
+    """按 schema 哈希缓存编译好的校验器"""
+    key = schema_hash(schema)
+    validator = _validator_cache.get(key)
+    if validator is None:
+        validator = _validator_cache[key] = ArgumentValidator(normalize_schema(schema))
+    return validator
+
+
+def validate_arguments(tool_name: str, schema: Optional[dict], tool_args) -> dict:
+    """
+    校验模型给出的工具参数，不合法时抛出 ToolArgumentError，避免把错误请求发到服务器
+    :param tool_name: 工具名，用于错误信息
+    :param schema: tool.inputSchema
+    :param tool_args: 参数，dict 或 JSON 字符串
+    :return: 解析后的参数 dict
+    """
+    if isinstance(tool_args, str):
+        try:
+            tool_args = json.loads(tool_args) if tool_args.strip() else {}
+        except ValueError as e:
+            raise ToolArgumentError(tool_name, [f"参数不是合法的 JSON: {str(e)}"])
+    if not isinstance(tool_args, dict):
+        raise ToolArgumentError(tool_name, [f"参数应为 JSON 对象，实际为 {type(tool_args).__name__}"])
+    errors = compile_validator(schema)(tool_args)
+    if errors:
+        raise ToolArgumentError(tool_name, errors)
+    return tool_args
@@ -0,0 +1,392 @@
+# encoding=utf-8
+# created @2025/5/18
+# created by zhanzq
+#
+# 多进程部署 FastMCP 的 SSE 服务：启动 N 个工作进程，由前端调度器统一监听一个端口。
+#   python servers/launcher.py servers/weather_server.py --workers 4 --port 8000
+#
+# SSE 会话必须固定在创建它的进程上，因此不使用 SO_REUSEPORT（内核按连接随机分配，POST 消息会落到别的进程）：
+#   - 每个工作进程的消息路径带上自己的前缀 /w{i}/messages/（通过 --message-path 参数设置），
+#     客户端从 endpoint 事件拿到的地址天然指向该进程，调度器按前缀转发即可；
+#   - 新的 GET /sse 连接分配给当前 SSE 连接数最少的健康进程。
+# 健康检查: GET /health（全部进程）、GET /w{i}/health（单个进程）。
+# 发送 SIGHUP 时逐个滚动重启工作进程：先停止分配新会话，等已有会话结束（或超时）后再重启。
+#
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import signal
+import sys
+import time
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+_WORKER_PATH = re.compile(r"^/w(\d+)/")
+
+
+async def read_head(reader: asyncio.StreamReader):
+    """读取一个 HTTP 报文头，返回 (起始行, {小写头名: 值}, 原始字节)，连接关闭时返回 None"""
+    try:
+        raw = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None
+    lines = raw.decode("latin-1").split("\r\n")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+    return lines[0], headers, raw
+
+
+async def relay_body(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, headers: dict,
+                     until_close: bool = False):
+    """按 Content-Length 或 chunked 编码转发报文体；两者都没有时，until_close 为 True 则转发到连接关闭"""
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        while True:
+            size_line = await reader.readuntil(b"\r\n")
+            size = int(size_line.split(b";", 1)[0], 16)
+            # 数据块加结尾的 \r\n；最后一个 0 长度块后面是可选的 trailer 和空行
+            data = await reader.readexactly(size + 2) if size else await reader.readuntil(b"\r\n")
+            writer.write(size_line + data)
+            await writer.drain()
+            if size == 0:
+                return
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining > 0:
+            data = await reader.read(min(remaining, 65536))
+            if not data:
+                raise ConnectionResetError("连接在报文体结束前关闭")
+            writer.write(data)
+            remaining -= len(data)
+        await writer.drain()
+    elif until_close:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            writer.write(data)
+            await writer.drain()
+
+
+class _NullWriter:
+    """丢弃写入的数据，用于读掉无法转发的请求体"""
+
+    def write(self, data):
+        pass
+
+    async def drain(self):
+        pass
+
+
+def json_response(status: str, payload: dict) -> bytes:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return (f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n").encode("latin-1") + body
+
+
+class Worker:
+    """一个 FastMCP 工作进程"""
+
+    def __init__(self, index: int, script: str, port: int, host: str = "127.0.0.1"):
+        self.index = index
+        self.script = script
+        self.host = host
+        self.port = port
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.streams = 0
+        self.requests = 0
+        self.restarts = 0
+        self.started_at = 0.0
+        self.draining = False
+        self.healthy = False
+
+    @property
+    def prefix(self) -> str:
+        return f"/w{self.index}"
+
+    async def start(self, ready_timeout: float = 30.0):
+        message_path = f"{self.prefix}/messages/"
+        # 新版 mcp 不再读取 FASTMCP_* 环境变量，监听地址和消息路径以命令行参数传给服务脚本，环境变量保留给旧版本
+        env = dict(os.environ,
+                   FASTMCP_HOST=self.host,
+                   FASTMCP_PORT=str(self.port),
+                   FASTMCP_MESSAGE_PATH=message_path)
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, self.script, "--host", self.host, "--port", str(self.port), "--message-path", message_path,
+            env=env)
+        self.started_at = time.time()
+        deadline = time.monotonic() + ready_timeout
+        while not await self.probe():
+            if self.proc.returncode is not None:
+                raise RuntimeError(f"工作进程 {self.index} 启动失败，退出码 {self.proc.returncode}")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"工作进程 {self.index} 在 {ready_timeout}s 内未就绪")
+            await asyncio.sleep(0.2)
+        logger.info(f"工作进程 {self.index} 已就绪: pid={self.proc.pid} port={self.port}")
+
+    async def probe(self) -> bool:
+        """进程存活且端口可以连接"""
+        if self.proc is None or self.proc.returncode is not None:
+            self.healthy = False
+            return False
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), timeout=2)
+            writer.close()
+            self.healthy = True
+        except (OSError, asyncio.TimeoutError):
+            self.healthy = False
+        return self.healthy
+
+    async def stop(self, timeout: float = 10.0):
+        self.healthy = False
+        if self.proc is None or self.proc.returncode is not None:
+            return
+        self.proc.terminate()
+        try:
+            await asyncio.wait_for(self.proc.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"工作进程 {self.index} 未在 {timeout}s 内退出，强制结束")
+            self.proc.kill()
+            await self.proc.wait()
+
+    def status(self) -> dict:
+        return {
+            "worker": self.index,
+            "pid": self.proc.pid if self.proc else None,
+            "port": self.port,
+            "healthy": self.healthy,
+            "draining": self.draining,
+            "streams": self.streams,
+            "requests": self.requests,
+            "restarts": self.restarts,
+            "uptime": round(time.time() - self.started_at, 1) if self.healthy else 0,
+        }
+
+
+class Dispatcher:
+    """前端调度器：监听对外端口，把请求转发到工作进程"""
+
+    def __init__(self, script: str, workers: int = 4, host: str = "0.0.0.0", port: int = 8000,
+                 base_port: Optional[int] = None, sse_path: str = "/sse", drain_timeout: float = 30.0,
+                 health_interval: float = 2.0):
+        """
+        :param script: FastMCP 服务脚本路径
+        :param workers: 工作进程数
+        :param host: 对外监听地址
+        :param port: 对外监听端口
+        :param base_port: 工作进程的起始端口，默认 port + 1
+        :param sse_path: 建立 SSE 连接的路径，与服务的 sse_path 设置一致
+        :param drain_timeout: 重启时等待已有会话结束的最长时间（秒）
+        :param health_interval: 健康检查间隔（秒）
+        """
+        base_port = base_port or port + 1
+        self.workers: List[Worker] = [Worker(i, script, base_port + i) for i in range(workers)]
+        self.host = host
+        self.port = port
+        self.sse_path = sse_path
+        self.drain_timeout = drain_timeout
+        self.health_interval = health_interval
+        self._server = None
+        self._monitor = None
+        self._restarting = False
+        self._stopping = asyncio.Event()
+
+    def pick_worker(self, path: str) -> Optional[Worker]:
+        match = _WORKER_PATH.match(path)
+        if match:
+            index = int(match.group(1))
+            return self.workers[index] if index < len(self.workers) else None
+        candidates = [w for w in self.workers if w.healthy and not w.draining]
+        return min(candidates, key=lambda w: (w.streams, w.requests)) if candidates else None
+
+    def health(self, path: str) -> Optional[bytes]:
+        """/health 与 /w{i}/health 由调度器直接应答"""
+        if path == "/health":
+            statuses = [w.status() for w in self.workers]
+            ok = any(s["healthy"] for s in statuses)
+            return json_response("200 OK" if ok else "503 Service Unavailable",
+                                 {"healthy": ok, "workers": statuses})
+        match = _WORKER_PATH.match(path)
+        if match and path == f"/w{match.group(1)}/health":
+            index = int(match.group(1))
+            if index >= len(self.workers):
+                return json_response("404 Not Found", {"error": f"no worker {index}"})
+            status = self.workers[index].status()
+            return json_response("200 OK" if status["healthy"] else "503 Service Unavailable", status)
+        return None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # 同一个客户端连接上的请求可能属于不同进程，为每个进程各保留一条上游连接
+        upstreams = {}
+        try:
+            while True:
+                head = await read_head(reader)
+                if head is None:
+                    break
+                request_line, headers, raw = head
+                method, target, _ = request_line.split(" ", 2)
+                path = target.split("?", 1)[0]
+
+                response = self.health(path) if method == "GET" else None
+                if response is not None:
+                    writer.write(response)
+                    await writer.drain()
+                    continue
+
+                worker = self.pick_worker(path)
+                if worker is None or not worker.healthy:
+                    await relay_body(reader, _NullWriter(), headers)
+                    writer.write(json_response("503 Service Unavailable", {"error": "no healthy worker"}))
+                    await writer.drain()
+                    continue
+
+                upstream = upstreams.get(worker.index)
+                if upstream is None or upstream[1].is_closing():
+                    upstream = upstreams[worker.index] = await asyncio.open_connection(worker.host, worker.port)
+                up_reader, up_writer = upstream
+
+                worker.requests += 1
+                is_stream = method == "GET" and path == self.sse_path
+                if is_stream:
+                    worker.streams += 1
+                try:
+                    up_writer.write(raw)
+                    await relay_body(reader, up_writer, headers)
+                    await up_writer.drain()
+                    keep_alive = await self._relay_response(up_reader, writer, reader, is_stream)
+                finally:
+                    if is_stream:
+                        worker.streams -= 1
+                if not keep_alive or headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for _, up_writer in upstreams.values():
+                up_writer.close()
+            writer.close()
+
+    async def _relay_response(self, up_reader, writer, client_reader, is_stream: bool) -> bool:
+        """转发一个响应，返回连接是否可以继续复用"""
+        head = await read_head(up_reader)
+        if head is None:
+            raise ConnectionResetError("工作进程关闭了连接")
+        _, headers, raw = head
+        writer.write(raw)
+        await writer.drain()
+        framed = "content-length" in headers or "chunked" in headers.get("transfer-encoding", "").lower()
+        if not is_stream:
+            await relay_body(up_reader, writer, headers, until_close=True)
+            return framed and headers.get("connection", "").lower() != "close"
+
+        # SSE 长连接：客户端断开时要立即关闭上游，工作进程才能及时清理会话
+        relay = asyncio.ensure_future(relay_body(up_reader, writer, headers, until_close=True))
+        disconnect = asyncio.ensure_future(client_reader.read(1))
+        try:
+            await asyncio.wait({relay, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (relay, disconnect):
+                task.cancel()
+        return False
+
+    async def _monitor_workers(self):
+        while not self._stopping.is_set():
+            for worker in self.workers:
+                if not await worker.probe() and not self._restarting and worker.proc.returncode is not None:
+                    logger.error(f"工作进程 {worker.index} 已退出（退出码 {worker.proc.returncode}），正在重启")
+                    await self._restart_worker(worker, drain=False)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.health_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _restart_worker(self, worker: Worker, drain: bool = True):
+        worker.draining = True
+        try:
+            if drain:
+                deadline = time.monotonic() + self.drain_timeout
+                while worker.streams and time.monotonic() < deadline:
+                    await asyncio.sleep(0.5)
+                if worker.streams:
+                    logger.warning(f"工作进程 {worker.index} 仍有 {worker.streams} 个会话，超时后强制重启")
+            await worker.stop()
+            await worker.start()
+            worker.restarts += 1
+        except Exception as e:
+            logger.error(f"重启工作进程 {worker.index} 失败: {str(e)}")
+        finally:
+            worker.draining = False
+
+    async def rolling_restart(self):
+        """逐个重启工作进程，其余进程继续服务"""
+        if self._restarting:
+            logger.info("滚动重启已在进行中")
+            return
+        self._restarting = True
+        try:
+            logger.info("开始滚动重启")
+            for worker in self.workers:
+                await self._restart_worker(worker)
+            logger.info("滚动重启完成")
+        finally:
+            self._restarting = False
+
+    async def start(self):
+        await asyncio.gather(*(worker.start() for worker in self.workers))
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self._monitor = asyncio.create_task(self._monitor_workers())
+        loop = asyncio.get_running_loop()
+        if hasattr(signal, "SIGHUP"):
+            loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self.rolling_restart()))
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._stopping.set)
+        logger.info(f"调度器已启动: http://{self.host}:{self.port}{self.sse_path}，工作进程 {len(self.workers)} 个")
+        return self
+
+    async def serve_forever(self):
+        await self._stopping.wait()
+        await self.shutdown()
+
+    async def shutdown(self):
+        """停止接受新连接，等待已有会话结束（或超时）后关闭所有工作进程"""
+        self._stopping.set()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for worker in self.workers:
+            worker.draining = True
+        deadline = time.monotonic() + self.drain_timeout
+        while any(w.streams for w in self.workers) and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+        if self._monitor is not None:
+            await self._monitor
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="多进程运行 FastMCP SSE 服务")
+    parser.add_argument("script", help="FastMCP 服务脚本路径，如 servers/weather_server.py")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="工作进程数，默认等于 CPU 核数")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--base-port", type=int, default=None, help="工作进程的起始端口，默认 port + 1")
+    parser.add_argument("--sse-path", default="/sse")
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="重启和退出时等待会话结束的时间（秒）")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    dispatcher = Dispatcher(args.script, workers=args.workers, host=args.host, port=args.port,
+                            base_port=args.base_port, sse_path=args.sse_path, drain_timeout=args.drain_timeout)
+    await dispatcher.start()
+    await dispatcher.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
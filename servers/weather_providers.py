@@ -0,0 +1,273 @@
+# encoding=utf-8
+# created @2025/5/17
+# created by zhanzq
+#
+# 天气数据源。工具处理函数只依赖 WeatherProvider 接口：
+#   SQLiteWeatherProvider  本地数据集（默认，离线可用，首次使用时由 data/weather_normals.csv 生成），
+#                          只有各城市的月平均气候，不是逐日预报
+#   HTTPWeatherProvider    远程天气接口，复用连接池
+#   CachedWeatherProvider  包装任意数据源，按 (城市, 日期) 缓存结果并合并相同的并发请求
+#
+
+import asyncio
+import csv
+import datetime
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_CSV_PATH = os.path.join(DATA_DIR, "weather_normals.csv")
+DEFAULT_DB_PATH = os.path.join(DATA_DIR, "weather.db")
+
+_RELATIVE_DAYS = {"前天": -2, "昨天": -1, "今天": 0, "今日": 0, "明天": 1, "明日": 1, "后天": 2, "大后天": 3}
+_MONTH_DAY_PATTERN = re.compile(r"^(?:(\d{4})年)?(\d{1,2})月(\d{1,2})[日号]?$")
+
+
+def resolve_date(date: str, today: Optional[datetime.date] = None) -> datetime.date:
+    """
+    把 '今天'、'明天'、'2025-05-20'、'5月20日' 等写法解析为具体日期
+    :param date: 日期描述
+    :param today: 基准日期，默认为当天
+    :return: datetime.date
+    """
+    today = today or datetime.date.today()
+    date = (date or "今天").strip()
+    if date in _RELATIVE_DAYS:
+        return today + datetime.timedelta(days=_RELATIVE_DAYS[date])
+    match = _MONTH_DAY_PATTERN.match(date)
+    if match:
+        year, month, day = match.groups()
+        return datetime.date(int(year or today.year), int(month), int(day))
+    try:
+        return datetime.date.fromisoformat(date.replace("/", "-"))
+    except ValueError:
+        raise ValueError(f"无法识别的日期: {date}")
+
+
+def normalize_city(city: str) -> str:
+    """去掉首尾空白和行政区划后缀，英文城市名统一首字母大写"""
+    city = city.strip()
+    if city.isascii():
+        return " ".join(part.capitalize() for part in city.split())
+    return re.sub(r"(市|特别行政区)$", "", city)
+
+
+class CityNotFound(LookupError):
+    """数据源中没有该城市的数据"""
+
+
+class WeatherProvider:
+    """天气数据源接口"""
+
+    name = "base"
+
+    async def fetch(self, city: str, date: datetime.date) -> dict:
+        """
+        查询天气
+        :param city: 归一化后的城市名
+        :param date: 日期
+        :return: {"city", "date", "condition", "temp_low", "temp_high", "monthly_normal"}，
+            monthly_normal 为 True 时是该月的气候平均值，而不是当天的预报
+        :raises CityNotFound: 没有该城市的数据
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+def build_database(csv_path: str = DEFAULT_CSV_PATH, db_path: str = DEFAULT_DB_PATH):
+    """由 CSV 数据集生成 SQLite 数据库"""
+    tmp_path = f"{db_path}.{os.getpid()}.tmp"
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("CREATE TABLE weather (city TEXT NOT NULL, month INTEGER NOT NULL, temp_low INTEGER, "
+                     "temp_high INTEGER, condition TEXT, PRIMARY KEY (city, month))")
+        with open(csv_path, encoding="utf-8") as f:
+            rows = [(normalize_city(row["city"]), int(row["month"]), int(row["temp_low"]), int(row["temp_high"]),
+                     row["condition"]) for row in csv.DictReader(f)]
+        conn.executemany("INSERT OR REPLACE INTO weather VALUES (?, ?, ?, ?, ?)", rows)
+        conn.commit()
+    finally:
+        conn.close()
+    # 先写临时文件再改名，多个进程同时启动时不会读到不完整的数据库
+    os.replace(tmp_path, db_path)
+    logger.info(f"已由 {csv_path} 生成天气数据库 {db_path}，共 {len(rows)} 条记录")
+
+
+class SQLiteWeatherProvider(WeatherProvider):
+    """
+    本地 SQLite 数据集，按城市和月份给出气候平均值。
+    查询在线程池中执行，每个线程持有自己的只读连接，不阻塞事件循环。
+    """
+
+    name = "sqlite"
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, csv_path: str = DEFAULT_CSV_PATH):
+        """
+        :param db_path: 数据库路径，不存在时由 csv_path 生成
+        :param csv_path: CSV 数据集路径
+        """
+        if not os.path.exists(db_path):
+            build_database(csv_path, db_path)
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def _query(self, city: str, month: int):
+        return self._connection().execute(
+            "SELECT temp_low, temp_high, condition FROM weather WHERE city = ? AND month = ?", (city, month)
+        ).fetchone()
+
+    async def fetch(self, city: str, date: datetime.date) -> dict:
+        row = await asyncio.to_thread(self._query, city, date.month)
+        if row is None:
+            raise CityNotFound(f"没有城市 {city} 的天气数据")
+        temp_low, temp_high, condition = row
+        return {"city": city, "date": date.isoformat(), "condition": condition,
+                "temp_low": temp_low, "temp_high": temp_high, "monthly_normal": True}
+
+
+class HTTPWeatherProvider(WeatherProvider):
+    """
+    远程天气接口：GET {url}?city=..&date=YYYY-MM-DD[&key=..]，返回包含 condition、temp_low、temp_high 的 JSON。
+    所有请求共用一个带连接池的 httpx.AsyncClient。
+    """
+
+    name = "http"
+
+    def __init__(self, url: str, api_key: Optional[str] = None, timeout: float = 10.0,
+                 max_connections: int = 100, max_keepalive: int = 20):
+        """
+        :param url: 接口地址
+        :param api_key: 接口密钥，作为 key 参数传递
+        :param timeout: 单次请求超时（秒）
+        :param max_connections: 连接池最大连接数
+        :param max_keepalive: 保持的空闲连接数
+        """
+        import httpx
+
+        self.url = url
+        self.api_key = api_key
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+        )
+
+    async def fetch(self, city: str, date: datetime.date) -> dict:
+        params = {"city": city, "date": date.isoformat()}
+        if self.api_key:
+            params["key"] = self.api_key
+        response = await self.client.get(self.url, params=params)
+        response.raise_for_status()
+        data = response.json()
+        return {"city": city, "date": date.isoformat(), "condition": data["condition"],
+                "temp_low": data["temp_low"], "temp_high": data["temp_high"], "monthly_normal": False}
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class CachedWeatherProvider(WeatherProvider):
+    """
+    按 (城市, 日期) 缓存查询结果，按 LRU 淘汰；相同键的并发查询只会请求一次底层数据源
+    """
+
+    def __init__(self, provider: WeatherProvider, ttl: float = 600, max_entries: int = 4096):
+        """
+        :param provider: 底层数据源
+        :param ttl: 结果缓存时间（秒）
+        :param max_entries: 最多缓存的条数
+        """
+        self.provider = provider
+        self.name = f"cached-{provider.name}"
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        # (城市, 日期) -> (过期时间, 结果)
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._inflight = {}
+
+    async def fetch(self, city: str, date: datetime.date) -> dict:
+        key = (city, date)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] >= time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        task = asyncio.ensure_future(self.provider.fetch(city, date))
+        self._inflight[key] = task
+
+        def done(finished: asyncio.Future):
+            self._inflight.pop(key, None)
+            if finished.cancelled() or finished.exception() is not None:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, finished.result())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        task.add_done_callback(done)
+        # shield：某个客户端断开时，其它等待同一结果的请求不受影响
+        return await asyncio.shield(task)
+
+    async def close(self):
+        await self.provider.close()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+
+def create_provider_from_env() -> WeatherProvider:
+    """
+    根据环境变量创建数据源：
+        WEATHER_PROVIDER  sqlite（默认）或 http
+        WEATHER_DB        SQLite 数据库路径
+        WEATHER_API_URL   http 数据源的接口地址
+        WEATHER_API_KEY   http 数据源的密钥
+        WEATHER_CACHE_TTL 结果缓存时间（秒），为 0 时不缓存，默认 600
+    :return: WeatherProvider
+    """
+    kind = os.environ.get("WEATHER_PROVIDER", "sqlite")
+    if kind == "sqlite":
+        provider = SQLiteWeatherProvider(os.environ.get("WEATHER_DB", DEFAULT_DB_PATH))
+    elif kind == "http":
+        url = os.environ.get("WEATHER_API_URL")
+        if not url:
+            raise ValueError("WEATHER_PROVIDER=http 时需要设置 WEATHER_API_URL")
+        provider = HTTPWeatherProvider(url, api_key=os.environ.get("WEATHER_API_KEY"))
+    else:
+        raise ValueError(f"未知的天气数据源: {kind}")
+    ttl = float(os.environ.get("WEATHER_CACHE_TTL", 600))
+    if ttl > 0:
+        provider = CachedWeatherProvider(provider, ttl=ttl)
+    return provider
@@ -3,25 +3,63 @@
 # created by zhanzq
 #
 
+import argparse
+import os
+import sys
+
 from mcp.server.fastmcp import FastMCP
 
-mcp = FastMCP("weather")
+from weather_providers import CityNotFound, create_provider_from_env, normalize_city, resolve_date
+
+
+def server_settings(argv=None) -> dict:
+    """
+    HTTP 传输的监听地址和消息路径：命令行参数优先，其次是 FASTMCP_HOST/FASTMCP_PORT/FASTMCP_MESSAGE_PATH。
+    新版 mcp 的 FastMCP 构造函数会显式传入默认值、不再读取这些环境变量，因此这里解析后显式传给 FastMCP
+    :param argv: 命令行参数，为 None 时不解析命令行
+    :return: dict
+    """
+    parser = argparse.ArgumentParser(description="天气 MCP 服务")
+    parser.add_argument("--host", default=os.environ.get("FASTMCP_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("FASTMCP_PORT", "8000")))
+    parser.add_argument("--message-path", default=os.environ.get("FASTMCP_MESSAGE_PATH", "/messages/"))
+    args, _ = parser.parse_known_args(argv or [])
+    return {"host": args.host, "port": args.port, "message_path": args.message_path}
+
+
+# 作为模块导入时不解析导入方的命令行
+mcp = FastMCP("weather", **server_settings(sys.argv[1:] if __name__ == "__main__" else None))
+
+# 数据源在所有会话间共享：连接池、结果缓存和并发请求合并都按进程生效
+provider = create_provider_from_env()
 
 
 @mcp.tool()
-def get_weather(city: str, date: str = "今天") -> str:
-    """获取指定地点的天气预报。
+async def get_weather(city: str, date: str = "今天") -> str:
+    """获取指定地点的天气。默认的本地数据源只有各城市每月的气候平均值（不是逐日预报），
+    同一个月内不同日期的结果相同；没有该城市的数据时返回说明文字。
     参数：
-        city (str): 城市名，如 'New York'。
+        city (str): 城市名，如 '北京' 或 'New York'。
         date (str): 日期，如 '今天' 或 '明天'。
     返回：
         str: 天气信息。
     """
-    # todo: 实现天气查询逻辑
-    return f"{city}{date}的天气：温度 25°C，晴朗"
+    city_name = normalize_city(city)
+    day = resolve_date(date)
+    try:
+        weather = await provider.fetch(city_name, day)
+    except CityNotFound:
+        return f"暂无{city}的天气数据"
+    if weather.get("monthly_normal"):
+        return (f"{city}{day.month}月的气候平均值（不是{date}的预报）：温度 {weather['temp_low']}~{weather['temp_high']}°C，"
+                f"{weather['condition']}")
+    return f"{city}{date}的天气：温度 {weather['temp_low']}~{weather['temp_high']}°C，{weather['condition']}"
 
 
 if __name__ == "__main__":
-    print(mcp.settings)
-    # mcp.run(transport="stdio")
-    mcp.run(transport="sse")
+    # 传输方式：stdio、sse（默认）或 streamable-http；客户端以 stdio 或 launch 方式启动时通过 MCP_TRANSPORT 指定
+    transport = os.environ.get("MCP_TRANSPORT", "sse")
+    if transport != "stdio":
+        # stdio 模式下标准输出是协议通道，不能打印
+        print(mcp.settings)
+    mcp.run(transport=transport)
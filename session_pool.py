@@ -0,0 +1,203 @@
+# encoding=utf-8
+# created @2025/5/12
+# created by zhanzq
+#
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from mcp.shared.exceptions import McpError
+
+from connections import ServerConnection
+from process_pool import open_connection
+
+logger = logging.getLogger(__name__)
+
+
+class PooledSession:
+    def __init__(self, connection: ServerConnection):
+        self.connection = connection
+        self.in_flight = 0
+        self.last_used = time.monotonic()
+        self.broken = False
+
+    @property
+    def usable(self) -> bool:
+        return not self.broken and self.connection.is_alive
+
+
+class SessionPool:
+    """
+    同一个MCP服务器的会话池。
+    保持若干个已初始化的会话，把并发请求分散到多条流上；每个会话的在途请求数有上限，
+    负载高时扩容，空闲时缩容，断开的会话会被回收并在需要时补充。
+    """
+
+    def __init__(self, server_config: dict, min_size: int = 2, max_size: int = 8,
+                 max_in_flight: int = 8, idle_timeout: float = 60.0):
+        """
+        :param server_config: 服务器配置字典，格式同 ServerConnection
+        :param min_size: 最少保持的会话数
+        :param max_size: 最多会话数
+        :param max_in_flight: 每个会话同时进行的请求数上限
+        :param idle_timeout: 超过 min_size 的会话空闲多久后关闭（秒）
+        """
+        self.server_config = server_config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_in_flight = max_in_flight
+        self.idle_timeout = idle_timeout
+        self.sessions: List[PooledSession] = []
+        self.created = 0
+        self.recycled = 0
+        self.waits = 0
+        self._pending = 0
+        self._last_error: Optional[BaseException] = None
+        self._condition = asyncio.Condition()
+        self._maintain_task: Optional[asyncio.Task] = None
+        self._background = set()
+        self._closed = False
+
+    async def start(self):
+        """并发建立 min_size 个会话，并启动后台维护任务"""
+        self._pending += self.min_size
+        results = await asyncio.gather(*(self._open() for _ in range(self.min_size)), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if len(errors) == len(results):
+            raise errors[0]
+        self._maintain_task = asyncio.create_task(self._maintain())
+        return self
+
+    async def _open(self) -> PooledSession:
+        # 调用方负责事先把 _pending 加一，这样在连接建立期间不会重复扩容
+        try:
+            # 断开的会话由池回收并补充，不需要连接自己重连
+            config = dict(self.server_config, id=f"{self.server_config['id']}#{self.created}", reconnect=False)
+            self.created += 1
+            # stdio 服务器配置了 warm_pool 时，新会话直接使用预热好的进程
+            connection = await open_connection(config)
+        finally:
+            self._pending -= 1
+        pooled = PooledSession(connection)
+        async with self._condition:
+            self.sessions.append(pooled)
+            self._condition.notify_all()
+        return pooled
+
+    def _grow_in_background(self):
+        async def grow():
+            try:
+                await self._open()
+            except Exception as e:
+                logger.warning(f"会话池扩容失败: {str(e)}")
+                self._last_error = e
+                async with self._condition:
+                    self._condition.notify_all()
+
+        self._pending += 1
+        task = asyncio.create_task(grow())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _pick(self) -> Optional[PooledSession]:
+        candidates = [s for s in self.sessions if s.usable and s.in_flight < self.max_in_flight]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda s: s.in_flight)
+
+    @asynccontextmanager
+    async def acquire(self):
+        """
+        取出一个负载最低的会话，用完自动归还
+        :return: ClientSession
+        """
+        grown = False
+        async with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("会话池已关闭")
+                pooled = self._pick()
+                if pooled is not None:
+                    break
+                if grown and not self.sessions and not self._pending and self._last_error is not None:
+                    # 池里没有会话，扩容也失败了，不再无限等待
+                    raise self._last_error
+                # 所有会话都已满载：允许的话扩容，然后等待有会话可用
+                if len(self.sessions) + self._pending < self.max_size:
+                    self._grow_in_background()
+                    grown = True
+                self.waits += 1
+                await self._condition.wait()
+            pooled.in_flight += 1
+        try:
+            yield pooled.connection.session
+        except (McpError, asyncio.TimeoutError):
+            # 服务端返回的业务错误或调用方超时，会话本身是好的
+            raise
+        except Exception:
+            pooled.broken = True
+            raise
+        finally:
+            pooled.in_flight -= 1
+            pooled.last_used = time.monotonic()
+            async with self._condition:
+                self._condition.notify_all()
+            if pooled.broken or not pooled.connection.is_alive:
+                await self._recycle(pooled)
+
+    async def call_tool(self, tool_name: str, tool_args: dict):
+        async with self.acquire() as session:
+            return await session.call_tool(tool_name, tool_args)
+
+    async def _recycle(self, pooled: PooledSession):
+        async with self._condition:
+            if pooled not in self.sessions:
+                return
+            self.sessions.remove(pooled)
+        self.recycled += 1
+        logger.info(f"回收断开的会话 {pooled.connection.server_id}")
+        await pooled.connection.close()
+        if not self._closed and len(self.sessions) + self._pending < self.min_size:
+            self._grow_in_background()
+
+    async def _maintain(self):
+        """定期回收断开的会话，关闭多余的空闲会话，保持最少会话数"""
+        interval = max(1.0, self.idle_timeout / 2)
+        while not self._closed:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for pooled in list(self.sessions):
+                if not pooled.usable and pooled.in_flight == 0:
+                    await self._recycle(pooled)
+            idle = [s for s in self.sessions if s.in_flight == 0 and now - s.last_used > self.idle_timeout]
+            for pooled in idle[:max(0, len(self.sessions) - self.min_size)]:
+                async with self._condition:
+                    if pooled.in_flight or pooled not in self.sessions:
+                        continue
+                    self.sessions.remove(pooled)
+                logger.info(f"关闭空闲会话 {pooled.connection.server_id}")
+                await pooled.connection.close()
+            for _ in range(self.min_size - len(self.sessions) - self._pending):
+                self._grow_in_background()
+
+    async def close(self):
+        self._closed = True
+        if self._maintain_task is not None:
+            self._maintain_task.cancel()
+        async with self._condition:
+            sessions, self.sessions = self.sessions, []
+            self._condition.notify_all()
+        await asyncio.gather(*(pooled.connection.close() for pooled in sessions))
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.sessions),
+            "pending": self._pending,
+            "in_flight": sum(s.in_flight for s in self.sessions),
+            "created": self.created,
+            "recycled": self.recycled,
+            "waits": self.waits,
+        }
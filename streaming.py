@@ -0,0 +1,165 @@
+# encoding=utf-8
+# created @2025/5/14
+# created by zhanzq
+#
+
+import json
+import logging
+import time
+from typing import List, Optional
+
+from history import message_tokens
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class OpenAIStream:
+    """
+    OpenAI 兼容接口（Qwen/ollama）的流式补全。
+    迭代时逐个产出文本增量，同时把分片到达的 tool_calls 按 index 拼接完整；迭代结束后可读取
+    content、tool_calls、finish_reason，以及首 token 耗时 ttft。
+    """
+
+    def __init__(self, llm, span_name: str = "llm.completion", **kwargs):
+        """
+        :param llm: AsyncOpenAI 客户端
+        :param span_name: 追踪时使用的阶段名，如 llm.initial、llm.followup
+        :param kwargs: 传给 chat.completions.create 的参数，stream 会被强制设为 True
+        """
+        self.llm = llm
+        self.span_name = span_name
+        self.kwargs = kwargs
+        self.content = ""
+        self.tool_calls: List[dict] = []
+        self.finish_reason: Optional[str] = None
+        self.ttft: Optional[float] = None
+        self.elapsed: Optional[float] = None
+
+    async def __aiter__(self):
+        with tracer.span(self.span_name, model=self.kwargs.get("model")) as span:
+            start = time.perf_counter()
+            parts = []
+            calls = {}
+            stream = await self.llm.chat.completions.create(stream=True, **self.kwargs)
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                delta = choice.delta
+                if self.ttft is None and (delta.content or delta.tool_calls):
+                    self.ttft = time.perf_counter() - start
+                if delta.content:
+                    parts.append(delta.content)
+                    yield delta.content
+                for tool_call in delta.tool_calls or []:
+                    call = calls.setdefault(tool_call.index, {
+                        "id": None,
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""}
+                    })
+                    if tool_call.id:
+                        call["id"] = tool_call.id
+                    if tool_call.function is not None:
+                        if tool_call.function.name:
+                            call["function"]["name"] += tool_call.function.name
+                        if tool_call.function.arguments:
+                            call["function"]["arguments"] += tool_call.function.arguments
+                if choice.finish_reason:
+                    self.finish_reason = choice.finish_reason
+            self.content = "".join(parts)
+            self.tool_calls = [calls[index] for index in sorted(calls)]
+            if self.tool_calls and self.finish_reason != "tool_calls":
+                # 部分服务（如 ollama）返回工具调用时 finish_reason 仍为 stop
+                self.finish_reason = "tool_calls"
+            self.elapsed = time.perf_counter() - start
+            log_timing(self.kwargs.get("model"), self.ttft, self.elapsed)
+            if span.recording:
+                span.set(**request_stats(self.kwargs), ttft_ms=(self.ttft or 0) * 1000,
+                         output_chars=len(self.content), tool_calls=len(self.tool_calls))
+
+
+class AnthropicStream:
+    """
+    Anthropic 的流式补全。
+    迭代时逐个产出文本增量，同时根据 content_block_* 事件拼接完整的内容块（tool_use 的 input 由
+    input_json_delta 分片拼出）；迭代结束后可读取 content_blocks、stop_reason 和 ttft。
+    """
+
+    def __init__(self, anthropic, span_name: str = "llm.completion", **kwargs):
+        """
+        :param anthropic: AsyncAnthropic 客户端
+        :param span_name: 追踪时使用的阶段名，如 llm.initial、llm.followup
+        :param kwargs: 传给 messages.create 的参数，stream 会被强制设为 True
+        """
+        self.anthropic = anthropic
+        self.span_name = span_name
+        self.kwargs = kwargs
+        self.content_blocks: List[dict] = []
+        self.stop_reason: Optional[str] = None
+        self.ttft: Optional[float] = None
+        self.elapsed: Optional[float] = None
+
+    @property
+    def tool_uses(self) -> List[dict]:
+        return [block for block in self.content_blocks if block["type"] == "tool_use"]
+
+    @property
+    def text(self) -> str:
+        return "".join(block["text"] for block in self.content_blocks if block["type"] == "text")
+
+    async def __aiter__(self):
+        with tracer.span(self.span_name, model=self.kwargs.get("model")) as span:
+            start = time.perf_counter()
+            blocks = {}
+            partial_json = {}
+            stream = await self.anthropic.messages.create(stream=True, **self.kwargs)
+            async for event in stream:
+                if event.type == "content_block_start":
+                    block = event.content_block
+                    if block.type == "tool_use":
+                        blocks[event.index] = {"type": "tool_use", "id": block.id, "name": block.name, "input": {}}
+                        partial_json[event.index] = []
+                    else:
+                        blocks[event.index] = {"type": "text", "text": getattr(block, "text", "")}
+                elif event.type == "content_block_delta":
+                    if self.ttft is None:
+                        self.ttft = time.perf_counter() - start
+                    delta = event.delta
+                    if delta.type == "text_delta":
+                        blocks[event.index]["text"] += delta.text
+                        yield delta.text
+                    elif delta.type == "input_json_delta":
+                        partial_json[event.index].append(delta.partial_json)
+                elif event.type == "content_block_stop":
+                    if event.index in partial_json:
+                        raw = "".join(partial_json.pop(event.index))
+                        blocks[event.index]["input"] = json.loads(raw) if raw else {}
+                elif event.type == "message_delta":
+                    self.stop_reason = event.delta.stop_reason
+            self.content_blocks = [blocks[index] for index in sorted(blocks)]
+            self.elapsed = time.perf_counter() - start
+            log_timing(self.kwargs.get("model"), self.ttft, self.elapsed)
+            if span.recording:
+                span.set(**request_stats(self.kwargs), ttft_ms=(self.ttft or 0) * 1000,
+                         output_chars=len(self.text), tool_calls=len(self.tool_uses))
+
+
+def request_stats(kwargs: dict) -> dict:
+    """请求的估算 token 数和负载大小，只在开启追踪时计算"""
+    messages = kwargs.get("messages") or []
+    tools = kwargs.get("tools") or []
+    return {
+        "prompt_tokens": sum(message_tokens(message) for message in messages),
+        "messages": len(messages),
+        "tools": len(tools),
+        "payload_bytes": len(json.dumps({"messages": messages, "tools": tools}, ensure_ascii=False,
+                                        default=str).encode("utf-8")),
+    }
+
+
+def log_timing(model: Optional[str], ttft: Optional[float], elapsed: float):
+    if ttft is None:
+        logger.info(f"[{model}] 流式响应无内容，总耗时 {elapsed * 1000:.0f}ms")
+    else:
+        logger.info(f"[{model}] 首token耗时 {ttft * 1000:.0f}ms，总耗时 {elapsed * 1000:.0f}ms")
@@ -0,0 +1,123 @@
+# encoding=utf-8
+# created @2025/5/8
+# created by zhanzq
+#
+
+import asyncio
+import functools
+import json
+import logging
+import time
+from typing import Callable, List, Optional, Tuple
+
+from mcp import ClientSession
+
+from postprocess import PostProcessorRegistry, default_registry
+from resilience import ServerGuard
+from result_cache import ToolResultCache
+from schema_convert import validate_arguments
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# 单个工具调用的默认超时时间（秒）
+DEFAULT_TOOL_TIMEOUT = 30.0
+
+
+class ToolCallError(RuntimeError):
+    """工具执行了但返回了错误（CallToolResult.isError 为 True）"""
+
+
+async def call_tool(session: ClientSession, tool_name: str, tool_args, timeout: Optional[float] = None,
+                    server_id: str = "", cache: Optional[ToolResultCache] = None,
+                    schema: Optional[dict] = None, guard: Optional[ServerGuard] = None,
+                    idempotent: bool = False, postprocess: Optional[PostProcessorRegistry] = None) -> str:
+    """
+    带超时地调用一个工具，并解析返回结果
+    :param session: 工具所在服务器的会话
+    :param tool_name: 工具在服务器上的原始名称
+    :param tool_args: 工具参数，dict 或 JSON 字符串
+    :param timeout: 超时时间（秒），为 None 时使用 guard 的超时，没有 guard 时使用 DEFAULT_TOOL_TIMEOUT
+    :param server_id: 服务器标识，用作结果缓存键的一部分
+    :param cache: 工具结果缓存，为 None 时不缓存
+    :param schema: 工具的 inputSchema，提供时先在本地校验参数，不合法时抛出 ToolArgumentError
+    :param guard: 服务器的调用保护，提供时由它负责每次尝试的超时、重试和熔断
+    :param idempotent: 工具是否幂等，只有幂等工具会重试
+    :param postprocess: 结果后处理注册表，默认使用 postprocess.default_registry
+    :return: str
+    :raises ToolCallError: 工具返回了错误结果
+    """
+    if schema is not None:
+        tool_args = validate_arguments(tool_name, schema, tool_args)
+    elif isinstance(tool_args, str):
+        tool_args = json.loads(tool_args) if tool_args.strip() else {}
+    with tracer.span("call_tool", tool=tool_name, server=server_id) as span:
+        fetch = functools.partial(session.call_tool, tool_name, tool_args)
+        if guard is not None:
+            fetch = functools.partial(guard.call, fetch, tool_name=tool_name, idempotent=idempotent, timeout=timeout)
+
+        if cache is not None:
+            call = cache.get_or_call(server_id, tool_name, tool_args, fetch)
+        else:
+            call = fetch()
+        result = await (call if guard is not None else asyncio.wait_for(call, timeout=timeout or DEFAULT_TOOL_TIMEOUT))
+        text = result.content[0].text if result.content else ""
+        is_error = bool(getattr(result, "isError", False))
+        if span.recording:
+            span.set(args_bytes=len(json.dumps(tool_args, ensure_ascii=False).encode("utf-8")),
+                     result_bytes=len(text.encode("utf-8")), is_error=is_error)
+    if is_error:
+        # 例如天气服务的 "无法识别的日期"：作为失败返回给模型，不打印成功调用的日志
+        raise ToolCallError(text or f"工具 {tool_name} 返回了错误")
+    logger.info(f"[Calling tool {tool_name} with args {tool_args}]")
+    with tracer.span("parse_tool_result", tool=tool_name):
+        return (postprocess or default_registry).process(server_id, tool_name, text)
+
+
+async def execute_tool_calls(tool_calls: List[Tuple[str, str, object]],
+                             resolve: Callable[[str], Tuple[str, ClientSession, str]],
+                             timeout: Optional[float] = None,
+                             cache: Optional[ToolResultCache] = None,
+                             schema_of: Optional[Callable[[str], Optional[dict]]] = None,
+                             guard_of: Optional[Callable[[str], Tuple[ServerGuard, bool]]] = None,
+                             postprocess: Optional[PostProcessorRegistry] = None) -> List[dict]:
+    """
+    并发执行同一轮模型回复中的所有工具调用，可跨多个服务器
+    :param tool_calls: [(tool_call_id, 暴露给模型的工具名, 参数), ...]
+    :param resolve: 根据暴露给模型的工具名返回 (服务器标识, 会话, 原始工具名)
+    :param timeout: 每个调用各自的超时时间（秒），为 None 时使用服务器调用保护的超时
+    :param cache: 工具结果缓存，为 None 时不缓存
+    :param schema_of: 根据暴露给模型的工具名返回 inputSchema，用于在本地校验参数
+    :param guard_of: 根据暴露给模型的工具名返回 (服务器的调用保护, 是否幂等)
+    :param postprocess: 结果后处理注册表
+    :return: 与 tool_calls 顺序一致的结果列表，每项包含 id、name、args、content、elapsed、error
+    """
+
+    async def run_one(call_id: str, name: str, args) -> dict:
+        start = time.perf_counter()
+        error = None
+        guard, idempotent = None, False
+        try:
+            server_id, session, tool_name = resolve(name)
+            schema = schema_of(name) if schema_of is not None else None
+            if guard_of is not None:
+                guard, idempotent = guard_of(name)
+            content = await call_tool(session, tool_name, args, timeout=timeout, server_id=server_id, cache=cache,
+                                      schema=schema, guard=guard, idempotent=idempotent, postprocess=postprocess)
+        except asyncio.TimeoutError:
+            error = f"工具调用超时（{timeout or (guard.timeout if guard is not None else DEFAULT_TOOL_TIMEOUT)}s）"
+        except Exception as e:
+            error = str(e)
+        if error is not None:
+            content = f"Error: {error}"
+            logger.error(f"[Error calling tool {name}: {error}]")
+        return {
+            "id": call_id,
+            "name": name,
+            "args": args,
+            "content": content,
+            "elapsed": time.perf_counter() - start,
+            "error": error,
+        }
+
+    return await asyncio.gather(*(run_one(*call) for call in tool_calls))
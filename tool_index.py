@@ -0,0 +1,171 @@
+# encoding=utf-8
+# created @2025/5/25
+# created by zhanzq
+#
+# 本地工具检索：按工具名、描述和参数说明建立索引，每次提问只把最相关的 top-k 个工具发给模型。
+# 默认使用 BM25（中文按单字和相邻双字切分，英文按单词切分）；也可以传入向量化函数改用余弦相似度。
+# 索引按服务器分组，某个服务器的工具目录变化时只重建该服务器的部分。
+#
+
+import asyncio
+import math
+import re
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+_ASCII_WORD = re.compile(r"[a-z0-9]+")
+_CJK_RUN = re.compile(r"[㐀-鿿]+")
+_CAMEL = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+
+# texts -> 向量列表，可以是普通函数（在线程池中执行）或协程函数
+Vectors = Sequence[Sequence[float]]
+EmbedFunction = Callable[[List[str]], Union[Vectors, Awaitable[Vectors]]]
+
+
+def tokenize(text: str) -> List[str]:
+    """英文按单词（拆开驼峰和下划线），中文按单字加相邻双字"""
+    text = _CAMEL.sub(" ", text or "").lower()
+    tokens = _ASCII_WORD.findall(text)
+    for run in _CJK_RUN.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def tool_text(tool) -> str:
+    """用于检索的工具文本：名称、描述和各参数的名称与说明"""
+    parts = [tool.name, tool.description or ""]
+    properties = (tool.inputSchema or {}).get("properties") or {}
+    for name, prop in properties.items():
+        parts.append(name)
+        if isinstance(prop, dict) and prop.get("description"):
+            parts.append(prop["description"])
+    return " ".join(parts)
+
+
+class ToolIndex:
+    """
+    工具检索索引。文档以暴露给模型的工具名为键，按服务器分组增量更新：
+    BM25 的倒排表、文档频率和平均长度在更新时增减，不需要整体重建。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, embed: Optional[EmbedFunction] = None):
+        """
+        :param k1: BM25 词频饱和参数
+        :param b: BM25 长度归一化参数
+        :param embed: 向量化函数，提供时改用余弦相似度排序
+        """
+        self.k1 = k1
+        self.b = b
+        self.embed = embed
+        self.rebuilds = 0
+        # 服务器ID -> 该服务器的文档名列表
+        self._server_docs: Dict[str, List[str]] = {}
+        # 文档名 -> 词频
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_length: Dict[str, int] = {}
+        # 词 -> {文档名: 词频}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+        # 文档名 -> 归一化后的向量
+        self._vectors: Dict[str, List[float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def remove_server(self, server_id: str):
+        for name in self._server_docs.pop(server_id, []):
+            terms = self._doc_terms.pop(name)
+            self._total_length -= self._doc_length.pop(name)
+            for term in terms:
+                postings = self._postings[term]
+                del postings[name]
+                if not postings:
+                    del self._postings[term]
+            self._vectors.pop(name, None)
+
+    async def embed_texts(self, texts: List[str]) -> Vectors:
+        """在事件循环之外计算向量：协程函数直接等待，普通函数放到线程池中执行"""
+        if asyncio.iscoroutinefunction(self.embed):
+            return await self.embed(texts)
+        return await asyncio.to_thread(self.embed, texts)
+
+    def update_server(self, server_id: str, entries: List[Tuple[str, object]], vectors: Optional[Vectors] = None):
+        """
+        替换某个服务器的全部工具
+        :param server_id: 服务器标识
+        :param entries: [(暴露给模型的工具名, mcp.types.Tool), ...]
+        :param vectors: 与 entries 一一对应的向量，为 None 且设置了 embed 时同步计算（异步场景用 aupdate_server）
+        """
+        texts = [tool_text(tool) for _, tool in entries]
+        if self.embed is not None and vectors is None and texts:
+            vectors = self.embed(texts)
+        self.remove_server(server_id)
+        names = []
+        for i, (name, tool) in enumerate(entries):
+            if name in self._doc_terms:
+                # 同名工具只保留先加入的，与 Agent 的工具名解析一致
+                continue
+            text = texts[i]
+            terms = Counter(tokenize(text))
+            length = sum(terms.values())
+            self._doc_terms[name] = terms
+            self._doc_length[name] = length
+            self._total_length += length
+            for term, count in terms.items():
+                self._postings.setdefault(term, {})[name] = count
+            names.append(name)
+            if vectors is not None:
+                self._vectors[name] = _normalize(vectors[i])
+        self._server_docs[server_id] = names
+        self.rebuilds += 1
+
+    async def aupdate_server(self, server_id: str, entries: List[Tuple[str, object]]):
+        """update_server 的异步版本，向量在事件循环之外计算"""
+        vectors = None
+        if self.embed is not None and entries:
+            vectors = await self.embed_texts([tool_text(tool) for _, tool in entries])
+        self.update_server(server_id, entries, vectors)
+
+    def scores(self, query: str, query_vector: Optional[Sequence[float]] = None) -> Dict[str, float]:
+        """
+        query 与各工具的相关度，只返回大于 0 的项
+        :param query: 用户的问题
+        :param query_vector: 已计算好的问题向量，为 None 且设置了 embed 时同步计算
+        """
+        if self.embed is not None:
+            query_vector = _normalize(query_vector if query_vector is not None else self.embed([query])[0])
+            return {name: score for name, vector in self._vectors.items()
+                    if (score := sum(a * b for a, b in zip(query_vector, vector))) > 0}
+
+        count = len(self._doc_terms)
+        if not count:
+            return {}
+        average_length = self._total_length / count
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for name, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._doc_length[name] / average_length)
+                scores[name] = scores.get(name, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, k: int, query_vector: Optional[Sequence[float]] = None) -> List[str]:
+        """
+        返回最相关的至多 k 个工具名，按相关度降序；没有任何工具相关时返回空列表
+        """
+        scores = self.scores(query, query_vector)
+        return sorted(scores, key=lambda name: (-scores[name], name))[:k]
+
+    async def asearch(self, query: str, k: int) -> List[str]:
+        """search 的异步版本，问题向量在事件循环之外计算"""
+        query_vector = (await self.embed_texts([query]))[0] if self.embed is not None else None
+        return self.search(query, k, query_vector)
+
+
+def _normalize(vector: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
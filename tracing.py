@@ -0,0 +1,239 @@
+# encoding=utf-8
+# created @2025/5/16
+# created by zhanzq
+#
+# 查询链路各阶段的耗时追踪。默认关闭，关闭时 tracer.span() 只返回一个共享的空对象。
+# 通过环境变量开启，多个导出器用逗号分隔：
+#   MCP_TRACE=jsonl:traces.jsonl,histogram,otlp:otlp_traces.jsonl
+#
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+from metrics import LatencyRecorder
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "duration", "attrs", "error",
+                 "_start", "_token", "_tracer")
+    recording = True
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: dict):
+        parent = _current_span.get()
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attrs = attrs
+        self.error = None
+        self.duration = 0.0
+        self._tracer = tracer
+
+    def set(self, **attrs):
+        """补充属性，如 token 数、负载大小"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # 在异步生成器中跨上下文结束时无法还原，忽略即可
+            pass
+        self._tracer.export(self)
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "duration_ms": self.duration * 1000,
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """追踪关闭时使用的空 span，不分配任何对象"""
+    recording = False
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class JsonLinesExporter:
+    """每个 span 一行 JSON"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class HistogramExporter:
+    """在内存中按 span 名称统计耗时分布，退出时输出汇总表"""
+
+    def __init__(self):
+        self.recorders = {}
+
+    def export(self, span: Span):
+        recorder = self.recorders.get(span.name)
+        if recorder is None:
+            recorder = self.recorders[span.name] = LatencyRecorder()
+        recorder.record(span.duration)
+
+    def report(self) -> str:
+        header = f"{'stage':<24}{'count':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}"
+        lines = [header, "-" * len(header)]
+        for name in sorted(self.recorders):
+            s = self.recorders[name].summary()
+            lines.append(f"{name:<24}{s['count']:>8}" + "".join(
+                f"{s[key] * 1000:>10.1f}" for key in ("mean", "p50", "p90", "p99", "max")))
+        return "\n".join(lines)
+
+    def close(self):
+        if self.recorders:
+            logger.info("各阶段耗时(ms):\n" + self.report())
+
+
+class OTLPJsonExporter:
+    """
+    以 OpenTelemetry OTLP/JSON 格式（每行一个 ExportTraceServiceRequest）输出，
+    可以直接被 otel-collector 的 file receiver 或 Jaeger 等工具导入
+    """
+
+    def __init__(self, path: str, service_name: str = "mcp-client"):
+        self.path = path
+        self.service_name = service_name
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _attribute(key: str, value) -> dict:
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def export(self, span: Span):
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 3,  # SPAN_KIND_CLIENT
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.start_ns + int(span.duration * 1e9)),
+            "attributes": [self._attribute(k, v) for k, v in span.attrs.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        request = {"resourceSpans": [{
+            "resource": {"attributes": [self._attribute("service.name", self.service_name)]},
+            "scopeSpans": [{"scope": {"name": "mcp_project.tracing"}, "spans": [otlp_span]}],
+        }]}
+        line = json.dumps(request, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class Tracer:
+    def __init__(self, exporters: Optional[List] = None):
+        self.exporters = list(exporters or [])
+        self.enabled = bool(self.exporters)
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+        self.enabled = True
+
+    def span(self, name: str, **attrs):
+        """
+        创建一个 span，用法: with tracer.span("call_tool", tool=name) as span: ...
+        :param name: 阶段名
+        :param attrs: 初始属性
+        :return: Span，追踪关闭时返回共享的空 span
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attrs)
+
+    def export(self, span: Span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logger.warning(f"导出 span 失败: {str(e)}")
+
+    def shutdown(self):
+        for exporter in self.exporters:
+            exporter.close()
+        self.exporters = []
+        self.enabled = False
+
+
+# 全局 tracer，各模块共用
+tracer = Tracer()
+
+
+def configure_from_env(env_var: str = "MCP_TRACE") -> Tracer:
+    """
+    根据环境变量配置全局 tracer，例如 MCP_TRACE=jsonl:traces.jsonl,histogram,otlp:otlp.jsonl
+    :param env_var: 环境变量名
+    :return: Tracer
+    """
+    spec = os.environ.get(env_var, "").strip()
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        kind, _, arg = item.partition(":")
+        if kind == "jsonl":
+            tracer.add_exporter(JsonLinesExporter(arg or "traces.jsonl"))
+        elif kind == "histogram":
+            tracer.add_exporter(HistogramExporter())
+        elif kind == "otlp":
+            tracer.add_exporter(OTLPJsonExporter(arg or "otlp_traces.jsonl"))
+        else:
+            logger.warning(f"未知的追踪导出器: {item}")
+    return tracer